@@ -0,0 +1,492 @@
+from simulator.traj_generator import *
+from simulator.person_anonymized import *
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import time
+import numpy as np
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+
+class BenchmarkConfig(DayPlannerConfig):
+    """Keep event summaries and pattern gists in memory so a benchmark leaves no files behind."""
+    EVENT_REGISTRY_PATH = None
+    PATTERN_GIST_STORE_PATH = None
+
+
+class CountingPlanner(DayPlanner):
+    """DayPlanner that counts the days that ended in the fallback plan."""
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.fallbacks = 0
+
+    def _use_fallback_plan(self, person, date, test_route, world_interaction):
+        self.fallbacks += 1
+        super()._use_fallback_plan(person, date, test_route, world_interaction)
+
+
+def synthetic_person(index, seed, train_days, test_days):
+    """A user with a handful of favourite POIs visited on most days, like the preprocessed data."""
+    rng = random.Random(f"{seed}/{index}")
+    categories = sorted(get_valid_locations())
+    favourites = [f"{rng.choice(categories)} #{rng.randint(1, 40)}" for _ in range(rng.randint(3, 10))]
+    start = date(2020, 4, 7) - timedelta(days=train_days)
+
+    def day(d):
+        times = sorted(rng.sample(range(6 * 6, 23 * 6), rng.randint(1, 5)))
+        visits = [f"{rng.choice(favourites)} at {t // 6:02d}:{t % 6 * 10:02d}:00" for t in times]
+        return f"Activities at {d.isoformat()}: " + ', '.join(visits) + '.'
+
+    P = Person(f"user_{index}")
+    P.train_routine_list = [day(start + timedelta(days=i)) for i in range(train_days)]
+    P.test_routine_list = [day(date(2020, 4, 7) + timedelta(days=i)) for i in range(test_days)]
+    return P
+
+
+async def plan_all_async(planner, make_person, num_users, concurrency):
+    """Plan users with `concurrency` workers, building each person only when a worker picks it up."""
+    indices = iter(range(num_users))
+
+    async def worker():
+        for index in indices:
+            await planner.plan_new_day_async(make_person(index))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def bench_planner(args):
+    backend = StubBackend(latency=args.latency, latency_mean=args.latency_mean, failure_rate=args.failure_rate,
+                          malformed_rate=args.malformed_rate, reflection_pass_rate=args.reflection_pass_rate,
+                          seed=args.seed, defect_rate=args.defect_rate)
+    set_llm_backend(backend)
+    configure_llm_client(max_retries=args.max_retries)
+    config = BenchmarkConfig()
+    config.GENERATION_CANDIDATES = args.candidates
+    config.REPAIR_PLANS = args.repair
+    if args.response_format:
+        config.STAGE_SETTINGS = {stage: {"response_format": args.response_format} for stage in RESPONSE_SCHEMAS}
+    planner = CountingPlanner(config)
+    if args.trace:
+        if os.path.exists(args.trace):
+            os.remove(args.trace)
+        configure_tracing(args.trace)
+    test_dates = [(date(2020, 4, 7) + timedelta(days=i)).isoformat() for i in range(args.test_days)]
+
+    def make_person(index):
+        return synthetic_person(index, args.seed, args.train_days, args.test_days)
+
+    # Person creation and retries print a line each, which would dominate the timing
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+        planner.prepare_events(test_dates)
+        if args.concurrency > 1:
+            asyncio.run(plan_all_async(planner, make_person, args.users, args.concurrency))
+        else:
+            for index in range(args.users):
+                planner.plan_new_day(make_person(index))
+    elapsed = time.perf_counter() - start
+    get_tracer().close()
+
+    user_days = args.users * args.test_days
+    print(f"{args.users} users x {args.test_days} days in {elapsed:.2f}s "
+          f"({args.users / elapsed:.1f} users/s, {user_days / elapsed:.1f} user-days/s)")
+    print(f"{backend.calls} backend calls ({backend.calls / user_days:.2f} per user-day), "
+          f"{planner.fallbacks} fallback days ({planner.fallbacks / user_days:.1%})")
+    if args.trace:
+        print_trace_summary(summarize_traces(args.trace))
+
+
+def bench_history(args):
+    """Prompt sizes of the history-heavy prompts with the full history and with compaction."""
+    config = DayPlannerConfig()
+    date_ = "2020-04-07"
+    day_type = f"Today is {check_workday_or_weekend(date_)}."
+    print(f"{'days':>6}{'budget':>8}{'generation tok':>16}{'pattern tok':>13}{'compact ms':>12}")
+    for days in args.days:
+        P = synthetic_person(0, args.seed, days, 1)
+        recent = get_recent_routines(date_, P.train_routine_list)
+        long = get_long_routines(date_, P.train_routine_list)
+        for budget in [None] + args.budgets:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                long_slot = compact_routines(long, budget)
+                pattern_slot = compact_routines(P.train_routine_list, budget)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            generation = generate_prompt([long_slot, recent, "event", day_type], config.GENERATION_TEMPLATE)
+            pattern = generate_prompt([pattern_slot, recent], config.PATTERN_GIST_TEMPLATE)
+            print(f"{days:>6}{str(budget or 'full'):>8}{estimate_text_tokens(generation):>16}"
+                  f"{estimate_text_tokens(pattern):>13}{elapsed * 1000:>12.2f}")
+
+
+def _scan_routines(date_, routines, num_days=3):
+    """The recent and long routines the way they were found before RoutineList: strptime and sort per call."""
+    current_date = datetime.strptime(date_, "%Y-%m-%d")
+    routines_with_diff = []
+    for routine in routines:
+        days_diff = (current_date - datetime.strptime(routine.split(": ")[0].split(" ")[-1], "%Y-%m-%d")).days
+        if days_diff > 0:
+            routines_with_diff.append((routine, days_diff))
+    routines_with_diff.sort(key=lambda x: x[1])
+    return [route[0] for route in routines_with_diff[:num_days]], [route[0] for route in routines_with_diff[num_days:]]
+
+
+def bench_routines(args):
+    """Per-day recent/long routine lookups plus the append of the planned day, as plan_new_day does them."""
+    print(f"{'days':>6}{'scan ms/user-day':>18}{'index ms/user-day':>19}{'speed-up':>10}")
+    for days in args.days:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            persons = [synthetic_person(index, args.seed, days, args.test_days) for index in range(args.users)]
+        timings = []
+        for indexed in (False, True):
+            routine_ordinal.cache_clear()
+            start = time.perf_counter()
+            for P in persons:
+                routines = as_routine_list(P.train_routine_list) if indexed else list(P.train_routine_list)
+                for test_route in P.test_routine_list:
+                    date_ = test_route.split(": ")[0].split(" ")[-1]
+                    if indexed:
+                        recent, long = routines.recent(date_, 3), routines.older(date_, 3)
+                    else:
+                        recent, long = _scan_routines(date_, routines)
+                    routines.append(test_route)
+            timings.append((time.perf_counter() - start) * 1000 / (args.users * args.test_days))
+        print(f"{days:>6}{timings[0]:>18.3f}{timings[1]:>19.3f}{timings[0] / timings[1]:>9.1f}x")
+
+
+def _loop_grid_counts(points, grid_count=100, lon_range=(139.50, 139.90), lat_range=(35.50, 35.82)):
+    """Grid counts the way calc_sg_act_jsd binned visits before NumPy: one point at a time."""
+    grid_side = int(np.sqrt(grid_count))
+    counts = np.zeros(grid_count + 1, dtype=int)
+    for lon, lat in points:
+        if lon_range[0] <= lon <= lon_range[1] and lat_range[0] <= lat <= lat_range[1]:
+            gx = min(int((lon - lon_range[0]) / (lon_range[1] - lon_range[0]) * grid_side), grid_side - 1)
+            gy = min(int((lat - lat_range[0]) / (lat_range[1] - lat_range[0]) * grid_side), grid_side - 1)
+            counts[gy * grid_side + gx] += 1
+        else:
+            counts[grid_count] += 1
+    return counts
+
+
+def bench_metrics(args):
+    """Scalar vs vectorised one-step distances (SD) and grid binning (SGD) on synthetic visits."""
+    import evaluation
+    evaluator = evaluation.Evaluation({})
+    print(f"{'visits':>10}{'SD loop s':>11}{'SD numpy s':>12}{'max |diff| km':>15}"
+          f"{'SGD loop s':>12}{'SGD numpy s':>13}{'same counts':>13}")
+    for visits in args.visits:
+        rng = np.random.default_rng(args.seed)
+        lengths = rng.integers(2, 9, size=visits // 5)
+        points = np.column_stack([rng.uniform(139.45, 139.95, lengths.sum()), rng.uniform(35.45, 35.87, lengths.sum())])
+        trajs = [seq.tolist() for seq in np.split(points, np.cumsum(lengths)[:-1])]
+        flat = [point for traj in trajs for point in traj]
+
+        start = time.perf_counter()
+        loop_distances = [evaluator.geodistance(lnglat[0], lnglat[1], traj[index][0], traj[index][1])
+                          for traj in trajs for index, lnglat in enumerate(traj[1:])]
+        loop_sd = time.perf_counter() - start
+        start = time.perf_counter()
+        numpy_distances = evaluator.step_distances(trajs)
+        numpy_sd = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loop_counts = _loop_grid_counts(flat)
+        loop_sgd = time.perf_counter() - start
+        start = time.perf_counter()
+        numpy_counts = evaluator.grid_counts(flat)
+        numpy_sgd = time.perf_counter() - start
+
+        diff = float(np.max(np.abs(np.array(loop_distances) - numpy_distances)))
+        print(f"{len(flat):>10}{loop_sd:>11.3f}{numpy_sd:>12.3f}{diff:>15.3g}"
+              f"{loop_sgd:>12.3f}{numpy_sgd:>13.3f}{str(np.array_equal(loop_counts, numpy_counts)):>13}")
+
+
+def bench_bootstrap(args):
+    """Bootstrap CIs by re-evaluating resampled trajectory strings vs reweighting per-user histograms."""
+    import evaluation
+    rng = np.random.default_rng(args.seed)
+    categories = [name for name in evaluation.get_sub_to_top() if isinstance(name, str)][:200]
+    locations = [f"{category} #{poi}" for category in categories for poi in range(20)]
+    points = np.column_stack([rng.uniform(139.50, 139.90, len(locations)), rng.uniform(35.50, 35.82, len(locations))])
+    evaluator = evaluation.Evaluation(dict(zip(locations, map(tuple, points.tolist()))))
+
+    def days():
+        trajs = {}
+        for day in range(7, 14):
+            visits = sorted(rng.integers(6 * 3600, 23 * 3600, size=rng.integers(1, 7)))
+            names = rng.choice(locations, size=len(visits))
+            trajs[f"2020-04-{day:02d}"] = f"Activities at 2020-04-{day:02d}: " + ", ".join(
+                f"{name} at {seconds // 3600:02d}:{seconds // 60 % 60:02d}:00" for name, seconds in zip(names, visits))
+        return trajs
+
+    metrics = ("SI", "SD", "CD", "SGD")
+    print(f"{'users':>8}{'naive s/resample':>18}{'naive s total':>15}{'histograms s':>14}{'resamples s':>13}"
+          f"{'speed-up':>10}")
+    for num_users in args.users:
+        results = {user: {"results": days()} for user in range(num_users)}
+        reals = {user: {"reals": days()} for user in range(num_users)}
+
+        start = time.perf_counter()
+        for _ in range(args.naive_resamples):
+            picks = rng.integers(0, num_users, size=num_users)
+            fake = evaluator.parse_columns([traj for user in picks for traj in
+                                            evaluation.DataLoader.window_trajectories(results[user]["results"])])
+            real = evaluator.parse_columns([traj for user in picks for traj in
+                                            evaluation.DataLoader.window_trajectories(reals[user]["reals"])])
+            evaluator.histogram_jsds(evaluator.histograms(fake), evaluator.histograms(real))
+        naive = (time.perf_counter() - start) / args.naive_resamples
+
+        start = time.perf_counter()
+        users = list(results)
+        generated = evaluator.user_histograms(
+            *evaluation.DataLoader.user_trajectories(results, users, "results"), num_users)
+        real = evaluator.user_histograms(*evaluation.DataLoader.user_trajectories(reals, users, "reals"), num_users)
+        histograms = time.perf_counter() - start
+        start = time.perf_counter()
+        samples = evaluator.bootstrap_jsds(generated, real, args.resamples, args.seed)
+        resampling = time.perf_counter() - start
+        assert all(len(samples[name]) == args.resamples for name in metrics)
+        print(f"{num_users:>8}{naive:>18.3f}{naive * args.resamples:>15.1f}{histograms:>14.2f}{resampling:>13.2f}"
+              f"{naive * args.resamples / (histograms + resampling):>9.0f}x")
+
+
+_LOAD_LOCATIONS = """
+import sys, time, pickle
+import numpy as np
+from simulator.location_index import LocationIndex
+def rss():
+    fields = dict(line.split(':', 1) for line in open('/proc/self/status'))
+    return [int(fields[key].split()[0]) / 1024 for key in ('RssAnon', 'RssFile')]
+before = rss()
+start = time.perf_counter()
+if sys.argv[1].endswith('.locidx'):
+    locations = LocationIndex(sys.argv[1])
+    lnglat, found = locations.lookup(locations.keys())
+else:
+    # DataLoader.load_location_map, without importing evaluation and its own data
+    data = pickle.load(open(sys.argv[1], 'rb'))
+    locations = {name: (float(data[name][1][2]), float(data[name][1][3])) for name in data}
+    del data
+    points = [locations.get(name) for name in locations]
+elapsed = time.perf_counter() - start
+after = rss()
+print(elapsed, after[0] - before[0], after[1] - before[1])
+"""
+
+
+def bench_locations(args):
+    """Cold start and memory of the pickled location maps against their memory-mapped LocationIndex."""
+    import tempfile
+    import subprocess
+    from simulator.location_index import LocationIndex, convert_location_map
+    import evaluation
+    print(f"{'map':>28}{'format':>8}{'MB on disk':>12}{'load s':>9}{'RssAnon MB':>12}{'RssFile MB':>12}"
+          f"{'lookup s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pickle_path in args.maps:
+            index_path = convert_location_map(pickle_path, os.path.join(tmp, os.path.basename(pickle_path) + ".locidx"))
+            location_map, index = evaluation.DataLoader.load_location_map(pickle_path), LocationIndex(index_path)
+            names = list(location_map)
+            rng = random.Random(args.seed)
+            queries = [rng.choice(names) if rng.random() < 0.9 else "Unknown Place #%d" % i for i in range(args.lookups)]
+            # both into the coordinate array and mask Evaluation.parse_columns builds
+            start = time.perf_counter()
+            points = [location_map.get(name) for name in queries]
+            known = np.fromiter((point is not None for point in points), dtype=bool, count=len(points))
+            dict_lnglat = np.fromiter(chain.from_iterable(point or (np.nan, np.nan) for point in points), dtype=float,
+                                      count=2 * len(points)).reshape(-1, 2)
+            dict_lookup = time.perf_counter() - start
+            start = time.perf_counter()
+            lnglat, found = index.lookup(queries)
+            index_lookup = time.perf_counter() - start
+            assert np.array_equal(found, known) and np.array_equal(lnglat[found], dict_lnglat[known])
+            for path, lookup in ((pickle_path, dict_lookup), (index_path, index_lookup)):
+                runs = [subprocess.run([sys.executable, "-c", _LOAD_LOCATIONS, path], capture_output=True, text=True,
+                                       check=True, cwd=os.getcwd()).stdout.split() for _ in range(args.repeat)]
+                load, anon, file = (min(float(run[column]) for run in runs) for column in range(3))
+                print(f"{os.path.basename(pickle_path):>28}{os.path.splitext(path)[1]:>8}"
+                      f"{os.path.getsize(path) / 2 ** 20:>12.2f}{load:>9.3f}{anon:>12.1f}{file:>12.1f}{lookup:>10.3f}")
+
+
+_IMPORT_MODULE = """
+import sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=["_"])
+imported = time.perf_counter()
+if sys.argv[2]:
+    getattr(module, sys.argv[2])()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def bench_startup(args):
+    """Import time of the modules in fresh interpreters started outside the repository, then their first data access."""
+    import tempfile
+    import subprocess
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    print(f"{'module':>26}{'import ms':>11}{'first access':>22}{'access ms':>11}")
+    with tempfile.TemporaryDirectory() as cwd:
+        for module, accessor in (("const", ""), ("evaluation", "get_sub_to_top"),
+                                 ("simulator.traj_generator", "get_plan_validator")):
+            runs = [subprocess.run([sys.executable, "-c", _IMPORT_MODULE, module, accessor], cwd=cwd, env=env,
+                                   capture_output=True, text=True, check=True).stdout.split()
+                    for _ in range(args.repeat)]
+            imported, accessed = (sorted(float(run[column]) * 1000 for run in runs)[len(runs) // 2] for column in (0, 1))
+            print(f"{module:>26}{imported:>11.1f}{accessor + '()' if accessor else '':>22}{accessed:>11.1f}")
+
+
+def _loop_poi_labels(df):
+    """data/preprocess.py's get_poi_id_text_label as it was: one filter of the POI frame per sub category."""
+    df = df.copy()
+    poi_df = df[["poi_id", "sub_category"]].drop_duplicates()
+    poi_id_mapping = {}
+    for sub_cat in poi_df['sub_category'].unique():
+        sub_cat_pois = sorted(list(poi_df[poi_df['sub_category'] == sub_cat]['poi_id'].unique()))
+        poi_id_mapping.update(dict(zip(sub_cat_pois, [f"{sub_cat} #{i}" for i in range(len(sub_cat_pois))])))
+    df['poi_id'] = df['poi_id'].map(poi_id_mapping)
+    return df
+
+
+def _apply_trajectory_prompts(df):
+    """data/preprocess.py's generate_trajectory_prompts as it was: strftime per row and groupby.apply joins."""
+    df = df.copy().sort_values(by=['uid', 'time_interval'])
+    df['time_str'] = df['time_interval'].dt.strftime('%H:%M:%S')
+    df = df[df['poi_id'] != df.groupby(['uid', 'date'])['poi_id'].shift(1)]
+    df['event_str'] = df['poi_id'] + " at " + df['time_str']
+    df["uid"] = "user_" + df["uid"].astype(str)
+    daily_traj = df.groupby(['uid', 'date'])['event_str'].apply(lambda x: ', '.join(x)).reset_index()
+    daily_traj['prompt'] = "Activities at " + daily_traj['date'].astype(str) + ": " + daily_traj['event_str'] + "."
+    return daily_traj.groupby('uid')['prompt'].apply(list).to_dict()
+
+
+def synthetic_checkins(rows, seed, categories=800):
+    """A raw check-in frame like data/anonymized_*.csv: about 200 check-ins per user over a month, 50 per POI."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    pois = max(1, rows // 50)
+    names = np.array([f"Category {i}" for i in range(categories)], dtype=object)
+    poi_id = rng.integers(0, pois, rows)
+    sub_category = names[rng.integers(0, categories, pois)][poi_id]
+    # a few check-ins list their POI under another sub category, and a few have none
+    relabelled = rng.random(rows) < 0.001
+    sub_category[relabelled] = names[rng.integers(0, categories, int(relabelled.sum()))]
+    sub_category[rng.random(rows) < 0.001] = np.nan
+    df = pd.DataFrame({
+        "uid": rng.integers(0, max(1, rows // 200), rows),
+        "poi_id": poi_id,
+        "sub_category": sub_category,
+        "timestamp": pd.Timestamp("2020-04-01") + pd.to_timedelta(rng.integers(0, 30 * 86400, rows), unit="s"),
+    })
+    df["visit_order"] = df.groupby("uid")["timestamp"].rank(method="first").astype(np.int64)
+    return df
+
+
+def bench_preprocess(args):
+    """Old and vectorised POI relabelling and prompt building of data/preprocess.py on synthetic check-ins."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "preprocess", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "preprocess.py"))
+    preprocess = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(preprocess)
+    print(f"{'rows':>11}{'stage':>30}{'old s':>9}{'new s':>9}{'speed-up':>10}{'identical':>11}")
+    for rows in args.rows:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            df = preprocess.drop_duplicates_and_count(synthetic_checkins(rows, args.seed))
+        df = preprocess.keep_first_visit_per_interval(df)
+        stages = (("get_poi_id_text_label", _loop_poi_labels, preprocess.get_poi_id_text_label),
+                  ("generate_trajectory_prompts", _apply_trajectory_prompts, preprocess.generate_trajectory_prompts))
+        for name, old, new in stages:
+            timings, outputs = [], []
+            for function in (old, new):
+                start = time.perf_counter()
+                outputs.append(function(df))
+                timings.append(time.perf_counter() - start)
+            if name == "get_poi_id_text_label":
+                identical = outputs[0].equals(outputs[1])
+                df = outputs[1][['uid', 'poi_id', 'sub_category', 'date', 'time_interval']]
+            else:
+                identical = outputs[0] == outputs[1] and list(outputs[0]) == list(outputs[1])
+            print(f"{rows:>11}{name:>30}{timings[0]:>9.2f}{timings[1]:>9.2f}{timings[0] / timings[1]:>9.1f}x"
+                  f"{str(identical):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks that run without the live LLM endpoint.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    planner = commands.add_parser("planner", help="plan synthetic users against the local stub backend")
+    planner.add_argument("--users", type=int, default=1000)
+    planner.add_argument("--concurrency", type=int, default=100)
+    planner.add_argument("--train-days", type=int, default=60)
+    planner.add_argument("--test-days", type=int, default=7)
+    planner.add_argument("--latency", choices=["constant", "uniform", "exponential", "lognormal"],
+                         default="lognormal")
+    planner.add_argument("--latency-mean", type=float, default=0.0, help="mean seconds per stub call")
+    planner.add_argument("--failure-rate", type=float, default=0.0, help="share of calls raising a transient error")
+    planner.add_argument("--malformed-rate", type=float, default=0.0, help="share of JSON replies that are broken")
+    planner.add_argument("--defect-rate", type=float, default=0.0,
+                         help="share of plan items with a repairable defect (AM/PM, '#' spacing, case)")
+    planner.add_argument("--no-repair", dest="repair", action="store_false",
+                         help="reject defective plans instead of repairing them (REPAIR_PLANS = False)")
+    planner.add_argument("--reflection-pass-rate", type=float, default=0.8)
+    planner.add_argument("--response-format", choices=["json_object", "json_schema"], default=None,
+                         help="ask for JSON mode on the generation, replan and reflection stages")
+    planner.add_argument("--candidates", type=int, default=1, help="GENERATION_CANDIDATES of the planner")
+    planner.add_argument("--max-retries", type=int, default=8)
+    planner.add_argument("--seed", type=int, default=0)
+    planner.add_argument("--trace", default=None, help="also trace every stage call to this JSONL file")
+    planner.add_argument("--verbose", dest="quiet", action="store_false", help="keep the planner's own output")
+    planner.set_defaults(func=bench_planner)
+
+    history = commands.add_parser("history", help="compare full and compacted history prompts")
+    history.add_argument("--days", type=int, nargs="+", default=[60, 180, 365, 730])
+    history.add_argument("--budgets", type=int, nargs="+", default=[1000, 2000, 4000])
+    history.add_argument("--repeat", type=int, default=20)
+    history.add_argument("--seed", type=int, default=0)
+    history.set_defaults(func=bench_history)
+
+    routines = commands.add_parser("routines", help="time the per-day recent/long routine lookups")
+    routines.add_argument("--days", type=int, nargs="+", default=[60, 180, 365, 730])
+    routines.add_argument("--users", type=int, default=200)
+    routines.add_argument("--test-days", type=int, default=7)
+    routines.add_argument("--seed", type=int, default=0)
+    routines.set_defaults(func=bench_routines)
+
+    metrics = commands.add_parser("metrics", help="time the scalar and vectorised SD/SGD computations")
+    metrics.add_argument("--visits", type=int, nargs="+", default=[100000, 1000000])
+    metrics.add_argument("--seed", type=int, default=0)
+    metrics.set_defaults(func=bench_metrics)
+
+    bootstrap = commands.add_parser("bootstrap", help="time naive and histogram-level bootstrap CIs of the metrics")
+    bootstrap.add_argument("--users", type=int, nargs="+", default=[1000, 10000])
+    bootstrap.add_argument("--resamples", type=int, default=1000)
+    bootstrap.add_argument("--naive-resamples", type=int, default=5, help="naive resamples timed and extrapolated")
+    bootstrap.add_argument("--seed", type=int, default=0)
+    bootstrap.set_defaults(func=bench_bootstrap)
+
+    locations = commands.add_parser("locations", help="cold start and RSS of pickled vs memory-mapped location maps")
+    locations.add_argument("--maps", nargs="+", default=["data/location_map_covid.pkl", "data/location_map_normal_day.pkl"])
+    locations.add_argument("--lookups", type=int, default=1000000, help="names looked up in the lookup timing")
+    locations.add_argument("--repeat", type=int, default=3, help="fresh interpreters per format; the best is shown")
+    locations.add_argument("--seed", type=int, default=0)
+    locations.set_defaults(func=bench_locations)
+
+    startup = commands.add_parser("startup", help="import time of the modules, run from outside the repository")
+    startup.add_argument("--repeat", type=int, default=9, help="fresh interpreters per module; the median is shown")
+    startup.set_defaults(func=bench_startup)
+
+    preprocess = commands.add_parser("preprocess", help="time the old and vectorised data/preprocess.py stages")
+    preprocess.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    preprocess.add_argument("--seed", type=int, default=0)
+    preprocess.set_defaults(func=bench_preprocess)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
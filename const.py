@@ -1,6 +1,10 @@
 from pathlib import Path
 
+# the directory of this file, not found by searching from the working directory
+PROJECT_ROOT = Path(__file__).absolute().parent
+
 def get_project_root():
+    """The nearest directory from the working directory upwards that looks like a project root."""
     current_path = Path.cwd()
     while True:
         if (current_path / '.git').exists() or \
@@ -12,4 +16,3 @@ def get_project_root():
         if parent_path == current_path:
             raise Exception("Project root not found.")
         current_path = parent_path
-PROJECT_ROOT = get_project_root()
\ No newline at end of file
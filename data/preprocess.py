@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import pickle as pk
 import time
@@ -42,14 +43,19 @@ def keep_first_visit_per_interval(df):
 
 def get_poi_id_text_label(df):
     df = df.copy()
-    poi_df = df[["poi_id", "sub_category"]].drop_duplicates()
-    poi_id_mapping = {}
+    # POIs without a sub category get no label
+    poi_df = df[["poi_id", "sub_category"]].drop_duplicates().dropna(subset=["sub_category"])
+    # order in which the sub categories first appear
+    poi_df["first_seen"] = pd.factorize(poi_df["sub_category"])[0]
 
-    for sub_cat in poi_df['sub_category'].unique():
-        sub_cat_pois = poi_df[poi_df['sub_category'] == sub_cat]['poi_id'].unique()
-        sub_cat_pois = sorted(list(sub_cat_pois))
-        new_ids = [f"{sub_cat} #{i}" for i in range(len(sub_cat_pois))]
-        poi_id_mapping.update(dict(zip(sub_cat_pois, new_ids)))
+    # number the POIs of each sub category in sorted order, e.g., "Cafe #0", "Cafe #1", ...
+    poi_df = poi_df.sort_values(by="poi_id", kind="stable")
+    poi_df["label"] = poi_df["sub_category"].astype(str) + " #" + \
+        poi_df.groupby("sub_category", sort=False).cumcount().astype(str)
+
+    # a POI listed under several sub categories keeps the label of the one that appears last
+    poi_df = poi_df.sort_values(by="first_seen", kind="stable").drop_duplicates(subset="poi_id", keep="last")
+    poi_id_mapping = pd.Series(poi_df["label"].to_numpy(), index=poi_df["poi_id"].to_numpy())
 
     df['poi_id'] = df['poi_id'].map(poi_id_mapping)
     return df
@@ -67,8 +73,12 @@ def generate_trajectory_prompts(df):
     # 1. make sure the data is sorted by user and time
     df = df.sort_values(by=['uid', 'time_interval'])
 
-    # 2. extract the time part from the time interval for better readability in the prompt
-    df['time_str'] = df['time_interval'].dt.strftime('%H:%M:%S')
+    # 2. extract the time part from the time interval for better readability in the prompt;
+    # there are only a few distinct times of day, so each is formatted once
+    seconds = (df['time_interval'] - df['time_interval'].dt.normalize()).dt.total_seconds().astype(np.int64)
+    codes, times = pd.factorize(seconds)
+    time_strs = np.array([f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}" for t in times], dtype=object)
+    df['time_str'] = time_strs[codes]
 
     # 3. filter out consecutive visits to the same POI, only keep the first one in a sequence of identical POIs
     is_poi_changed = df['poi_id'] != df.groupby(['uid', 'date'])['poi_id'].shift(1)
@@ -77,15 +87,30 @@ def generate_trajectory_prompts(df):
     # 4. concatenate the POI label and time into a single string for each event, e.g., "Restaurant #5 at 12:00"
     df['event_str'] = df['poi_id'] + " at " + df['time_str']
 
-    # 5. aggregate by user and date, concatenate the events of the day into a single string separated by commas
+    # 5. aggregate by user and date, concatenate the events of the day into a single string separated by commas;
+    # the (user, date) groups are numbered in sorted order and their rows brought together, keeping the row order
     df["uid"] = "user_" + df["uid"].astype(str)
-    daily_traj = df.groupby(['uid', 'date'])['event_str'].apply(lambda x: ', '.join(x)).reset_index()
+    group = df.groupby(['uid', 'date']).ngroup().to_numpy()
+    order = np.argsort(group, kind='stable')
+    starts = np.flatnonzero(np.diff(group[order], prepend=-1))
+    ends = np.append(starts[1:], len(order))
+    events = df['event_str'].to_numpy()[order].tolist()
+    daily_traj = pd.DataFrame({
+        'uid': df['uid'].to_numpy()[order][starts],
+        'date': df['date'].to_numpy()[order][starts],
+        'event_str': [', '.join(events[start:end]) for start, end in zip(starts, ends)],
+    })
 
     # 6. construct the prompt for each day, e.g., "Activities at 2026-03-01: Convenience Store #1 at 08:00, Cafe #2 at 09:10, Restaurant #5 at 12:00."
     daily_traj['prompt'] = "Activities at " + daily_traj['date'].astype(str) + ": " + daily_traj['event_str'] + "."
 
-    # 7. aggregate the daily prompts into a list for each user, resulting in a dictionary {uid: [prompt1, prompt2, ...]}
-    daily_text_trajs = daily_traj.groupby('uid')['prompt'].apply(list).to_dict()
+    # 7. aggregate the daily prompts into a list for each user, resulting in a dictionary {uid: [prompt1, prompt2, ...]};
+    # the days are sorted by user already, so each user's prompts are one slice
+    uids = daily_traj['uid'].to_numpy()
+    prompts = daily_traj['prompt'].tolist()
+    user_starts = np.flatnonzero(np.r_[True, uids[1:] != uids[:-1]]) if len(uids) else np.zeros(0, dtype=np.int64)
+    user_ends = np.append(user_starts[1:], len(uids))
+    daily_text_trajs = {uids[start]: prompts[start:end] for start, end in zip(user_starts, user_ends)}
 
     return daily_text_trajs
 
@@ -106,36 +131,35 @@ def run_preprocessing(df, dataset_name):
     return  text_trajs
 
 
-df1=  pd.read_csv("anonymized_olympic.csv")
-df2 = pd.read_csv("anonymized_covid.csv")
-df3 = pd.read_csv("anonymized_typhoon.csv")
-df4 = pd.read_csv("anonymized_normal_day.csv")
-
-print("-" * 150)
-text_trajs_olympic = run_preprocessing(df1, "olympic")
-text_trajs_covid = run_preprocessing(df2, "covid")
-text_trajs_typhoon = run_preprocessing(df3, "typhoon")
-text_trajs_normal_day =  run_preprocessing(df4, "normal_day")
-
-
-# save the processed prompts to pickle files for later use
-pk.dump(text_trajs_olympic, open("activities_list_coordinate_olympic", "wb"))
-pk.dump(text_trajs_covid, open("activities_list_coordinate_covid", "wb"))
-pk.dump(text_trajs_typhoon, open("activities_list_coordinate_typhoon", "wb"))
-pk.dump(text_trajs_normal_day, open("activities_list_coordinate_normal_day", "wb"))
+if __name__ == '__main__':
+    df1=  pd.read_csv("anonymized_olympic.csv")
+    df2 = pd.read_csv("anonymized_covid.csv")
+    df3 = pd.read_csv("anonymized_typhoon.csv")
+    df4 = pd.read_csv("anonymized_normal_day.csv")
 
-
-import pandas as pd
-
-files = [
-    'anonymized_covid.csv',
-    'anonymized_normal_day.csv',
-    'anonymized_olympic.csv',
-    'anonymized_typhoon.csv',
-]
-
-dfs = [pd.read_csv(f, usecols=['sub_category']) for f in files]
-combined = pd.concat(dfs, ignore_index=True)
-result = combined.drop_duplicates().sort_values('sub_category').reset_index(drop=True)
-result.to_csv('subcategories.csv', index=False)
-print(f"共 {len(result)} 条唯一 sub_category")
\ No newline at end of file
+    print("-" * 150)
+    text_trajs_olympic = run_preprocessing(df1, "olympic")
+    text_trajs_covid = run_preprocessing(df2, "covid")
+    text_trajs_typhoon = run_preprocessing(df3, "typhoon")
+    text_trajs_normal_day =  run_preprocessing(df4, "normal_day")
+
+
+    # save the processed prompts to pickle files for later use
+    pk.dump(text_trajs_olympic, open("activities_list_coordinate_olympic", "wb"))
+    pk.dump(text_trajs_covid, open("activities_list_coordinate_covid", "wb"))
+    pk.dump(text_trajs_typhoon, open("activities_list_coordinate_typhoon", "wb"))
+    pk.dump(text_trajs_normal_day, open("activities_list_coordinate_normal_day", "wb"))
+
+
+    files = [
+        'anonymized_covid.csv',
+        'anonymized_normal_day.csv',
+        'anonymized_olympic.csv',
+        'anonymized_typhoon.csv',
+    ]
+
+    dfs = [pd.read_csv(f, usecols=['sub_category']) for f in files]
+    combined = pd.concat(dfs, ignore_index=True)
+    result = combined.drop_duplicates().sort_values('sub_category').reset_index(drop=True)
+    result.to_csv('subcategories.csv', index=False)
+    print(f"共 {len(result)} 条唯一 sub_category")
@@ -1,14 +1,122 @@
 import numpy as np
-import scipy.stats
 import pickle as pk
 from math import sin, cos, asin, sqrt, radians
 import pickle
 from datetime import datetime
 import re
 from typing import List, Tuple
+from itertools import chain
+from functools import lru_cache
+import argparse
+import time
+from simulator.trajectory import *
+from simulator.result_store import *
+from simulator.location_index import LocationIndex
+from const import PROJECT_ROOT
+
+SUB_TO_TOP_PATH = PROJECT_ROOT / "data" / "subcategory_to_topscategory.pickle"
+GROUND_TRUTH_PATH = PROJECT_ROOT / "groundtruth.pkl"
+
+
+# the metric settings evaluation.py reports
+METRIC_SETTINGS = {
+    "duration_granularity": 10,
+    "max_distance": 100,
+    "distance_granularity": 1,
+    "grid_count": 100,
+    "lon_range": (139.50, 139.90),
+    "lat_range": (35.50, 35.82),
+}
+
+
+@lru_cache(maxsize=None)
+def get_sub_to_top():
+    """
+    The {sub category: top categories} map of SUB_TO_TOP_PATH, read on first use
+    """
+    with open(SUB_TO_TOP_PATH, "rb") as f:
+        return pickle.load(f)
+
+
+@lru_cache(maxsize=None)
+def top_category_index():
+    """
+    Index of every top category of `get_sub_to_top()`, in sorted order; built once per process.
+    """
+    all_tops = sorted({
+        top
+        for tops in get_sub_to_top().values()
+        for top in tops
+        if isinstance(top, str)
+    })
+    return {top: i for i, top in enumerate(all_tops)}
+
+
+def top_category_of(sub):
+    """
+    Index of the top category of the sub category `sub`, or -1 if it has none
+    """
+    sub = sub.strip()
+    if sub == "Cafe":
+        sub = "Café"
+    elif sub == "Pet Cafe":
+        sub = "Pet Café"
+    tops = get_sub_to_top().get(sub)
+    if not tops:
+        return -1
+    return top_category_index().get(tops[0], -1)
+
+
+class TrajectoryColumns(object):
+    """
+    A set of trajectories parsed once into flat per-visit arrays, which every metric reads. \n
+    The visits of trajectory i are rows offsets[i]:offsets[i + 1] of `categories` (interned
+    category IDs), `seconds` (time of day) and `lnglat` (coordinates, valid where `known`, i.e.
+    where the location map has the POI). `hash_counts` is the number of '#' in each trajectory
+    text, which the multi-visit filters go by.
+    """
+
+    def __init__(self, offsets, categories, seconds, lnglat, known, hash_counts):
+        self.offsets = offsets
+        self.categories = categories
+        self.seconds = seconds
+        self.lnglat = lnglat
+        self.known = known
+        self.hash_counts = hash_counts
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def traj_ids(self):
+        """
+        The trajectory index of every visit
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
 
-with open("data/subcategory_to_topscategory.pickle", "rb") as f:
-    sub_to_top = pickle.load(f)
+    def select(self, mask):
+        """
+        The trajectories where `mask` is True, as new columns
+        """
+        mask = np.asarray(mask, dtype=bool)
+        lengths = self.lengths
+        rows = np.repeat(mask, lengths)
+        offsets = np.zeros(int(mask.sum()) + 1, dtype=np.int64)
+        np.cumsum(lengths[mask], out=offsets[1:])
+        return TrajectoryColumns(offsets, self.categories[rows], self.seconds[rows], self.lnglat[rows],
+                                 self.known[rows], self.hash_counts[mask])
+
+    def consecutive(self, rows):
+        """
+        For the visits selected by `rows` (a boolean mask), which of them follow another selected
+        visit of the same trajectory: the pairs SI and SD measure
+        """
+        ids = self.traj_ids[rows]
+        return ids[1:] == ids[:-1]
 
 
 class DataLoader(object):
@@ -32,6 +140,12 @@ class DataLoader(object):
 
     @staticmethod
     def load_location_map(data_path):
+        """
+        The {name: (lng, lat)} map of a data/location_map_*.pkl, or the memory-mapped LocationIndex of a .locidx file
+        written by `python -m simulator.location_index`
+        """
+        if data_path.endswith(".locidx"):
+            return LocationIndex(data_path)
         location_map = {}
         data = pk.load(open(data_path, "rb"))
         for location_name in data:
@@ -40,35 +154,77 @@ class DataLoader(object):
         return location_map
 
     @staticmethod
-    def load_trajectory_data(data_path):
+    def in_evaluation_window(date):
+        dt = datetime.strptime(date, '%Y-%m-%d')
+        # please adjust the date range according to the actual date range of your data, here we only keep the trajectories in April 7-13, 2020 for covid event dataset.
+        return dt.month == 4 and 7 <= dt.day <= 13
+
+    @staticmethod
+    def window_trajectories(trajs_by_date):
+        """
+        The cleaned trajectories of one user's {date: trajectory} dict that fall in the evaluation window
+        """
+        return [DataLoader.clean_and_extract_locations(text_traj)
+                for date, text_traj in trajs_by_date.items() if DataLoader.in_evaluation_window(date)]
+
+    @staticmethod
+    def load_generated(data_path):
+        """
+        The generated {user: record} dict of result.pkl, or of a run's result.jsonl store and its shard stores
+        """
+        if data_path.endswith(".jsonl"):
+            return load_results(data_path)
+        return pickle.load(open(data_path, 'rb'))
+
+    @staticmethod
+    def user_trajectories(records, users, key):
+        """
+        The window trajectories of `users` from {user: {key: {date: trajectory}}} records, and the index in `users`
+        of the user each trajectory belongs to
+        """
+        trajs, owners = [], []
+        for owner, user in enumerate(users):
+            window = DataLoader.window_trajectories(records[user][key])
+            trajs.extend(window)
+            owners.extend([owner] * len(window))
+        return trajs, owners
+
+    @staticmethod
+    def iter_generated(data_path):
+        """
+        (user, record) of every generated user of result.pkl, or of a run's result.jsonl store and its shard stores
+        """
+        if not data_path.endswith(".jsonl"):
+            yield from pickle.load(open(data_path, 'rb')).items()
+            return
+        for store_path in store_paths(data_path):
+            yield from ResultStore(store_path)
+
+    @staticmethod
+    def load_trajectory_data(data_path, ground_truth_path=GROUND_TRUTH_PATH):
         """
         Load trajectory data, it could be generated or real trajectory data. \n
         Args:
             data_path: str, path to the trajectory data file
+            ground_truth_path: str, path to the real trajectories of the same users
         Returns:
             fake_trajs: list, generated trajectories
             real_trajs: list, real trajectories
         """
-        genlist = pickle.load(open(data_path, 'rb'))
-        reallist = pickle.load(open("groundtruth.pkl", 'rb'))
+        genlist = DataLoader.load_generated(data_path)
+        reallist = pickle.load(open(ground_truth_path, 'rb'))
 
         all_fake = {}
         all_real = {}
         for m in genlist:
             if m in reallist:
                 for date, text_traj in genlist[m]['results'].items():
-                    dt = datetime.strptime(date, '%Y-%m-%d')
-                    # please adjust the date range according to the actual date range of your data, here we only keep the trajectories in April 7-13, 2020 for covid event dataset.
-                    if dt.month != 4 or (dt.month == 4 and (dt.day < 7 or dt.day > 13)):
-                        continue
-                    all_fake[f"{m}_{date}"] = text_traj
+                    if DataLoader.in_evaluation_window(date):
+                        all_fake[f"{m}_{date}"] = text_traj
 
                 for date, text_traj in reallist[m]['reals'].items():
-
-                    dt = datetime.strptime(date, '%Y-%m-%d')
-                    if dt.month != 4 or (dt.month == 4 and (dt.day < 7 or dt.day > 13)):
-                        continue
-                    all_real[f"{m}_{date}"] = text_traj
+                    if DataLoader.in_evaluation_window(date):
+                        all_real[f"{m}_{date}"] = text_traj
 
 
         fake_trajs = [DataLoader.clean_and_extract_locations(all_fake[k]) for k in all_fake.keys()]
@@ -82,6 +238,45 @@ class Evaluation(object):
     def __init__(self, locations_map):
 
         self.locations_map = locations_map
+        self._top_ids = []
+
+    def parse_columns(self, trajs):
+        """
+        Parse trajectories (texts or DayTrajectory objects) once into TrajectoryColumns
+        Args:
+            trajs (list): trajectories
+        Returns:
+            columns (TrajectoryColumns): the visits of all trajectories as flat arrays
+        """
+        days = [as_day(", ".join(str(x) for x in traj) if isinstance(traj, (list, tuple)) else traj)
+                for traj in trajs]
+        visits = [visit for day in days for visit in day.visits]
+        offsets = np.zeros(len(days) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(day.visits) for day in days), dtype=np.int64, count=len(days)), out=offsets[1:])
+        categories = np.fromiter((visit.category for visit in visits), dtype=np.int64, count=len(visits))
+        seconds = np.fromiter((visit.seconds for visit in visits), dtype=np.int64, count=len(visits))
+        if isinstance(self.locations_map, LocationIndex):
+            lnglat, known = self.locations_map.lookup([visit.location for visit in visits])
+        else:
+            points = [self.locations_map.get(visit.location) for visit in visits]
+            known = np.fromiter((point is not None for point in points), dtype=bool, count=len(points))
+            lnglat = np.fromiter(chain.from_iterable(point or (np.nan, np.nan) for point in points), dtype=float,
+                                 count=2 * len(points)).reshape(-1, 2)
+        # a day that round-trips has exactly one '#' per visit; other days keep their raw text
+        hash_counts = np.fromiter((len(day.visits) if day.raw is None else day.raw.count('#') for day in days),
+                                  dtype=np.int64, count=len(days))
+        return TrajectoryColumns(offsets, categories, seconds, lnglat, known, hash_counts)
+
+    def as_columns(self, trajs):
+        return trajs if isinstance(trajs, TrajectoryColumns) else self.parse_columns(trajs)
+
+    def category_top_ids(self):
+        """
+        Top category index (or -1) of every interned category ID, extended as new categories appear
+        """
+        while len(self._top_ids) < len(CATEGORY_NAMES):
+            self._top_ids.append(top_category_of(CATEGORY_NAMES[len(self._top_ids)]))
+        return np.array(self._top_ids, dtype=np.int64)
 
     @staticmethod
     def parse_activities(activities_str):
@@ -93,49 +288,18 @@ class Evaluation(object):
 
     def extract_category_seq_single(self, trajs):
         all_categories = []
-        for trajectory_str in trajs:
-            header, sep, activities_part = trajectory_str.partition(':')
-            if not sep:
-                continue
-            matches = self.parse_activities(activities_part)
-
-            categories = []
-            for match in matches:
-                if '#' in match:
-                    category_part = match.split('#')[0]
-                    categories.append(category_part)
-                else:
-                    categories.append(match)
-            all_categories.extend(categories)
+        for trajectory in trajs:
+            # times of day outside any activity (LooseVisit without a location) have no category
+            all_categories.extend(visit.category_name for visit in as_day(trajectory).visits if visit.location)
         return all_categories
 
     def extract_duration_seq(self, p):
-        def to_seconds(ts):
-            parts = ts.split(':')
-            try:
-                if len(parts) == 3:
-                    h, m, s = map(int, parts)
-                    return h * 3600 + m * 60 + s
-                elif len(parts) == 2:
-                    h, m = map(int, parts)
-                    return h * 3600 + m * 60
-            except:
-                pass
-            return 0
-
-        # Regex to match HH:MM or HH:MM:SS
-        time_pattern = re.compile(r"(\d{1,2}:\d{2}(?::\d{2})?)")
         d = []
         for u in p:
-            # Create a raw text containing all events for this day
-            if isinstance(u, str):
-                raw = u
-            elif isinstance(u, (list, tuple)):
-                raw = ", ".join(str(x) for x in u)
-            else:
-                raw = str(u)
-            # Extract timestamps in order
-            times = [to_seconds(m.group(1)) for m in time_pattern.finditer(raw)]
+            if isinstance(u, (list, tuple)):
+                u = ", ".join(str(x) for x in u)
+            # visit times of the day in seconds, in order
+            times = [visit.seconds for visit in as_day(u).visits]
             if len(times) < 2:
                 continue
             # Compute consecutive differences
@@ -146,19 +310,16 @@ class Evaluation(object):
 
         return flat_scaled
 
-    def extract_lnglat_seq(self, trajectory_str):
+    def extract_lnglat_seq(self, trajectory):
         """
         e.g.: trajectory = "Activities at 2020-09-01: Shipping, Freight, and Material Transportation Service#1111 at 14:20, Other Place#22222 at 16:00"
+        (or the DayTrajectory parsed from it)
         """
-        activities_str = trajectory_str.split(": ")[1]
-        activities = self.parse_activities(activities_str)
         valid_points = []
-        for activity in activities:
-            if activity and "at" in activity:
-                loc_name, time = activity.rsplit(" at ", 1)
-                if loc_name in self.locations_map:
-                    lng, lat = self.locations_map[loc_name]
-                    valid_points.append((lng, lat))
+        for visit in as_day(trajectory).visits:
+            point = self.locations_map.get(visit.location)
+            if point is not None:
+                valid_points.append(point)
 
         return valid_points
 
@@ -181,6 +342,17 @@ class Evaluation(object):
         assert num_of_samples == distribution.sum(), f"num_of_samples: {num_of_samples}, distribution.sum(): {distribution.sum()}"
         return distribution, base[:-1]
 
+    @staticmethod
+    def distribution_bins(arr, Min, Max, bins):
+        """
+        The bin of every value in the `arr_to_distribution` histogram: 0 below Min, 1 to bins from Min to Max
+        (binned like np.histogram) and bins + 1 above Max
+        """
+        edges = np.histogram_bin_edges(arr, bins=bins, range=(Min, Max))
+        indices = np.searchsorted(edges, arr, side='right')
+        indices[arr == Max] = bins
+        return indices
+
     def get_js_divergence(self, p1, p2):
         """
         calculate the Jensen-Shanon Divergence of two probability distributions
@@ -188,6 +360,7 @@ class Evaluation(object):
         :param p2:
         :return:
         """
+        import scipy.stats  # on first use: it takes most of this module's import time
         # normalize
         p1 = p1 / (p1.sum() + 1e-9)
         p2 = p2 / (p2.sum() + 1e-9)
@@ -195,6 +368,16 @@ class Evaluation(object):
         js = 0.5 * scipy.stats.entropy(p1, m) + 0.5 * scipy.stats.entropy(p2, m)
         return js
 
+    def get_js_divergences(self, p1, p2):
+        """
+        `get_js_divergence` of every row of p1 with the same row of p2
+        """
+        import scipy.stats
+        p1 = p1 / (p1.sum(axis=1, keepdims=True) + 1e-9)
+        p2 = p2 / (p2.sum(axis=1, keepdims=True) + 1e-9)
+        m = (p1 + p2) / 2
+        return 0.5 * scipy.stats.entropy(p1, m, axis=1) + 0.5 * scipy.stats.entropy(p2, m, axis=1)
+
     def geodistance(self, lng1, lat1, lng2, lat2):
         """
         Calculate the greater circle distance in `km` between two points on the earth
@@ -215,6 +398,62 @@ class Evaluation(object):
         distance = round(distance / 1000, 3)
         return distance
 
+    def geodistances(self, lng1, lat1, lng2, lat2):
+        """
+        Vectorised `geodistance`: the greater circle distances in `km` between arrays of points
+        Args:
+            lng1, lat1, lng2, lat2 (array-like): coordinates of the first and the second points
+
+        Returns:
+            distances (np.ndarray): distances of the point pairs in km, rounded to metres
+        """
+        lng1, lat1, lng2, lat2 = (np.radians(np.asarray(v, dtype=float)) for v in (lng1, lat1, lng2, lat2))
+        dlon = lng2 - lng1
+        dlat = lat2 - lat1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        distances = 2 * np.arcsin(np.sqrt(a)) * 6371 * 1000
+        return np.round(distances / 1000, 3)
+
+    def step_distances(self, point_seqs):
+        """
+        Distances in `km` between consecutive points of every sequence, in one vectorised pass
+        Args:
+            point_seqs (list): one list of (lng, lat) points per trajectory
+        Returns:
+            distances (np.ndarray): the one step distances of all sequences, in order
+        """
+        lengths = np.array([len(seq) for seq in point_seqs], dtype=np.int64)
+        if lengths.sum() < 2:
+            return np.zeros(0)
+        points = np.fromiter(chain.from_iterable(chain.from_iterable(point_seqs)), dtype=float,
+                             count=2 * int(lengths.sum())).reshape(-1, 2)
+        # pair i joins points i and i + 1; drop the pairs that run into the next sequence
+        keep = np.ones(len(points) - 1, dtype=bool)
+        starts = np.cumsum(lengths)[:-1]
+        keep[starts[(starts > 0) & (starts < len(points))] - 1] = False
+        later, earlier = points[1:][keep], points[:-1][keep]
+        return self.geodistances(later[:, 0], later[:, 1], earlier[:, 0], earlier[:, 1])
+
+    def column_step_distances(self, columns):
+        """
+        One step distances in `km` between the consecutive located visits of every trajectory, and the trajectory
+        index of each
+        """
+        pairs = columns.consecutive(columns.known)
+        points = columns.lnglat[columns.known]
+        later, earlier = points[1:][pairs], points[:-1][pairs]
+        trajs = columns.traj_ids[columns.known][1:][pairs]
+        return self.geodistances(later[:, 0], later[:, 1], earlier[:, 0], earlier[:, 1]), trajs
+
+    def distance_histogram(self, columns, max_distance=100, granularity=0.5):
+        """
+        One step distances counted in `granularity` km bins up to `max_distance`, with the bins below and above
+        """
+        MIN = 0
+        MAX = max_distance
+        bins = int((MAX - MIN) / granularity)
+        return self.arr_to_distribution(self.column_step_distances(columns)[0], MIN, MAX, bins)[0]
+
     # SD
     def calc_distance_one_step_jsd(self, real_trajs, generated_trajs, max_distance=100, granularity=0.5):
         """
@@ -227,25 +466,29 @@ class Evaluation(object):
         Returns:
             JSD (float): Jensen-Shanon Divergence
         """
-        generated_trajs = [self.extract_lnglat_seq(traj) for traj in generated_trajs]
-        real_trajs = [self.extract_lnglat_seq(traj) for traj in real_trajs]
-        generated_trajs = [traj for traj in generated_trajs if len(traj) > 1]
-        real_trajs = [traj for traj in real_trajs if len(traj) > 1]
+        r_list = self.distance_histogram(self.as_columns(real_trajs), max_distance, granularity)
+        f_list = self.distance_histogram(self.as_columns(generated_trajs), max_distance, granularity)
+        JSD = self.get_js_divergence(r_list, f_list)
 
-        generated_distances = [self.geodistance(lnglat[0], lnglat[1], traj[index][0], traj[index][1]) for traj in
-                               generated_trajs for index, lnglat in enumerate(traj[1:])]
-        real_distances = [self.geodistance(lnglat[0], lnglat[1], traj[index][0], traj[index][1]) for traj in real_trajs
-                          for index, lnglat in enumerate(traj[1:])]
+        return JSD
 
+    def column_durations(self, columns):
+        """
+        Seconds between consecutive visits of every trajectory, and the trajectory index of each
+        """
+        everything = np.ones(len(columns.seconds), dtype=bool)
+        steps = columns.consecutive(everything)
+        return np.diff(columns.seconds)[steps], columns.traj_ids[1:][steps]
 
+    def duration_histogram(self, columns, granularity=10.0):
+        """
+        Minutes between consecutive visits counted in `granularity` minute bins over the day, with the bins
+        below and above
+        """
         MIN = 0
-        MAX = max_distance
+        MAX = 24 * 60  # 1440 minutes in a day
         bins = int((MAX - MIN) / granularity)
-        r_list, _ = self.arr_to_distribution(np.array(real_distances), MIN, MAX, bins)
-        f_list, _ = self.arr_to_distribution(np.array(generated_distances), MIN, MAX, bins)
-        JSD = self.get_js_divergence(r_list, f_list)
-
-        return JSD
+        return self.arr_to_distribution(self.column_durations(columns)[0] / 60, MIN, MAX, bins)[0]
 
     # SI
     def calc_duration_jsd(self, reals, generations, granularity=10.0):
@@ -259,22 +502,20 @@ class Evaluation(object):
             JSD (float): Jensen-Shanon Divergence
         """
 
-        g = self.extract_duration_seq(generations)
-        r = self.extract_duration_seq(reals)
-        g = [x / 60 for x in g]
-        r = [x / 60 for x in r]
-
-        MIN = 0
-        MAX = 24 * 60  # 1440 minutes in a day
-        bins = int((MAX - MIN) / granularity)
-
-        r_list, _ = self.arr_to_distribution(np.array(r), MIN, MAX, bins)
-        g_list, _ = self.arr_to_distribution(np.array(g), MIN, MAX, bins)
+        r_list = self.duration_histogram(self.as_columns(reals), granularity)
+        g_list = self.duration_histogram(self.as_columns(generations), granularity)
         JSD = self.get_js_divergence(r_list, g_list)
 
         return JSD
 
 
+    def category_histogram(self, columns):
+        """
+        Visits counted per top category
+        """
+        tops = self.category_top_ids()[columns.categories]
+        return np.bincount(tops[tops >= 0], minlength=len(top_category_index()))
+
     def calc_category_jsd(self, generated_trajs, real_trajs):
         """
         calculate the Jensen-Shanon Divergence of `category` between generated and real trajectories
@@ -284,39 +525,44 @@ class Evaluation(object):
         Returns:
             JSD (float): Jensen-Shanon Divergence
         """
-        generated_categories = self.extract_category_seq_single(generated_trajs)
-        real_categories = self.extract_category_seq_single(real_trajs)
-
-        all_tops = sorted({
-            top
-            for tops in sub_to_top.values()
-            for top in tops
-            if isinstance(top, str)
-        })
-        top_index = {top: i for i, top in enumerate(all_tops)}
-
-        def count_top_categories(sub_cats):
-            counts = np.zeros(len(top_index), dtype=int)
-            for sub in sub_cats:
-                sub = sub.strip()
-                if sub == "Cafe":
-                    sub = "Café"
-                elif sub == "Pet Cafe":
-                    sub = "Pet Café"
-                tops = sub_to_top.get(sub)
-                if not tops:
-                    continue
-                top = tops[0]
-                counts[top_index[top]] += 1
-            return counts
-
-        top_counts1 = count_top_categories(generated_categories)
-        top_counts2 = count_top_categories(real_categories)
+        top_counts1 = self.category_histogram(self.as_columns(generated_trajs))
+        top_counts2 = self.category_histogram(self.as_columns(real_trajs))
 
         JSD = self.get_js_divergence(top_counts1, top_counts2)
 
         return JSD
 
+    def grid_counts(self, points, grid_count=100, lon_range=(139.50, 139.90), lat_range=(35.50, 35.82)):
+        """
+        count visits per grid cell with one bincount over the cell index of every point
+        Args:
+            points (list): (lng, lat) points
+            grid_count (int): number of grids, default is 100
+            lon_range (tuple): longitude range, default is (139.50, 139.90)
+            lat_range (tuple): latitude range, default is (35.50, 35.82)
+        Returns:
+            counts (np.ndarray): grid_count cell counts, then the count of points off the grid
+        """
+        return np.bincount(self.grid_cells(points, grid_count, lon_range, lat_range), minlength=grid_count + 1)
+
+    def grid_cells(self, points, grid_count=100, lon_range=(139.50, 139.90), lat_range=(35.50, 35.82)):
+        """
+        The grid cell of every point, grid_count for points off the grid
+        """
+        grid_side = int(np.sqrt(grid_count))
+        if not isinstance(points, np.ndarray):
+            points = np.fromiter(chain.from_iterable(points), dtype=float, count=2 * len(points))
+        points = points.reshape(-1, 2)
+        lon, lat = points[:, 0], points[:, 1]
+        inside = (lon_range[0] <= lon) & (lon <= lon_range[1]) & (lat_range[0] <= lat) & (lat <= lat_range[1])
+        x_norm = (lon[inside] - lon_range[0]) / (lon_range[1] - lon_range[0])
+        y_norm = (lat[inside] - lat_range[0]) / (lat_range[1] - lat_range[0])
+        gx = np.minimum((x_norm * grid_side).astype(np.int64), grid_side - 1)
+        gy = np.minimum((y_norm * grid_side).astype(np.int64), grid_side - 1)
+        idx = np.full(len(points), grid_count, dtype=np.int64)
+        idx[inside] = gy * grid_side + gx
+        return idx
+
     # Spatial Grid Activity JSD
     def calc_sg_act_jsd(self, generated_trajs, real_trajs, grid_count=100, lon_range=(139.50, 139.90),
                         lat_range=(35.50, 35.82)):
@@ -332,87 +578,394 @@ class Evaluation(object):
             JSD (float): Jensen-Shanon Divergence
         """
 
-        def map_visits_to_grid(p):
-            grid_side = int(np.sqrt(grid_count))
-            counts = np.zeros(grid_count + 1, dtype=int)
-            for lon, lat in p:
-                if lon_range[0] <= lon <= lon_range[1] and lat_range[0] <= lat <= lat_range[1]:
-                    x_norm = (lon - lon_range[0]) / (lon_range[1] - lon_range[0])
-                    y_norm = (lat - lat_range[0]) / (lat_range[1] - lat_range[0])
-                    gx = min(int(x_norm * grid_side), grid_side - 1)
-                    gy = min(int(y_norm * grid_side), grid_side - 1)
-                    idx = gy * grid_side + gx
-                else:
-                    idx = grid_count
-                counts[idx] += 1
-            return list(counts)
-
-        generated_points = [self.extract_lnglat_seq(traj) for traj in generated_trajs]
-        real_points = [self.extract_lnglat_seq(traj) for traj in real_trajs]
-        generated_points = [point for traj in generated_points for point in traj]
-        real_points = [point for traj in real_points for point in traj]
-
-        p1 = np.array(map_visits_to_grid(generated_points))[:grid_count]
-        p2 = np.array(map_visits_to_grid(real_points))[:grid_count]
+        p1 = self.grid_histogram(self.as_columns(generated_trajs), grid_count, lon_range, lat_range)
+        p2 = self.grid_histogram(self.as_columns(real_trajs), grid_count, lon_range, lat_range)
+        return self.grid_js_divergence(p1, p2)
+
+    def grid_histogram(self, columns, grid_count=100, lon_range=(139.50, 139.90), lat_range=(35.50, 35.82)):
+        """
+        Located visits counted per grid cell; visits off the grid are not counted
+        """
+        return self.grid_counts(columns.lnglat[columns.known], grid_count, lon_range, lat_range)[:grid_count]
+
+    def grid_js_divergence(self, p1, p2):
+        """
+        SGD of the generated grid counts `p1` against the real ones `p2`, over the 25 busiest real cells
+        """
         top25 = np.argsort(p2)[-25:][::-1]
         selected_p1 = p1[top25]
         selected_p2 = p2[top25]
         JSD = self.get_js_divergence(selected_p1, selected_p2)
         return JSD
 
+    def grid_js_divergences(self, p1, p2):
+        """
+        `grid_js_divergence` of every row of p1 with the same row of p2
+        """
+        top25 = np.argsort(p2, axis=1)[:, -25:][:, ::-1]
+        return self.get_js_divergences(np.take_along_axis(p1, top25, axis=1), np.take_along_axis(p2, top25, axis=1))
+
+    def histograms(self, trajs, settings=METRIC_SETTINGS):
+        """
+        The histograms SI, SD, CD and SGD compare, for one trajectory set. The histograms of disjoint sets add up,
+        so they can be accumulated user by user. Like the multi-visit filters, SI and SD count the trajectories
+        with more than one check-in and CD and SGD those with at least one.
+        Args:
+            trajs (list or TrajectoryColumns): trajectories
+            settings (dict): bins of the metrics, see METRIC_SETTINGS
+        Returns:
+            histograms (dict): "SI", "SD", "CD" and "SGD" counts
+        """
+        columns = self.as_columns(trajs)
+        owned = self.user_histograms(columns, np.zeros(len(columns), dtype=np.int64), 1, settings)
+        return {name: counts[0] for name, counts in owned.items()}
+
+    def user_histograms(self, trajs, owners, num_owners, settings=METRIC_SETTINGS):
+        """
+        `histograms` of the trajectories of every owner (e.g. user) at once
+        Args:
+            trajs (list or TrajectoryColumns): trajectories
+            owners (array-like): the owner of every trajectory, from 0 to num_owners - 1
+            num_owners (int): number of owners
+            settings (dict): bins of the metrics, see METRIC_SETTINGS
+        Returns:
+            histograms (dict): per metric, a num_owners x bins array of counts
+        """
+        columns = self.as_columns(trajs)
+        owners = np.asarray(owners, dtype=np.int64)
+        multi_visit = columns.hash_counts > 1
+        single_visit = columns.hash_counts >= 1
+        multi, single = columns.select(multi_visit), columns.select(single_visit)
+
+        def count(bins, item_owners, size):
+            return np.bincount(item_owners * size + bins, minlength=num_owners * size).reshape(num_owners, size)
+
+        duration_bins = int(24 * 60 / settings["duration_granularity"])
+        durations, duration_trajs = self.column_durations(multi)
+        distance_bins = int(settings["max_distance"] / settings["distance_granularity"])
+        distances, distance_trajs = self.column_step_distances(multi)
+        tops = self.category_top_ids()[single.categories]
+        categorised = tops >= 0
+        grid_count = settings["grid_count"]
+        cells = self.grid_cells(single.lnglat[single.known], grid_count, settings["lon_range"], settings["lat_range"])
+        on_grid = cells < grid_count
+        return {
+            "SI": count(self.distribution_bins(durations / 60, 0, 24 * 60, duration_bins),
+                        owners[multi_visit][duration_trajs], duration_bins + 2),
+            "SD": count(self.distribution_bins(distances, 0, settings["max_distance"], distance_bins),
+                        owners[multi_visit][distance_trajs], distance_bins + 2),
+            "CD": count(tops[categorised], owners[single_visit][single.traj_ids][categorised], len(top_category_index())),
+            "SGD": count(cells[on_grid], owners[single_visit][single.traj_ids[single.known]][on_grid], grid_count),
+        }
+
+    def histogram_jsds(self, generated, real):
+        """
+        The four JSDs from the histograms of the generated and the real trajectories
+        """
+        return {
+            "SI": self.get_js_divergence(real["SI"], generated["SI"]),
+            "SD": self.get_js_divergence(real["SD"], generated["SD"]),
+            "CD": self.get_js_divergence(generated["CD"], real["CD"]),
+            "SGD": self.grid_js_divergence(generated["SGD"], real["SGD"]),
+        }
+
+
+    def resample_jsds(self, generated, real, weights):
+        """
+        The four JSDs of weighted sums of per-user histograms, one per row of `weights`
+        Args:
+            generated (dict): per metric, a users x bins array with the generated histograms of each user
+            real (dict): the same for the real trajectories, with the users in the same rows
+            weights (np.ndarray): resamples x users, how often each user is counted in each resample
+        Returns:
+            jsds (dict): per metric, the JSD of every resample
+        """
+        generated = {name: weights @ counts for name, counts in generated.items()}
+        real = {name: weights @ counts for name, counts in real.items()}
+        return {
+            "SI": self.get_js_divergences(real["SI"], generated["SI"]),
+            "SD": self.get_js_divergences(real["SD"], generated["SD"]),
+            "CD": self.get_js_divergences(generated["CD"], real["CD"]),
+            "SGD": self.grid_js_divergences(generated["SGD"], real["SGD"]),
+        }
+
+    def bootstrap_jsds(self, generated, real, num_resamples=1000, seed=0, chunk_size=100):
+        """
+        The four JSDs of `num_resamples` bootstrap resamples of the users. Every resample draws as many users as
+        there are, with replacement, and only reweights the per-user histograms, so no trajectory is parsed again.
+        The same seed and number of users give the same resamples, so the samples of two planner variants
+        evaluated on the same users can be subtracted for a paired interval of their difference.
+        Args:
+            generated (dict): per metric, a users x bins array with the generated histograms of each user
+            real (dict): the same for the real trajectories, with the users in the same rows
+            num_resamples (int): number of bootstrap resamples
+            seed (int): seed of the resampling
+            chunk_size (int): resamples weighted at once, which bounds the memory used
+        Returns:
+            samples (dict): per metric, the JSD of every resample
+        """
+        rng = np.random.default_rng(seed)
+        num_users = len(real["SI"])
+        generated = {name: counts.astype(float) for name, counts in generated.items()}
+        real = {name: counts.astype(float) for name, counts in real.items()}
+        samples = {name: [] for name in real}
+        for start in range(0, num_resamples, chunk_size):
+            size = min(chunk_size, num_resamples - start)
+            picks = rng.integers(0, num_users, size=(size, num_users)) + num_users * np.arange(size)[:, None]
+            weights = np.bincount(picks.ravel(), minlength=size * num_users).reshape(size, num_users)
+            for name, jsds in self.resample_jsds(generated, real, weights.astype(float)).items():
+                samples[name].append(jsds)
+        return {name: np.concatenate(parts) for name, parts in samples.items()}
+
+    @staticmethod
+    def bootstrap_interval(samples, confidence=0.95):
+        """
+        The percentile interval holding `confidence` of the bootstrap samples
+        """
+        tail = (1 - confidence) / 2 * 100
+        low, high = np.percentile(samples, [tail, 100 - tail])
+        return low, high
+
+
+class StreamingEvaluation(object):
+    """
+    Evaluation that accumulates the metric histograms user by user, so the generated trajectories read from a
+    result store are not kept and the JSDs can be read at any point, e.g. while run.py is still appending to its
+    store. `reals`, the whole ground truth, is still held in memory (and a .pkl result file is loaded whole);
+    each user's ground truth is dropped from it once the user is counted; users without ground truth and
+    repeated records of a counted user are skipped. Unlike the batch filter, which pairs the two trajectory lists
+    up to the shorter one, every trajectory in the evaluation window is counted.
+    """
+
+    def __init__(self, evaluator, reals, settings=METRIC_SETTINGS):
+        self.evaluator = evaluator
+        self.reals = reals
+        self.settings = settings
+        self.generated = evaluator.histograms([], settings)
+        self.real = evaluator.histograms([], settings)
+        self.num_users = 0
+        self._offsets = {}
+
+    def add_user(self, user, record):
+        """
+        Count one generated {"results": {date: trajectory}} record; returns whether it was counted
+        """
+        if user not in self.reals:
+            return False
+        real = self.reals.pop(user)
+        fake_trajs = DataLoader.window_trajectories(record['results'])
+        real_trajs = DataLoader.window_trajectories(real['reals'])
+        for totals, trajs in ((self.generated, fake_trajs), (self.real, real_trajs)):
+            for name, counts in self.evaluator.histograms(trajs, self.settings).items():
+                totals[name] += counts
+        self.num_users += 1
+        return True
+
+    def add_users(self, records, on_user=None):
+        """
+        Count (user, record) pairs, calling `on_user()` after each counted one; returns how many were counted
+        """
+        counted = 0
+        for user, record in records:
+            if self.add_user(user, record):
+                counted += 1
+                if on_user is not None:
+                    on_user()
+        return counted
+
+    def update_from_store(self, path, on_user=None):
+        """
+        Count the users appended to the store at `path` (and its shard stores) since the last call;
+        returns how many were counted
+        """
+        counted = 0
+        for store_path in store_paths(path):
+            store = ResultStore(store_path)
+            offset = self._offsets.get(store_path, 0)
+
+            def records():
+                for user, record, end in store.records(offset):
+                    self._offsets[store_path] = end
+                    yield user, record
+
+            counted += self.add_users(records(), on_user)
+        return counted
+
+    def jsds(self):
+        return self.evaluator.histogram_jsds(self.generated, self.real)
+
 
 def double_filter_multi_visit_trajectories(
         fake_trajs: List[List[str]],
         real_trajs: List[List[str]]
 ) -> Tuple[List[List[str]], List[List[str]]]:
+    if isinstance(fake_trajs, TrajectoryColumns):
+        # like the zip below, only the first min(len) trajectories of either side are considered
+        paired = min(len(fake_trajs), len(real_trajs))
+        return (fake_trajs.select((fake_trajs.hash_counts > 1) & (np.arange(len(fake_trajs)) < paired)),
+                real_trajs.select((real_trajs.hash_counts > 1) & (np.arange(len(real_trajs)) < paired)))
     filtered_fake = []
     filtered_real = []
     for fake, real in zip(fake_trajs, real_trajs):
-        if isinstance(real, str) and real.count('#') > 1:
+        if isinstance(real, (str, DayTrajectory)) and str(real).count('#') > 1:
             filtered_real.append(real)
     for fake, real in zip(fake_trajs, real_trajs):
-        if isinstance(fake, str) and fake.count('#') > 1:
+        if isinstance(fake, (str, DayTrajectory)) and str(fake).count('#') > 1:
             filtered_fake.append(fake)
     return filtered_fake, filtered_real
 
 
 def single_filter_multi_visit_trajectories(fake_trajs, real_trajs):
+    if isinstance(fake_trajs, TrajectoryColumns):
+        return fake_trajs.select(fake_trajs.hash_counts >= 1), real_trajs.select(real_trajs.hash_counts >= 1)
     filtered_fake = []
     filtered_real = []
 
     for real in real_trajs:
-        if isinstance(real, str) and real.count('#') >= 1:
+        if isinstance(real, (str, DayTrajectory)) and str(real).count('#') >= 1:
             filtered_real.append(real)
 
     for fake in fake_trajs:
-        if isinstance(fake, str) and fake.count('#') >= 1:
+        if isinstance(fake, (str, DayTrajectory)) and str(fake).count('#') >= 1:
             filtered_fake.append(fake)
 
     return filtered_fake, filtered_real
 
 
-if __name__ == '__main__':
+def print_summary(jsds, num_users=None):
+    print("********** RESULTS SUMMARY ***********")
+    if num_users is not None:
+        print(f"users : \t {num_users}")
+    print(f"SI : \t {jsds['SI']:.4f}")
+    print(f"SD : \t {jsds['SD']:.4f}")
+    print(f"CD : \t {jsds['CD']:.4f}")
+    print(f"SGD : \t {jsds['SGD']:.4f}")
+    print("**************************************")
+
 
-    trajdata_path = "result.pkl"
-    location_map = DataLoader.load_location_map("data/location_map_covid.pkl")
-    fake_trajs, real_trajs = DataLoader.load_trajectory_data(trajdata_path)
+def evaluate_stream(evaluator, trajdata_path, report_every=0, follow=None, ground_truth_path=GROUND_TRUTH_PATH):
+    """
+    Streaming evaluation of result.pkl or of a run's result.jsonl store; with `follow`, keep polling the store
+    every `follow` seconds and report whenever new users were counted, until interrupted
+    """
+    stream = StreamingEvaluation(evaluator, pickle.load(open(ground_truth_path, 'rb')))
+
+    def report():
+        if report_every and stream.num_users % report_every == 0:
+            print_summary(stream.jsds(), stream.num_users)
+
+    if trajdata_path.endswith(".jsonl"):
+        stream.update_from_store(trajdata_path, report)
+    else:
+        stream.add_users(DataLoader.load_generated(trajdata_path).items(), report)
+    print_summary(stream.jsds(), stream.num_users)
+    if follow is None or not trajdata_path.endswith(".jsonl"):
+        return stream
+    try:
+        while True:
+            time.sleep(follow)
+            if stream.update_from_store(trajdata_path):
+                print_summary(stream.jsds(), stream.num_users)
+    except KeyboardInterrupt:
+        pass
+    return stream
+
+
+def evaluate_bootstrap(evaluator, trajdata_path, num_resamples=1000, confidence=0.95, seed=0, compare_path=None,
+                       ground_truth_path=GROUND_TRUTH_PATH):
+    """
+    Bootstrap confidence intervals of the four JSDs, resampling users. With `compare_path`, the same resamples of the
+    users both result files have also give the JSDs of the other variant and the interval of the difference.
+    """
+    reals = pickle.load(open(ground_truth_path, 'rb'))
+    generated_sets = {path: dict(DataLoader.iter_generated(path))
+                      for path in [trajdata_path] + ([compare_path] if compare_path else [])}
+    users = [user for user in generated_sets[trajdata_path]
+             if user in reals and all(user in records for records in generated_sets.values())]
+    real = evaluator.user_histograms(*DataLoader.user_trajectories(reals, users, 'reals'), len(users))
+    results = {}
+    for path, records in generated_sets.items():
+        generated = evaluator.user_histograms(*DataLoader.user_trajectories(records, users, 'results'), len(users))
+        estimates = evaluator.histogram_jsds({name: counts.sum(axis=0) for name, counts in generated.items()},
+                                             {name: counts.sum(axis=0) for name, counts in real.items()})
+        results[path] = estimates, evaluator.bootstrap_jsds(generated, real, num_resamples, seed)
+
+    def print_intervals(title, estimates, samples):
+        print(f"********** {title} ***********")
+        for name in ("SI", "SD", "CD", "SGD"):
+            low, high = evaluator.bootstrap_interval(samples[name], confidence)
+            print(f"{name} : \t {estimates[name]:.4f} \t [{low:.4f}, {high:.4f}]")
+
+    print(f"{len(users)} users, {num_resamples} resamples, {confidence:.0%} intervals")
+    for path, (estimates, samples) in results.items():
+        print_intervals(path, estimates, samples)
+    if compare_path:
+        (estimates, samples), (other_estimates, other_samples) = results[trajdata_path], results[compare_path]
+        print_intervals(f"{trajdata_path} - {compare_path}",
+                        {name: estimates[name] - other_estimates[name] for name in estimates},
+                        {name: samples[name] - other_samples[name] for name in samples})
+    print("**************************************")
+    return results
+
+
+def evaluate(evaluator, trajdata_path, ground_truth_path=GROUND_TRUTH_PATH):
+    """
+    Batch evaluation: load every trajectory, parse each set once into columns and compute the four JSDs
+    """
+    fake_trajs, real_trajs = DataLoader.load_trajectory_data(trajdata_path, ground_truth_path)
+    # parse every trajectory once into columns; all four metrics are array operations on them
+    fake_trajs = evaluator.parse_columns(fake_trajs)
+    real_trajs = evaluator.parse_columns(real_trajs)
 
 
     doublecheckin_fake_trajs, doublecheckin_real_trajs = double_filter_multi_visit_trajectories(fake_trajs, real_trajs)
     onecheckin_fake_trajs, onecheckin_real_trajs = single_filter_multi_visit_trajectories(fake_trajs, real_trajs)
 
-    evaluator = Evaluation(location_map)
-    duration_jsd = evaluator.calc_duration_jsd(doublecheckin_real_trajs, doublecheckin_fake_trajs, granularity=10)
+    duration_jsd = evaluator.calc_duration_jsd(doublecheckin_real_trajs, doublecheckin_fake_trajs,
+                                               granularity=METRIC_SETTINGS["duration_granularity"])
     distance_step_jsd = evaluator.calc_distance_one_step_jsd(doublecheckin_real_trajs, doublecheckin_fake_trajs,
-                                                             max_distance=100, granularity=1)
+                                                             max_distance=METRIC_SETTINGS["max_distance"],
+                                                             granularity=METRIC_SETTINGS["distance_granularity"])
     category_jsd = evaluator.calc_category_jsd(onecheckin_fake_trajs, onecheckin_real_trajs)
-    sg_act_jsd = evaluator.calc_sg_act_jsd(onecheckin_fake_trajs, onecheckin_real_trajs, grid_count=100,
-                                           lon_range=(139.50, 139.90), lat_range=(35.50, 35.82))
+    sg_act_jsd = evaluator.calc_sg_act_jsd(onecheckin_fake_trajs, onecheckin_real_trajs,
+                                           grid_count=METRIC_SETTINGS["grid_count"],
+                                           lon_range=METRIC_SETTINGS["lon_range"], lat_range=METRIC_SETTINGS["lat_range"])
 
+    jsds = {"SI": duration_jsd, "SD": distance_step_jsd, "CD": category_jsd, "SGD": sg_act_jsd}
+    print_summary(jsds)
+    return jsds
 
-    print("********** RESULTS SUMMARY ***********")
-    print(f"SI : \t {duration_jsd:.4f}")
-    print(f"SD : \t {distance_step_jsd:.4f}")
-    print(f"CD : \t {category_jsd:.4f}")
-    print(f"SGD : \t {sg_act_jsd:.4f}")
-    print("**************************************")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--location-map", default=str(PROJECT_ROOT / "data" / "location_map_covid.pkl"),
+                        help="location map: the pickle, or its .locidx index")
+    parser.add_argument("--results", default="result.pkl",
+                        help="generated trajectories: result.pkl or a run's result.jsonl store")
+    parser.add_argument("--ground-truth", default=str(GROUND_TRUTH_PATH),
+                        help="real trajectories of the same users")
+    parser.add_argument("--stream", action="store_true",
+                        help="accumulate the metric histograms user by user instead of loading every trajectory")
+    parser.add_argument("--report-every", type=int, default=0,
+                        help="with --stream, also print the metrics every N users")
+    parser.add_argument("--follow", type=float, default=None, metavar="SECONDS",
+                        help="with --stream and a .jsonl store, keep polling the store for new users")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="RESAMPLES",
+                        help="confidence intervals of the metrics from this many bootstrap resamples of the users")
+    parser.add_argument("--confidence", type=float, default=0.95, help="coverage of the bootstrap intervals")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap resampling")
+    parser.add_argument("--compare", default=None,
+                        help="with --bootstrap, a second result file whose difference to --results gets an interval")
+    args = parser.parse_args()
+
+    trajdata_path = args.results
+    location_map = DataLoader.load_location_map(args.location_map)
+    evaluator = Evaluation(location_map)
+    if args.bootstrap:
+        evaluate_bootstrap(evaluator, trajdata_path, args.bootstrap, args.confidence, args.seed, args.compare,
+                           args.ground_truth)
+    elif args.stream:
+        evaluate_stream(evaluator, trajdata_path, args.report_every, args.follow, args.ground_truth)
+    else:
+        evaluate(evaluator, trajdata_path, args.ground_truth)
@@ -1,70 +1,207 @@
 from simulator.traj_generator import *
 from simulator.person_anonymized import *
+from simulator.result_store import *
+from simulator.batch_runner import *
+import argparse
+import asyncio
+import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from datetime import datetime, date, timedelta
 
 def ensure_dates(activities: list, dates: list) -> list:
-    existing = [
-        m.group(1)
-        for entry in activities
-        for m in [re.search(r'Activities at (\d{4}-\d{2}-\d{2})', entry)]
-        if m
-    ]
+    existing = {routine_ordinal(entry) for entry in activities}
     updated = activities.copy()
     for d in dates:
-        if d not in existing:
+        if routine_ordinal(d) not in existing:
             updated.append(f'Activities at {d}: ')
-    def extract_date(entry: str) -> str:
-        m = re.search(r'Activities at (\d{4}-\d{2}-\d{2})', entry)
-        return m.group(1) if m else ''
-    updated.sort(key=extract_date)
+    updated.sort(key=lambda entry: routine_ordinal(entry) or 0)
     return updated
 
+TRAIN_DAYS = (date(2020, 2, 7).toordinal(), date(2020, 4, 6).toordinal())
+TEST_DAYS = (date(2020, 4, 7).toordinal(), date(2020, 4, 13).toordinal())
+
 def filter_train(item_list):
     """Return activity entries whose date falls from 2020 02 07 through 2020 04 06 inclusive."""
-    filtered = []
-    for item in item_list:
-        m = re.search(r"Activities at (\d{4})-(\d{2})-(\d{2}):", item)
-        if not m:
-            continue
-        year, month, day = map(int, m.groups())
-        dt = datetime(year, month, day)
-        start = datetime(2020, 2, 7)
-        end   = datetime(2020, 4, 6)
-        if start <= dt <= end:
-            filtered.append(item)
-    return filtered
+    start, end = TRAIN_DAYS
+    return [item for item in item_list if start <= (routine_ordinal(item) or 0) <= end]
 
 
 def filter_test(item_list):
-    """Return activity entries whose date falls from 2020 02 07 through 2020 04 06 inclusive."""
-    filtered = []
-    for item in item_list:
-        m = re.search(r"Activities at (\d{4})-(\d{2})-(\d{2}):", item)
-        if not m:
-            continue
-        year, month, day = map(int, m.groups())
-        if year == 2020 and month == 4 and 7 <= day <= 13:
-            filtered.append(item)
-    return filtered
+    """Return activity entries whose date falls from 2020 04 07 through 2020 04 13 inclusive."""
+    start, end = TEST_DAYS
+    return [item for item in item_list if start <= (routine_ordinal(item) or 0) <= end]
 
-if __name__ == "__main__":
+def build_person(key, routine, days_to_check):
+    P = Person(key)
+    P.test_routine_list = ensure_dates(filter_test(routine[key]), days_to_check)
+    P.train_routine_list = filter_train(routine[key])
+    return P
+
+
+async def plan_users_async(planner, persons, concurrency, on_done=None):
+    """Plan many users at once, keeping at most `concurrency` of them waiting on the API.
+
+    Each user's days are still planned in order inside plan_new_day_async, because every
+    simulated day is appended to that user's training data before the next one.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def plan_one(P):
+        async with semaphore:
+            return P.name, await planner.plan_new_day_async(P)
+
+    results = {}
+    for finished in asyncio.as_completed([plan_one(P) for P in persons]):
+        name, trajectory = await finished
+        results[name] = trajectory
+        print(name)
+        if on_done is not None:
+            on_done(name, trajectory)
+    return results
+
+
+def plan_users(users, routine_path, days_to_check, store_path, concurrency=1, cache_settings=None,
+               client_settings=None, batch_backend=None, trace_path=None):
+    """Plan `users` with one DayPlanner, appending each finished user to the store at `store_path`.
+
+    With a batch_backend, all users advance together through bulk batch rounds instead.
+    Every stage call is traced to `trace_path` when it is given.
+    """
+    if cache_settings is not None:
+        configure_llm_cache(**cache_settings)
+    if client_settings is not None:
+        configure_llm_client(**client_settings)
+    configure_tracing(trace_path)
     planner = DayPlanner()
-    routinelist = open("data/activities_list_coordinate_covid", 'rb')
-    routine = pickle.load(routinelist)
+    if batch_backend is not None:
+        runner = BatchRunner(batch_backend, stage_settings=planner.stage_settings)
+        runner.run_steps({"events": planner.prepare_events_steps(days_to_check)})
+    else:
+        planner.prepare_events(days_to_check)
+    with open(routine_path, 'rb') as f:
+        routine = pickle.load(f)
+    store = ResultStore(store_path)
+    try:
+        if batch_backend is not None:
+            persons = [build_person(key, routine, days_to_check) for key in users]
+            runner.run(planner, persons, on_done=store.append)
+            if runner.failed:
+                print(f"{len(runner.failed)} users failed and are left for --resume: {sorted(runner.failed)}")
+        elif concurrency > 1:
+            persons = [build_person(key, routine, days_to_check) for key in users]
+            asyncio.run(plan_users_async(planner, persons, concurrency, on_done=store.append))
+        else:
+            for key in users:
+                print(key)
+                P = build_person(key, routine, days_to_check)
+                store.append(key, planner.plan_new_day(P))
+    finally:
+        store.close()
+        get_tracer().close()
+        print(f"llm cache: {get_llm_cache().stats()}")
+    return store_path
+
+
+def shard_users(user_list, num_shards):
+    """Split users into `num_shards` interleaved shards so heavy and light users spread evenly."""
+    return [user_list[i::num_shards] for i in range(num_shards)]
+
+
+def shard_path(store_path, shard_id, num_shards):
+    root, ext = os.path.splitext(store_path)
+    return f"{root}.shard{shard_id}-of-{num_shards}{ext}"
+
+
+def run_sharded(users, routine_path, days_to_check, store_path, num_shards, concurrency=1, cache_settings=None,
+                client_settings=None, trace_path=None):
+    """Plan each shard of users in its own worker process, each with its own store and trace file."""
+    if cache_settings is not None:
+        configure_llm_cache(**cache_settings)
+    if client_settings is not None:
+        configure_llm_client(**client_settings)
+        # every worker has its own rate limiter, so each gets an equal slice of the limits
+        client_settings = dict(client_settings)
+        for limit in ("requests_per_minute", "tokens_per_minute"):
+            if client_settings.get(limit) is not None:
+                client_settings[limit] = client_settings[limit] / num_shards
+    # summarise the events once here so the workers all read them from the registry file
+    configure_tracing(trace_path)
+    DayPlanner().prepare_events(days_to_check)
+    configure_tracing(None)
+    shards = shard_users(users, num_shards)
+    with ProcessPoolExecutor(max_workers=num_shards) as pool:
+        futures = [pool.submit(plan_users, shard, routine_path, days_to_check,
+                               shard_path(store_path, shard_id, num_shards), concurrency, cache_settings,
+                               client_settings, None, trace_path and shard_path(trace_path, shard_id, num_shards))
+                   for shard_id, shard in enumerate(shards)]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of users planned at once; 1 keeps the sequential loop")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="number of worker processes, each planning its own slice of users")
+    parser.add_argument("--store", default="result.jsonl",
+                        help="append-only store that receives one record per finished user")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip users that already have a record in the store")
+    parser.add_argument("--export-only", action="store_true",
+                        help="only compact the store into result.pkl")
+    parser.add_argument("--llm-cache", choices=CACHE_MODES, default="readwrite",
+                        help="readwrite reuses and stores responses, replay fails on any uncached prompt")
+    parser.add_argument("--llm-cache-path", default="llm_cache.sqlite")
+    parser.add_argument("--llm-cache-max-entries", type=int, default=None)
+    parser.add_argument("--llm-cache-max-age-days", type=float, default=None)
+    parser.add_argument("--rpm", type=float, default=None, help="requests-per-minute limit for the whole run")
+    parser.add_argument("--tpm", type=float, default=None, help="tokens-per-minute limit for the whole run")
+    parser.add_argument("--max-retries", type=int, default=None,
+                        help="retries of a transient API error before the call gives up")
+    parser.add_argument("--batch", action="store_true",
+                        help="plan all users through offline batch-file rounds instead of interactive calls")
+    parser.add_argument("--trace", default="trace.jsonl",
+                        help="JSONL file receiving one span per stage call; empty to disable tracing")
+    args = parser.parse_args()
+    if args.batch and args.shards > 1:
+        parser.error("--batch submits every user's prompts from one process; it cannot be combined with --shards")
+    cache_settings = {"path": args.llm_cache_path, "mode": args.llm_cache,
+                      "max_entries": args.llm_cache_max_entries, "max_age_days": args.llm_cache_max_age_days}
+    client_settings = {"requests_per_minute": args.rpm, "tokens_per_minute": args.tpm,
+                       "max_retries": args.max_retries}
+    trace_path = args.trace or None
+
+    routine_path = "data/activities_list_coordinate_covid"
     user_list = [f'user_{i}' for i in range(1100)]
-    trajectories = {}
     start_date = date(2020, 4, 7)
     num_days = 7
     days_to_check = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(num_days)]
-    for key in user_list:
-        P = Person(key)
-        print(key)
-        P.test_routine_list = ensure_dates(filter_test(routine[key]), days_to_check)
-        P.train_routine_list = filter_train(routine[key])
-        trajectories[str(P.name)] = planner.plan_new_day(P)
-        P.name = key
-        with open('result.pkl', 'wb') as f:
-            pickle.dump(trajectories, f)
+    if not args.export_only:
+        if args.resume:
+            done = completed_users(args.store)
+            users = [key for key in user_list if key not in done]
+            print(f"resuming: {len(done)} users already done, {len(users)} to go")
+        else:
+            for path in store_paths(args.store) + (store_paths(trace_path) if trace_path else []):
+                os.remove(path)
+            if args.llm_cache == "bypass":
+                # bypass asks the API afresh, so summaries and gists kept by earlier runs are not reused either
+                for path in (DayPlannerConfig.EVENT_REGISTRY_PATH, DayPlannerConfig.PATTERN_GIST_STORE_PATH):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+            users = user_list
+        if args.batch:
+            plan_users(users, routine_path, days_to_check, args.store, cache_settings=cache_settings,
+                       client_settings=client_settings, batch_backend=AzureBatchBackend(), trace_path=trace_path)
+        elif args.shards > 1:
+            run_sharded(users, routine_path, days_to_check, args.store, args.shards, args.concurrency,
+                        cache_settings, client_settings, trace_path)
+        else:
+            plan_users(users, routine_path, days_to_check, args.store, args.concurrency, cache_settings,
+                       client_settings, trace_path=trace_path)
+        if trace_path:
+            print_trace_summary(summarize_traces(trace_path))
+    export_results(args.store, user_list, 'result.pkl')
     print("done")
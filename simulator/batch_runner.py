@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from simulator.gpt_structure import *
+
+
+class LocalBatchBackend:
+    """Stand-in for the batch API: answers every line of a request file with `responder(body)`.
+
+    The result file has the same layout as the Batch API output, so BatchRunner cannot tell
+    the difference. A responder that raises marks that line as failed.
+    """
+    def __init__(self, responder):
+        self.responder = responder
+
+    def submit(self, input_path, output_path):
+        with open(input_path, 'r', encoding='utf-8') as src, open(output_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                request = json.loads(line)
+                try:
+                    contents = self.responder(request["body"])
+                    if isinstance(contents, str):
+                        contents = [contents]
+                    body = {"choices": [{"index": i, "message": {"role": "assistant", "content": content}}
+                                        for i, content in enumerate(contents)]}
+                    record = {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body},
+                              "error": None}
+                except Exception as e:
+                    record = {"custom_id": request["custom_id"], "response": None,
+                              "error": {"code": type(e).__name__, "message": str(e)}}
+                dst.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return output_path
+
+
+class AzureBatchBackend:
+    """Uploads a request file to the Azure OpenAI batch endpoint and waits for its results."""
+    def __init__(self, poll_interval=60, completion_window="24h"):
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def submit(self, input_path, output_path):
+        client = LLMClientPool().get_client()
+        with open(input_path, 'rb') as f:
+            batch_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(input_file_id=batch_file.id, endpoint="/chat/completions",
+                                      completion_window=self.completion_window)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = client.batches.retrieve(batch.id)
+            print(f"batch {batch.id}: {batch.status}")
+        if batch.status != "completed":
+            raise LLMRetryError(f"batch {batch.id} ended as {batch.status}")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(client.files.content(file_id).text)
+        return output_path
+
+
+class BatchRunner:
+    """Runs planning generators as a sequence of bulk rounds instead of interactive calls.
+
+    Each round collects the prompt every unfinished user is waiting on, writes them to one
+    request file with custom ids of the form user/date/stage/n, submits it to the backend
+    and feeds the answers back, which advances every user to its next stage. Answers go
+    through the response cache like execute_prompt, so cached prompts never reach a batch.
+    Model, temperature, max_tokens and response_format come from `stage_settings(stage)` (a planner's
+    stage_settings); a batch file goes to one endpoint, so the stages' backends are ignored.
+    A user whose generator raises (say, on a prompt that failed in every batch) is recorded in
+    `failed` and gets no result, so on_done never stores it and a resumed run plans it again.
+    """
+    def __init__(self, backend, work_dir="batches", model=DEFAULT_MODEL, temperature=0.1, max_retries=3,
+                 stage_settings=None):
+        self.backend = backend
+        self.work_dir = work_dir
+        self.model = model
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.stage_settings = stage_settings
+        self.rounds = 0
+        self.failed = {}
+        self._counters = {}
+
+    def run(self, planner, persons, on_done=None):
+        """Plan every person with `planner`; returns {name: trajectory}."""
+        if self.stage_settings is None:
+            self.stage_settings = planner.stage_settings
+        steps = {person.name: planner.plan_new_day_steps(person) for person in persons}
+        return self.run_steps(steps, on_done)
+
+    def run_steps(self, steps, on_done=None):
+        os.makedirs(self.work_dir, exist_ok=True)
+        results = {}
+        waiting = {}
+        for name, generator in steps.items():
+            self._advance(name, generator, None, None, waiting, results, on_done)
+        while waiting:
+            self.rounds += 1
+            answers, errors = self._run_round(waiting)
+            blocked, waiting = waiting, {}
+            for name, (generator, requests, ids) in blocked.items():
+                if name in errors:
+                    self._advance(name, generator, None, errors[name], waiting, results, on_done)
+                else:
+                    self._advance(name, generator, [answers[i] for i in ids], None, waiting, results, on_done)
+        return results
+
+    def _body(self, request):
+        """Chat completion request body for `request`, with its stage's model settings."""
+        if self.stage_settings is None:
+            model, temperature, max_tokens, response_format = self.model, self.temperature, None, None
+        else:
+            settings = self.stage_settings(request.stage)
+            model, temperature, max_tokens = settings["model"], settings["temperature"], settings["max_tokens"]
+            response_format = settings.get("response_format")
+        body = {"model": model, "messages": [{"role": "user", "content": request.prompt}], "temperature": temperature}
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if request.n != 1:
+            body["n"] = request.n
+        if response_format is not None:
+            body["response_format"] = response_format
+        return body
+
+    @staticmethod
+    def _cache_key(body):
+        return body["model"], body["messages"], body["temperature"]
+
+    @staticmethod
+    def _cache_options(body, request):
+        return body.get("max_tokens"), body.get("n", 1), body.get("response_format"), request.attempt
+
+    def _advance(self, name, generator, answers, error, waiting, results, on_done):
+        """Step a generator until it finishes or waits on prompts that are not cached."""
+        cache = get_llm_cache()
+        while True:
+            try:
+                requests = generator.throw(error) if error is not None else generator.send(answers)
+            except StopIteration as stop:
+                results[name] = stop.value
+                if on_done is not None:
+                    on_done(name, stop.value)
+                return
+            except FatalLLMError:
+                raise
+            except Exception as e:
+                # one user's failure ends only that user; the others keep advancing
+                print(f"{name} failed: {e}")
+                self.failed[name] = e
+                return
+            answers, error = [], None
+            for request in requests:
+                body = self._body(request)
+                answers.append(cache.get(*self._cache_key(body), *self._cache_options(body, request)))
+            if any(answer is None for answer in answers):
+                waiting[name] = (generator, requests, [])
+                return
+            for request in requests:
+                span = get_tracer().span(request.stage, name, request.date)
+                span.cached = True
+                span.finish(0.0)
+            answers = [unpack_answer(answer, request.n) for answer, request in zip(answers, requests)]
+
+    def _custom_ids(self, waiting):
+        # numbered per user/date/stage over the whole run, so a retried generation gets /2, /3, ...
+        for name, (generator, requests, ids) in waiting.items():
+            for request in requests:
+                base = f"{name}/{request.date}/{request.stage}"
+                self._counters[base] = self._counters.get(base, 0) + 1
+                ids.append(f"{base}/{self._counters[base]}")
+
+    def _run_round(self, waiting):
+        self._custom_ids(waiting)
+        lines = {}
+        for name, (generator, requests, ids) in waiting.items():
+            for request, custom_id in zip(requests, ids):
+                body = self._body(request)
+                lines[custom_id] = (name, request, body)
+
+        answers, failures = {}, {}
+        pending = dict(lines)
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            input_path = os.path.join(self.work_dir, f"round{self.rounds:04d}.try{attempt}.jsonl")
+            output_path = os.path.join(self.work_dir, f"round{self.rounds:04d}.try{attempt}.output.jsonl")
+            with open(input_path, 'w', encoding='utf-8') as f:
+                for custom_id, (name, request, body) in pending.items():
+                    f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/chat/completions",
+                                        "body": body}, ensure_ascii=False) + "\n")
+            print(f"batch round {self.rounds}: {len(pending)} prompts")
+            self.backend.submit(input_path, output_path)
+            for custom_id, record in self._read_results(output_path).items():
+                if custom_id not in pending:
+                    continue
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    failures[custom_id] = record.get("error") or response
+                    continue
+                name, request, body = pending.pop(custom_id)
+                failures.pop(custom_id, None)
+                choices = sorted(response["body"]["choices"], key=lambda choice: choice.get("index", 0))
+                contents = [choice["message"]["content"] for choice in choices]
+                text = pack_answer(contents[0] if request.n == 1 else contents, request.n)
+                get_llm_cache().put(*self._cache_key(body), text, *self._cache_options(body, request))
+                answers[custom_id] = unpack_answer(text, request.n)
+                span = get_tracer().span(request.stage, name, request.date)
+                span.retries = attempt
+                span.add_usage(response["body"].get("usage"))
+                span.finish(time.perf_counter() - started)
+
+        errors = {}
+        for custom_id, (name, request, body) in pending.items():
+            span = get_tracer().span(request.stage, name, request.date)
+            span.retries = self.max_retries
+            span.finish(time.perf_counter() - started, "LLMRetryError")
+            errors[name] = LLMRetryError(f"{custom_id} failed in every batch: {failures.get(custom_id)}")
+        return answers, errors
+
+    @staticmethod
+    def _read_results(output_path):
+        results = {}
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record["custom_id"]] = record
+        return results
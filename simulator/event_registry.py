@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class EventRegistry:
+    """Event schema and event gist, computed once per distinct event and kept on disk.
+
+    Summaries are keyed by the rendered schema and gist prompts and the two stages' LLM
+    settings, so editing the event context, either template or the model settings yields a
+    new entry instead of a stale one.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._summaries = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._summaries = json.load(f)
+
+    @staticmethod
+    def make_key(schema_prompt, gist_prompt, settings=None):
+        payload = f"{schema_prompt}\0{gist_prompt}"
+        if settings is not None:
+            payload += "\0" + json.dumps(settings, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (event_schema, event_gist) or None if the event has not been summarised yet."""
+        entry = self._summaries.get(key)
+        if entry is None:
+            return None
+        return entry["schema"], entry["gist"]
+
+    def put(self, key, context, schema, gist):
+        self._summaries[key] = {"context": context, "schema": schema, "gist": gist}
+        if self.path is not None:
+            # shard workers may write too: keep what they added since we read the file, and give
+            # every writer its own temporary file so none replaces the file with another's half
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._summaries = {**json.load(f), **self._summaries}
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                            prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._summaries, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def __len__(self):
+        return len(self._summaries)
@@ -1,57 +1,143 @@
 import re
-from openai import AzureOpenAI
+import asyncio
+import json
 import time
 from utils import *
+from simulator.llm_client import *
+from simulator.llm_cache import *
+from simulator.prompt_registry import *
+from simulator.llm_backends import *
+from simulator.tracing import *
+
+AZURE_ENDPOINT = ""
+AZURE_API_KEY = ""
+AZURE_API_VERSION = ""
+DEFAULT_MODEL = "gpt-4o-mini"
+configure_llm_client(azure_endpoint=AZURE_ENDPOINT, api_key=AZURE_API_KEY, api_version=AZURE_API_VERSION)
+_llm_cache = LLMCache(mode="bypass")
+_llm_backend = AzureBackend()
+_named_backends = {}
+
+
+def configure_llm_cache(path="llm_cache.sqlite", mode="readwrite", max_entries=None, max_age_days=None):
+    """Route execute_prompt through an on-disk response cache; mode is readwrite, replay or bypass."""
+    global _llm_cache
+    _llm_cache.close()
+    _llm_cache = LLMCache(path, mode, max_entries, max_age_days)
+    return _llm_cache
+
+
+def get_llm_cache():
+    return _llm_cache
+
+
+def set_llm_backend(backend):
+    """Answer execute_prompt from `backend` (an object with complete/complete_async), e.g. StubBackend()."""
+    global _llm_backend
+    _llm_backend = backend
+    return _llm_backend
+
+
+def register_llm_backend(name, backend):
+    """Make `backend` available to stages whose settings name it, e.g. a cheaper endpoint for the gists."""
+    _named_backends[name] = backend
+    return backend
+
+
+def get_llm_backend(name=None):
+    if name is None:
+        return _llm_backend
+    if name not in _named_backends:
+        raise FatalLLMError(f"no LLM backend registered as {name!r}")
+    return _named_backends[name]
+
+
+def pack_answer(answer, n=1):
+    """Cache text of a reply; the n replies of a multi-candidate request are stored as a JSON list."""
+    return answer if n == 1 else json.dumps(answer, ensure_ascii=False)
+
+
+def unpack_answer(text, n=1):
+    return text.strip() if n == 1 else [answer.strip() for answer in json.loads(text)]
+
 
 def generate_prompt(curr_input, prompt_lib_file):
     """Build a cleaned prompt by inserting inputs into a template then normalizing times casing and whitespace."""
-    if type(curr_input) == type("string"):
-        curr_input = [curr_input]
-    curr_input = [str(i) for i in curr_input]
-
-    f = open(prompt_lib_file, "r", encoding='utf-8')
-    prompt = f.read()
-    f.close()
-    for count, i in enumerate(curr_input):
-        if i == 'None':
-            i = ""
-        prompt = prompt.replace(f"!<INPUT {count}>!", i)
-    if "<commentblockmarker>###</commentblockmarker>" in prompt:
-        prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
-    pattern = r"(\d{2}:\d{2}):00"
-
-    modified_prompt = re.sub(pattern, r"\1", prompt)
-    modified_prompt = re.sub(r'\bYou\b', 'you', modified_prompt, flags=re.IGNORECASE)
-    modified_prompt = re.sub(r'\bYour\b', 'your', modified_prompt, flags=re.IGNORECASE)
-    cleaned_prompt = '\n'.join([line for line in modified_prompt.split('\n') if line.strip()])
-    return cleaned_prompt.strip()
-
-
-def execute_prompt(prompt, objective, history=None, temperature=0.1):
-    """Send the prompt to Azure OpenAI chat API and simple retry then return the reply text."""
-    response = None
-    while response is None:
+    return get_prompt_registry().get(prompt_lib_file).render(curr_input)
+
+
+def execute_prompt(prompt, objective, history=None, temperature=0.1, stage=None, model=DEFAULT_MODEL,
+                   max_tokens=None, backend=None, n=1, span=None, response_format=None, attempt=0):
+    """Send the prompt to the configured backend (Azure OpenAI by default), retrying transient errors with backoff, and return the reply text.
+
+    `stage` names the planner stage asking; model, max_tokens and the registered `backend`
+    name come from that stage's settings (see DayPlannerConfig.STAGE_SETTINGS). With n > 1
+    the backend samples n candidate replies in one call and a list of them is returned.
+    `response_format` (the API's JSON mode or structured output) is passed on only when set.
+    A tracing `span` receives the token usage, the retry count and whether the cache answered.
+    `attempt` counts how often the planner already rejected the reply to this very prompt; it
+    joins the cache key, so asking again reaches the backend instead of the rejected reply.
+    """
+    messages = [{"role": "user", "content": prompt}] if history is None else history
+    cached = _llm_cache.get(model, messages, temperature, max_tokens, n, response_format, attempt)
+    if cached is not None:
+        if span is not None:
+            span.cached = True
+        return unpack_answer(cached, n)
+    pool = LLMClientPool()
+    llm_backend = get_llm_backend(backend)
+    reserve = estimate_tokens(messages, (500 if max_tokens is None else max_tokens) * n)
+    options = {} if response_format is None else {"response_format": response_format}
+    retries = 0
+    while True:
+        pool.rate_limiter.acquire(reserve)
+        try:
+            answer, usage = llm_backend.complete(messages, model, temperature, max_tokens, n, **options)
+            break
+        except Exception as e:
+            delay = pool.retry_delay(e, retries)
+            print(e if stage is None else f"{stage}: {e}")
+            print(f'Retrying in {delay:.1f}s...')
+            time.sleep(delay)
+            retries += 1
+            if span is not None:
+                span.retries = retries
+    if span is not None:
+        span.add_usage(usage)
+    text = pack_answer(answer, n)
+    _llm_cache.put(model, messages, temperature, text, max_tokens, n, response_format, attempt)
+    return unpack_answer(text, n)
+
+
+async def execute_prompt_async(prompt, objective, history=None, temperature=0.1, stage=None, model=DEFAULT_MODEL,
+                               max_tokens=None, backend=None, n=1, span=None, response_format=None, attempt=0):
+    """Async counterpart of execute_prompt so many users can wait on the API at once."""
+    messages = [{"role": "user", "content": prompt}] if history is None else history
+    cached = _llm_cache.get(model, messages, temperature, max_tokens, n, response_format, attempt)
+    if cached is not None:
+        if span is not None:
+            span.cached = True
+        return unpack_answer(cached, n)
+    pool = LLMClientPool()
+    llm_backend = get_llm_backend(backend)
+    reserve = estimate_tokens(messages, (500 if max_tokens is None else max_tokens) * n)
+    options = {} if response_format is None else {"response_format": response_format}
+    retries = 0
+    while True:
+        await pool.rate_limiter.acquire_async(reserve)
         try:
-            client = AzureOpenAI(azure_endpoint="",
-            api_key="",
-            api_version="")
-            if history is None:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=temperature,
-                )
-            else:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=history,
-                    temperature=temperature
-                )
+            answer, usage = await llm_backend.complete_async(messages, model, temperature, max_tokens, n, **options)
+            break
         except Exception as e:
-            print(e)
-            print('Retrying...')
-            time.sleep(2)
-    answer = response.choices[0].message.content
-    return answer.strip()
+            delay = pool.retry_delay(e, retries)
+            print(e if stage is None else f"{stage}: {e}")
+            print(f'Retrying in {delay:.1f}s...')
+            await asyncio.sleep(delay)
+            retries += 1
+            if span is not None:
+                span.retries = retries
+    if span is not None:
+        span.add_usage(usage)
+    text = pack_answer(answer, n)
+    _llm_cache.put(model, messages, temperature, text, max_tokens, n, response_format, attempt)
+    return unpack_answer(text, n)
@@ -0,0 +1,101 @@
+import re
+from datetime import date as calendar_date
+
+_DATE_PATTERN = re.compile(r"Activities at (\d{4}-\d{2}-\d{2})")
+_VISIT_PATTERN = re.compile(r"\s*([^,]+?#\d+) at (\d{1,2}):(\d{2})(?::\d{2})?")
+
+
+def estimate_text_tokens(text):
+    """About 4 characters per token, the same rule as estimate_tokens for whole prompts."""
+    return len(text) // 4
+
+
+def parse_routine(routine):
+    """Split one 'Activities at DATE: POI #n at HH:MM:SS, ...' entry into its date and (POI, minutes) visits."""
+    match = _DATE_PATTERN.search(routine)
+    date = match.group(1) if match else None
+    body = routine.split(": ", 1)[1] if ": " in routine else ""
+    visits = [(poi.strip(), int(hour) * 60 + int(minute)) for poi, hour, minute in _VISIT_PATTERN.findall(body)]
+    return date, visits
+
+
+def _clock(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _place_lines(days, budget):
+    """Places of `days` ranked by the number of days they were visited, with their usual time."""
+    visited = {}
+    for date, visits in days:
+        for poi in dict.fromkeys(poi for poi, minutes in visits):
+            visited.setdefault(poi, []).append(min(minutes for name, minutes in visits if name == poi))
+    ranked = sorted(visited.items(), key=lambda item: (-len(item[1]), item[0]))
+    entries = []
+    for poi, times in ranked:
+        times = sorted(times)
+        entries.append(f"{poi} ({len(times)} days, usually {_clock(times[len(times) // 2])})")
+    return _fit(entries, budget, "more places")
+
+
+def _template_lines(days, budget):
+    """Distinct sequences of places (times dropped), most frequent first."""
+    templates = {}
+    for date, visits in days:
+        key = " -> ".join(poi for poi, minutes in visits) or "no visits"
+        templates[key] = templates.get(key, 0) + 1
+    ranked = sorted(templates.items(), key=lambda item: (-item[1], item[0]))
+    return _fit([f"[{count} days] {key}" for key, count in ranked], budget, "more day patterns")
+
+
+def _fit(entries, budget, what):
+    """Keep the leading entries that fit in `budget` tokens and count the rest."""
+    kept, used = [], 0
+    for entry in entries:
+        cost = estimate_text_tokens(entry) + 1
+        if used + cost > budget:
+            break
+        kept.append(entry)
+        used += cost
+    text = "; ".join(kept)
+    if len(kept) < len(entries):
+        text += f" (+{len(entries) - len(kept)} {what})"
+    return text
+
+
+def compact_routines(routines, token_budget):
+    """Return `routines` unchanged if they fit in `token_budget` tokens, otherwise a compact summary.
+
+    The summary keeps the places ranked by how often they were visited on weekdays and on
+    weekends, the recurring day patterns with their counts, and then as many of the most
+    recent routines verbatim as the remaining budget allows; what is left out is counted.
+    """
+    if token_budget is None or estimate_text_tokens(str(routines)) <= token_budget:
+        return routines
+    parsed = [parse_routine(routine) for routine in routines]
+    dated = [(date, visits) for date, visits in parsed if date is not None]
+    is_weekday = [calendar_date.fromisoformat(date).weekday() < 5 for date, visits in dated]
+    weekdays = [day for day, weekday in zip(dated, is_weekday) if weekday]
+    weekends = [day for day, weekday in zip(dated, is_weekday) if not weekday]
+    dates = sorted(date for date, visits in dated)
+
+    lines = [f"Summary of {len(routines)} days" + (f" from {dates[0]} to {dates[-1]}:" if dates else ":")]
+    lines.append(f"Weekday places: {_place_lines(weekdays, token_budget // 5)}")
+    lines.append(f"Weekend places: {_place_lines(weekends, token_budget // 10)}")
+    lines.append(f"Day patterns: {_template_lines(dated, token_budget // 5)}")
+    remaining = token_budget - estimate_text_tokens("\n".join(lines)) - 16
+    # the most recent days are kept verbatim, listed in the order they were given
+    newest_first = sorted(range(len(routines)), key=lambda i: parsed[i][0] or "", reverse=True)
+    chosen = set()
+    for i in newest_first:
+        cost = estimate_text_tokens(routines[i]) + 1
+        if cost > remaining:
+            break
+        chosen.add(i)
+        remaining -= cost
+    kept = [routine for i, routine in enumerate(routines) if i in chosen]
+    if kept:
+        lines.append("Days in full:")
+        lines.extend(kept)
+    if len(kept) < len(routines):
+        lines.append(f"({len(routines) - len(kept)} more days summarised above)")
+    return "\n".join(lines)
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from simulator.llm_client import *
+
+
+class AzureBackend:
+    """Chat completions from Azure OpenAI.
+
+    Without settings it uses the process-wide client pool (the endpoint in gpt_structure);
+    with azure_endpoint/api_key/api_version it talks to that endpoint with its own clients,
+    e.g. a cheaper deployment for the gist stages.
+    """
+    def __init__(self, azure_endpoint=None, api_key=None, api_version=None):
+        settings = dict(azure_endpoint=azure_endpoint, api_key=api_key, api_version=api_version)
+        self.settings = None if all(value is None for value in settings.values()) else settings
+        self._clients = {}
+
+    def _client(self, is_async):
+        if self.settings is None:
+            pool = LLMClientPool()
+            return pool.get_async_client() if is_async else pool.get_client()
+        key = (os.getpid(), asyncio.get_running_loop() if is_async else None)
+        client = self._clients.get(key)
+        if client is None:
+            client_class = AsyncAzureOpenAI if is_async else AzureOpenAI
+            client = self._clients[key] = client_class(**self.settings, max_retries=0)
+        return client
+
+    @staticmethod
+    def _request(messages, model, temperature, max_tokens, n, response_format):
+        request = dict(model=model, messages=messages, temperature=temperature)
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+        if n != 1:
+            request["n"] = n
+        if response_format is not None:
+            request["response_format"] = response_format
+        return request
+
+    @staticmethod
+    def _contents(response, n):
+        if n == 1:
+            return response.choices[0].message.content
+        return [choice.message.content for choice in sorted(response.choices, key=lambda choice: choice.index)]
+
+    def complete(self, messages, model, temperature, max_tokens=None, n=1, response_format=None):
+        """The reply text (a list of n replies when n > 1) and the response's token usage."""
+        response = self._client(False).chat.completions.create(
+            **self._request(messages, model, temperature, max_tokens, n, response_format))
+        return self._contents(response, n), response.usage
+
+    async def complete_async(self, messages, model, temperature, max_tokens=None, n=1, response_format=None):
+        response = await self._client(True).chat.completions.create(
+            **self._request(messages, model, temperature, max_tokens, n, response_format))
+        return self._contents(response, n), response.usage
+
+
+class StubTransientError(TransientLLMError):
+    """Injected by StubBackend; classified as retryable like a rate limit or timeout."""
+
+
+class StubBackend:
+    """Local, deterministic stand-in for the LLM, for load tests and for exercising retries.
+
+    Replies are well-formed for each template: generation/regeneration get a {"plan", "reason"}
+    object built from POIs that appear in the prompt (so valid_generation accepts it),
+    reflection gets the two coherence booleans, and the gist templates get short text.
+    latency is "constant", "uniform", "exponential" or "lognormal" around latency_mean
+    seconds; failure_rate raises StubTransientError and malformed_rate returns broken JSON
+    (a truncated object, one wrapped in a code fence and prose, or a refusal), except when a
+    response_format asks for JSON mode.
+    defect_rate gives single plan items a trivial defect (an AM/PM time, no space before '#'
+    or a lower-case name) that PlanValidator can repair locally.
+    Every draw is seeded from the prompt and how often it was asked, so a run is repeatable
+    whatever the order in which concurrent users reach the backend.
+    """
+    _VISIT_PATTERN = re.compile(r" (#\d+) at (\d{1,2}:\d{2})")
+    _NAME_DELIMITERS = ",:[]'\"\n"
+
+    def __init__(self, latency="constant", latency_mean=0.0, latency_sigma=0.5, failure_rate=0.0,
+                 malformed_rate=0.0, reflection_pass_rate=0.8, seed=0, defect_rate=0.0):
+        if latency not in ("constant", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"unknown latency distribution {latency!r}")
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.defect_rate = defect_rate
+        self.reflection_pass_rate = reflection_pass_rate
+        self.seed = seed
+        self.calls = 0
+        self._asked = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, messages):
+        prompt = messages[-1]["content"]
+        digest = hashlib.sha256(f"{self.seed}\0{prompt}".encode('utf-8')).hexdigest()
+        with self._lock:
+            self.calls += 1
+            count = self._asked.get(digest, 0)
+            self._asked[digest] = count + 1
+        return random.Random(f"{digest}/{count}"), prompt
+
+    def _delay(self, rng):
+        if self.latency_mean <= 0:
+            return 0.0
+        if self.latency == "uniform":
+            return rng.uniform(0, 2 * self.latency_mean)
+        if self.latency == "exponential":
+            return rng.expovariate(1 / self.latency_mean)
+        if self.latency == "lognormal":
+            return self.latency_mean * rng.lognormvariate(-self.latency_sigma ** 2 / 2, self.latency_sigma)
+        return self.latency_mean
+
+    def _reply(self, rng, prompt, n=1, response_format=None):
+        if rng.random() < self.failure_rate:
+            raise StubTransientError("stub: injected transient failure")
+        if n == 1:
+            return self._content(rng, prompt, response_format)
+        return [self._content(rng, prompt, response_format) for _ in range(n)]
+
+    def _content(self, rng, prompt, response_format=None):
+        malformed = rng.random() < self.malformed_rate and response_format is None
+        if '"plan"' in prompt and '"reason"' in prompt:
+            reply = json.dumps({"plan": self._plan(rng, prompt), "reason": "Stub plan following the user's routine."})
+        elif "coherence_with_pattern" in prompt:
+            passed = rng.random() < self.reflection_pass_rate
+            reply = json.dumps({"coherence_with_pattern": passed, "coherence_with_event": True,
+                                "reason": "Stub reflection."})
+        else:
+            return f"**Gist:** stub summary {rng.randrange(10 ** 6)}."
+        if malformed:
+            reply = rng.choice([reply[:len(reply) // 2], f"Here is the plan:\n```json\n{reply}\n```", "I cannot help."])
+        return reply
+
+    def _plan(self, rng, prompt):
+        pois = {}
+        for match in self._VISIT_PATTERN.finditer(prompt):
+            # the POI name runs back from " #id" to the previous list or time delimiter
+            head = match.start()
+            start = max(prompt.rfind(c, max(0, head - 80), head) for c in self._NAME_DELIMITERS) + 1
+            name = prompt[start:head].strip()
+            if name:
+                pois.setdefault((f"{name} {match.group(1)}", match.group(2)), None)
+        pois = list(pois)
+        if not pois:
+            return []
+        visits = sorted(rng.sample(pois, min(len(pois), rng.randint(1, 4))), key=lambda poi: poi[1].zfill(5))
+        plan = [f"{name} at {visit_time}" for name, visit_time in visits]
+        if self.defect_rate > 0:
+            plan = [self._defect(rng, item) if rng.random() < self.defect_rate else item for item in plan]
+        return plan
+
+    @staticmethod
+    def _defect(rng, item):
+        location, visit_time = item.rsplit(" at ", 1)
+        defect = rng.choice(["am_pm", "hash_spacing", "case"])
+        if defect == "am_pm":
+            hour, minute = map(int, visit_time.split(":"))
+            return f"{location} at {(hour - 1) % 12 + 1}:{minute:02d} {'PM' if hour >= 12 else 'AM'}"
+        if defect == "hash_spacing":
+            return f"{location.replace(' #', '#')} at {visit_time}"
+        return f"{location.lower()} at {visit_time}"
+
+    @staticmethod
+    def _usage(prompt, reply):
+        # about 4 characters per token, like estimate_tokens
+        completion = reply if isinstance(reply, str) else ''.join(reply)
+        return reply, {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(completion) // 4}
+
+    def complete(self, messages, model, temperature, max_tokens=None, n=1, response_format=None):
+        rng, prompt = self._rng(messages)
+        delay = self._delay(rng)
+        if delay:
+            time.sleep(delay)
+        return self._usage(prompt, self._reply(rng, prompt, n, response_format))
+
+    async def complete_async(self, messages, model, temperature, max_tokens=None, n=1, response_format=None):
+        rng, prompt = self._rng(messages)
+        delay = self._delay(rng)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._usage(prompt, self._reply(rng, prompt, n, response_format))
+
+    def respond(self, body):
+        """Responder for LocalBatchBackend: answers a batch request body, without the latency."""
+        rng, prompt = self._rng(body["messages"])
+        return self._reply(rng, prompt, body.get("n", 1), body.get("response_format"))
+
+
+LLM_BACKENDS = {"azure": AzureBackend, "stub": StubBackend}
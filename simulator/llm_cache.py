@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from simulator.llm_client import FatalLLMError
+
+CACHE_MODES = ("readwrite", "replay", "bypass")
+
+
+class CacheMiss(FatalLLMError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+
+class LLMCache:
+    """On-disk, content-addressed store of chat completions keyed by model, messages and sampling options.
+
+    mode="readwrite" answers from the cache and stores every new response, "replay" only
+    answers from the cache and raises CacheMiss otherwise, "bypass" never touches it.
+    Entries older than max_age_days are dropped, and once there are more than max_entries
+    the least recently used ones are evicted. `attempt` numbers the times the same prompt is
+    asked again after its reply was rejected, so a retry is not answered with that reply.
+    """
+    EVICT_EVERY = 1000
+
+    def __init__(self, path="llm_cache.sqlite", mode="readwrite", max_entries=None, max_age_days=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens=None, n=1, response_format=None, attempt=0):
+        fields = [model, messages, temperature]
+        # options only join the key when set, so entries cached before they existed still match
+        options = {name: value for name, value in (("max_tokens", max_tokens), ("response_format", response_format))
+                   if value is not None}
+        if n != 1:
+            options["n"] = n
+        if attempt:
+            options["attempt"] = attempt
+        if options:
+            fields.append(options)
+        payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        # connections cannot be shared with forked workers, so each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            if self.mode == "replay":
+                self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, model TEXT, answer TEXT, created_at REAL, last_used REAL)")
+                self._conn.commit()
+                self._evict()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, model, messages, temperature, max_tokens=None, n=1, response_format=None, attempt=0):
+        """Return the cached answer, None on a miss, or raise CacheMiss in replay mode."""
+        if self.mode == "bypass":
+            return None
+        key = self.make_key(model, messages, temperature, max_tokens, n, response_format, attempt)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT answer FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CacheMiss(f"no cached response for prompt {key[:12]} in {self.path}")
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            return row[0]
+
+    def put(self, model, messages, temperature, answer, max_tokens=None, n=1, response_format=None, attempt=0):
+        if self.mode != "readwrite":
+            return
+        key = self.make_key(model, messages, temperature, max_tokens, n, response_format, attempt)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, model, answer, now, now))
+            conn.commit()
+            self.writes += 1
+            if self.writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        conn = self._conn
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+        if self.max_entries is not None:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import openai
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from utils import Singleton
+
+
+class FatalLLMError(Exception):
+    """An error that retrying cannot fix and that every prompt would hit (bad key, unknown deployment, ...)."""
+
+
+class LLMRetryError(Exception):
+    """A retryable error that persisted through the whole retry budget."""
+
+
+class LLMRequestError(Exception):
+    """The API refused this one prompt (400/422: context length, content filter, ...); only its user-day falls back."""
+
+
+class TransientLLMError(Exception):
+    """Base of errors raised by local backends that are worth retrying, like a rate limit or timeout."""
+
+
+# credentials or configuration: every later prompt would fail the same way, so the run stops
+FATAL_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+REQUEST_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+TRANSIENT_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError, TransientLLMError, OSError, asyncio.TimeoutError)
+# 409 is a lock conflict on the server side, which the OpenAI client also retries
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(error):
+    """Only known transient errors are retried; anything else (a TypeError, say) is a bug and raises."""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError) and not isinstance(error, FATAL_ERRORS + REQUEST_ERRORS):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from the retry-after(-ms) headers, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by every caller in the process.
+
+    reserve() takes the capacity immediately and returns how long the caller has to wait
+    for it, so concurrent callers queue up behind each other instead of bursting together.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self._lock = threading.Lock()
+        self._buckets = []
+        for limit in (requests_per_minute, tokens_per_minute):
+            self._buckets.append(None if limit is None else [float(limit), float(limit), time.monotonic()])
+
+    def reserve(self, tokens):
+        wait = 0.0
+        with self._lock:
+            now = time.monotonic()
+            for bucket, cost in zip(self._buckets, (1, tokens)):
+                if bucket is None:
+                    continue
+                capacity, level, last = bucket
+                rate = capacity / 60.0
+                level = min(capacity, level + (now - last) * rate) - min(cost, capacity)
+                bucket[1], bucket[2] = level, now
+                if level < 0:
+                    wait = max(wait, -level / rate)
+        return wait
+
+    def acquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def estimate_tokens(messages, completion_tokens=500):
+    """Rough prompt size (4 characters per token) plus an allowance for the reply."""
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + completion_tokens
+
+
+class LLMClientPool(metaclass=Singleton):
+    """Process-wide Azure OpenAI clients, so HTTP connections are reused across calls.
+
+    The synchronous client is shared by every thread; async clients are bound to the event
+    loop that created them. Forked workers notice the new pid and build their own.
+    """
+    def __init__(self):
+        self.azure_endpoint = ""
+        self.api_key = ""
+        self.api_version = ""
+        self.max_retries = 8
+        self.backoff_base = 1.0
+        self.backoff_cap = 60.0
+        self.rate_limiter = RateLimiter()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._async_clients = {}
+
+    def configure(self, azure_endpoint=None, api_key=None, api_version=None, max_retries=None,
+                  requests_per_minute=None, tokens_per_minute=None):
+        with self._lock:
+            if azure_endpoint is not None:
+                self.azure_endpoint = azure_endpoint
+            if api_key is not None:
+                self.api_key = api_key
+            if api_version is not None:
+                self.api_version = api_version
+            if max_retries is not None:
+                self.max_retries = max_retries
+            if requests_per_minute is not None or tokens_per_minute is not None:
+                self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+            self._client = None
+            self._async_clients = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._client = None
+            self._async_clients = {}
+
+    def _client_settings(self):
+        # retries are ours (classified, with jitter), so the SDK's own retry loop is disabled
+        return dict(azure_endpoint=self.azure_endpoint, api_key=self.api_key, api_version=self.api_version,
+                    max_retries=0)
+
+    def get_client(self):
+        with self._lock:
+            self._check_pid()
+            if self._client is None:
+                self._client = AzureOpenAI(**self._client_settings())
+            return self._client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._check_pid()
+            client = self._async_clients.get(loop)
+            if client is None:
+                for old_loop in [old for old in self._async_clients if old.is_closed()]:
+                    del self._async_clients[old_loop]
+                client = self._async_clients[loop] = AsyncAzureOpenAI(**self._client_settings())
+            return client
+
+    def retry_delay(self, error, attempt):
+        """Seconds to wait before retry `attempt`, or raise if the error should not be retried."""
+        if isinstance(error, FatalLLMError):
+            raise error
+        if isinstance(error, FATAL_ERRORS):
+            raise FatalLLMError(f"{type(error).__name__}: {error}") from error
+        if isinstance(error, REQUEST_ERRORS):
+            raise LLMRequestError(f"{type(error).__name__}: {error}") from error
+        if not is_retryable(error):
+            raise error
+        if attempt >= self.max_retries:
+            raise LLMRetryError(f"gave up after {attempt + 1} attempts: {type(error).__name__}: {error}") from error
+        delay = retry_after(error)
+        if delay is None:
+            # full jitter keeps concurrent callers from retrying in lockstep
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        return delay
+
+
+def configure_llm_client(**settings):
+    """Set endpoint, key, API version, retry budget and requests/tokens-per-minute limits."""
+    LLMClientPool().configure(**settings)
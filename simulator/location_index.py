@@ -0,0 +1,144 @@
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+_MAGIC = b"ELLMLOC2"
+# magic, number of locations, width of the name slots, then padding up to the arrays
+_HEADER = 64
+_WORD_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_MIX_MULTIPLIERS = (np.uint64(0xFF51AFD7ED558CCD), np.uint64(0xC4CEB9FE1A85EC53))
+
+
+def hash_names(words):
+    """64-bit hashes of names given as an n x k array of little-endian uint64 words (the
+    UTF-8 bytes, NUL-padded to k words): a multiply-rotate over the words, then the
+    MurmurHash3 finaliser, all vectorised over the names."""
+    h = np.zeros(len(words), dtype=np.uint64)
+    for column in range(words.shape[1]):
+        h ^= words[:, column] * _WORD_MULTIPLIER
+        h = (h << np.uint64(31)) | (h >> np.uint64(33))
+        h *= _MIX_MULTIPLIERS[0]
+    for multiplier in _MIX_MULTIPLIERS:
+        h ^= h >> np.uint64(33)
+        h *= multiplier
+    h ^= h >> np.uint64(33)
+    return h
+
+
+def _name_words(encoded, width):
+    """The names as an n x width/8 array of uint64 words, and which of them fit in `width` bytes
+    (a NUL byte would be lost in the padding, so names holding one do not fit)."""
+    fits = np.fromiter((len(name) <= width and b'\0' not in name for name in encoded), dtype=bool, count=len(encoded))
+    names = np.array(encoded, dtype=f'S{width}') if encoded else np.zeros(0, dtype=f'S{width}')
+    return names.view('<u8').reshape(len(encoded), width // 8), fits
+
+
+class LocationIndex:
+    """A location map (name -> (lng, lat)) in the compact file written by convert_location_map.
+
+    The file holds, sorted by a 64-bit hash of the name, the hashes, the UTF-8 names in
+    fixed-width NUL-padded slots and the float64 lng/lat. All three are opened read-only
+    with np.memmap, so opening is instant and worker processes share the pages instead of
+    each unpickling its own dict. lookup() finds a whole array of names at once: hash them,
+    np.searchsorted into the hashes, then compare the names to rule out collisions; repeated
+    names are looked up once. get() keeps the dict interface Evaluation has always used.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER)
+        if header[:8] != _MAGIC:
+            raise ValueError(f"{path} is not a location index")
+        count, width = (int(v) for v in np.frombuffer(header, dtype='<u8', count=2, offset=8))
+        self.width = width
+        if count:
+            self.hashes = np.memmap(path, dtype='<u8', mode='r', offset=_HEADER, shape=(count,))
+            self.words = np.memmap(path, dtype='<u8', mode='r', offset=_HEADER + 8 * count,
+                                   shape=(count, width // 8))
+            self.lnglat = np.memmap(path, dtype='<f8', mode='r', offset=_HEADER + (8 + width) * count,
+                                    shape=(count, 2))
+        else:
+            self.hashes = np.zeros(0, dtype='<u8')
+            self.words = np.zeros((0, width // 8), dtype='<u8')
+            self.lnglat = np.zeros((0, 2))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, names):
+        """(lnglat, found): the n x 2 coordinates of `names` (NaN where unknown) and which were found."""
+        distinct = {}
+        inverse = np.array([distinct.setdefault(name, len(distinct)) for name in names], dtype=np.int64)
+        words, found = _name_words([name.encode('utf-8') for name in distinct], self.width)
+        lnglat = np.full((len(words), 2), np.nan)
+        if len(self.hashes):
+            positions = np.minimum(np.searchsorted(self.hashes, hash_names(words)), len(self.hashes) - 1)
+            found &= (self.words[positions] == words).all(axis=1)
+            lnglat[found] = self.lnglat[positions[found]]
+        else:
+            found[:] = False
+        return lnglat[inverse], found[inverse]
+
+    def get(self, name, default=None):
+        lnglat, found = self.lookup([name])
+        return (float(lnglat[0, 0]), float(lnglat[0, 1])) if found[0] else default
+
+    def __getitem__(self, name):
+        point = self.get(name)
+        if point is None:
+            raise KeyError(name)
+        return point
+
+    def __contains__(self, name):
+        return isinstance(name, str) and bool(self.lookup([name])[1][0])
+
+    def keys(self):
+        return [name.decode('utf-8') for name in np.asarray(self.words).view(f'S{self.width}').ravel()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return zip(self.keys(), map(tuple, self.lnglat.tolist()))
+
+
+def write_location_index(location_map, path):
+    """Write a {name: (lng, lat)} map as a LocationIndex file."""
+    encoded = [name.encode('utf-8') for name in location_map]
+    width = max(8, -(-max((len(name) for name in encoded), default=0) // 8) * 8)
+    words, fits = _name_words(encoded, width)
+    if not fits.all():
+        raise ValueError("location names cannot hold NUL characters")
+    hashes = hash_names(words)
+    order = np.argsort(hashes, kind='stable')
+    if len(hashes) and (np.diff(hashes[order]) == 0).any():
+        raise ValueError("two location names share a 64-bit hash")
+    lnglat = np.array(list(location_map.values()), dtype='<f8').reshape(-1, 2)
+    header = _MAGIC + np.array([len(encoded), width], dtype='<u8').tobytes()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(_HEADER, b'\0'))
+        for array in (hashes[order], words[order], lnglat[order]):
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+def convert_location_map(pickle_path, path=None):
+    """Convert a data/location_map_*.pkl (name -> [..., [.., .., lng, lat]]) into a LocationIndex
+    file next to it (or at `path`); returns the path written."""
+    path = path or os.path.splitext(pickle_path)[0] + ".locidx"
+    with open(pickle_path, 'rb') as f:
+        data = pickle.load(f)
+    write_location_index({name: (float(data[name][1][2]), float(data[name][1][3])) for name in data}, path)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert location map pickles into memory-mapped location indexes.")
+    parser.add_argument("pickles", nargs="+", help="data/location_map_*.pkl files")
+    args = parser.parse_args()
+    for pickle_path in args.pickles:
+        path = convert_location_map(pickle_path)
+        print(f"{pickle_path} -> {path} ({len(LocationIndex(path))} locations, {os.path.getsize(path)} bytes)")
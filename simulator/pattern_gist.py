@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+
+class PatternGistStore:
+    """Per-user pattern-gist states, appended to a JSON-lines file so later runs can reuse them.
+
+    A state is keyed by the user, the routines it summarises and the pattern_gist stage's
+    LLM settings, and records the gist, how many training routines it covers and how many
+    incremental updates it has had since the last full summary.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._states = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._states[record["key"]] = record["state"]
+
+    @staticmethod
+    def make_key(user, train_routine_list, recent_routine, history_budget=None, settings=None):
+        digest = hashlib.sha256()
+        digest.update(str(user).encode('utf-8'))
+        for routine in train_routine_list:
+            digest.update(b"\0" + routine.encode('utf-8'))
+        digest.update(b"\1" + str(recent_routine).encode('utf-8'))
+        if history_budget is not None:
+            # a compacted history gives a different gist than the full one
+            digest.update(b"\2" + str(history_budget).encode('utf-8'))
+        if settings is not None:
+            # another model or temperature gives another gist
+            digest.update(b"\3" + json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        return self._states.get(key)
+
+    def put(self, key, state):
+        self._states[key] = state
+        if self.path is not None:
+            record = json.dumps({"key": key, "state": state}, ensure_ascii=False) + "\n"
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, record.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def __len__(self):
+        return len(self._states)
@@ -1,14 +1,20 @@
 """Represents a person with train and test routine lists and a name."""
+from simulator.trajectory import as_routine_list
+
+
 class Person:
     def __init__(self, name):
         self.train_routine_list = None  # list of training routines
         self.test_routine_list = None  # list of testing routines
+        self.pattern_gist_state = None  # latest pattern gist and how much of the history it covers
         self.name = name
         print("Person {} is created".format(self.name))
 
+    @property
+    def train_routine_list(self):
+        return self._train_routine_list
 
-
-
-
-
-
+    @train_routine_list.setter
+    def train_routine_list(self, routines):
+        # kept indexed by date for the recent/long routine lookups of every planned day
+        self._train_routine_list = None if routines is None else as_routine_list(routines)
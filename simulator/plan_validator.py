@@ -0,0 +1,125 @@
+import re
+import unicodedata
+
+# what valid_generation has always accepted: "<name> #<id> at H:MM[:SS]" at the start of the item
+_ITEM_PATTERN = re.compile(r'(?P<location_full>[^#]+#\d+)\s+at\s+(?P<time>([0-1]?\d|2[0-3]):[0-5]\d(?::[0-5]\d)?)')
+_AM_PM_PATTERN = re.compile(r'\b(?:AM|PM)\b', re.IGNORECASE)
+# the same item written loosely: any spacing around '#', a.m./p.m. suffixes, a closing period
+_LOOSE_ITEM_PATTERN = re.compile(
+    r'\s*(?P<name>[^#]*?)\s*#\s*(?P<poi>\d+)\s+at\s+(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?(?::(?P<second>\d{2}))?'
+    r'\s*(?:(?P<meridiem>[AaPp])\.?\s?[Mm]\.?)?\s*\.?\s*')
+
+# rules a plan can fail, in the order they are checked
+NOT_A_LIST = "not_a_list"
+ITEM_FORMAT = "item_format"
+AM_PM = "am_pm"
+UNKNOWN_LOCATION = "unknown_location"
+# defects the repair pass fixes
+HASH_SPACING = "hash_spacing"
+LOCATION_SPELLING = "location_spelling"
+
+
+def normalize_location(name, accents=False):
+    """Case- and spacing-insensitive form of a location name ('PET  café' gives 'pet café');
+    also accent-insensitive unless `accents` ('Café' then gives 'cafe')."""
+    if not accents:
+        name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return " ".join(unicodedata.normalize("NFC", name).casefold().split())
+
+
+def _unique_spellings(names, accents):
+    spellings = {}
+    for name in names:
+        spellings.setdefault(normalize_location(name, accents), []).append(name)
+    # names that normalise to the same key are ambiguous and never repaired
+    return {key: group[0] for key, group in spellings.items() if len(group) == 1}
+
+
+class PlanValidator:
+    """Checks generated plans against the known location names.
+
+    check() is the strict rule set valid_generation always applied. validate() first lets
+    the valid items through untouched, then repairs the trivial defects of the others
+    locally (AM/PM times, spacing around '#', the case or accents of a location name that
+    matches exactly one known name, ignoring case first and then accents as well) instead of
+    spending another LLM round-trip on them.
+    Both report which rule rejected the plan.
+    """
+    def __init__(self, locations):
+        self.locations = frozenset(locations)
+        self._spellings = (_unique_spellings(self.locations, True), _unique_spellings(self.locations, False))
+
+    def check_item(self, item):
+        """The rule `item` breaks, or None if it is valid as written."""
+        if not isinstance(item, str):
+            return ITEM_FORMAT
+        if "Home at" in item:
+            return None
+        match = _ITEM_PATTERN.match(item)
+        if match is None:
+            return ITEM_FORMAT
+        if _AM_PM_PATTERN.search(item):
+            return AM_PM
+        if match.group("location_full").split('#')[0].strip() not in self.locations:
+            return UNKNOWN_LOCATION
+        return None
+
+    def check(self, plan):
+        """The first rule the plan breaks, or None if every item is valid as written."""
+        if not isinstance(plan, list):
+            return NOT_A_LIST
+        for item in plan:
+            rule = self.check_item(item)
+            if rule is not None:
+                return rule
+        return None
+
+    def repair_item(self, item):
+        """(repaired item, repairs applied) or (None, rule that could not be repaired)."""
+        if not isinstance(item, str):
+            return None, ITEM_FORMAT
+        match = _LOOSE_ITEM_PATTERN.fullmatch(item)
+        if match is None:
+            return None, ITEM_FORMAT
+        name, poi, hour, minute, second, meridiem = match.group("name", "poi", "hour", "minute", "second", "meridiem")
+        repairs = []
+        hour = int(hour)
+        if meridiem is not None:
+            if not 1 <= hour <= 12:
+                return None, AM_PM
+            hour = hour % 12 + (12 if meridiem in "Pp" else 0)
+            repairs.append(AM_PM)
+        if minute is None or hour > 23 or int(minute) > 59 or (second is not None and int(second) > 59):
+            return None, ITEM_FORMAT
+        if name not in self.locations:
+            with_accents, without_accents = self._spellings
+            canonical = with_accents.get(normalize_location(name, True)) \
+                or without_accents.get(normalize_location(name))
+            if canonical is None:
+                return None, UNKNOWN_LOCATION
+            name = canonical
+            repairs.append(LOCATION_SPELLING)
+        if item[match.start("name"):match.end("poi")] != f"{match.group('name')} #{poi}":
+            repairs.append(HASH_SPACING)
+        time = f"{hour:02d}:{minute}" if meridiem is not None else f"{match.group('hour')}:{minute}"
+        if second is not None:
+            time += f":{second}"
+        return f"{name} #{poi} at {time}", repairs
+
+    def validate(self, plan, repair=True):
+        """(plan, repairs, rule): the plan with its defective items repaired, the repairs applied
+        (one entry per repaired item and defect) and the rule that still rejects it, or None."""
+        rule = self.check(plan)
+        if rule is None or rule == NOT_A_LIST or not repair:
+            return plan, [], rule
+        repaired, repairs = [], []
+        for item in plan:
+            if self.check_item(item) is None:
+                repaired.append(item)
+                continue
+            fixed, applied = self.repair_item(item)
+            if fixed is None:
+                return plan, [], applied
+            repaired.append(fixed)
+            repairs.extend(applied)
+        return repaired, repairs, None
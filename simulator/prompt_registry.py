@@ -0,0 +1,163 @@
+import glob
+import os
+from functools import lru_cache
+import random
+import re
+
+COMMENT_BLOCK_MARKER = "<commentblockmarker>###</commentblockmarker>"
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_template")
+
+_SLOT_PATTERN = re.compile(r"!<INPUT (\d+)>!")
+_TIME_PATTERN = re.compile(r"(\d{2}:\d{2}):00")
+# one pass for both words: lowercasing any casing of You/Your is what the two original subs did
+_YOU_YOUR_PATTERN = re.compile(r'\b(?:You|Your)\b', flags=re.IGNORECASE)
+_WORD_PATTERN = re.compile(r"\w")
+
+
+def _lower_match(match):
+    return match.group(0).lower()
+
+
+def normalize_text(text):
+    """Drop the seconds of HH:MM:00 times and lowercase You/Your, as generate_prompt always did."""
+    text = _TIME_PATTERN.sub(r"\1", text)
+    return _YOU_YOUR_PATTERN.sub(_lower_match, text)
+
+
+# the same routine strings fill the pattern, generation and every replan prompt of a day
+normalize_input = lru_cache(maxsize=256)(normalize_text)
+
+
+def drop_blank_lines(text):
+    return '\n'.join([line for line in text.split('\n') if line.strip()]).strip()
+
+
+def render_legacy(template_text, inputs):
+    """Fill the template the way the original generate_prompt did, one str.replace per slot."""
+    prompt = template_text
+    for count, i in enumerate(inputs):
+        prompt = prompt.replace(f"!<INPUT {count}>!", i)
+    if COMMENT_BLOCK_MARKER in prompt:
+        prompt = prompt.split(COMMENT_BLOCK_MARKER)[1]
+    pattern = r"(\d{2}:\d{2}):00"
+    modified_prompt = re.sub(pattern, r"\1", prompt)
+    modified_prompt = re.sub(r'\bYou\b', 'you', modified_prompt, flags=re.IGNORECASE)
+    modified_prompt = re.sub(r'\bYour\b', 'your', modified_prompt, flags=re.IGNORECASE)
+    return drop_blank_lines(modified_prompt)
+
+
+def _is_safe_neighbour(char):
+    # normalisation cannot reach across a slot boundary when the template character next to
+    # the slot is neither a word character nor ':' (no \b, no part of an HH:MM:00 match)
+    return char is None or (char != ':' and not _WORD_PATTERN.match(char))
+
+
+class PromptTemplate:
+    """A prompt template pre-split at the comment-block marker and into slot segments.
+
+    The static segments are normalised once, so rendering only normalises the inputs and
+    joins the pieces. Templates or inputs where that could differ from render_legacy (a
+    slot next to a word character, stray '<INPUT' text, a marker inside an input) are
+    rendered with render_legacy instead.
+    """
+    __slots__ = ("text", "segments", "slots", "fast")
+
+    def __init__(self, text):
+        self.text = text
+        body = text.split(COMMENT_BLOCK_MARKER)[1] if COMMENT_BLOCK_MARKER in text else text
+        parts = _SLOT_PATTERN.split(body)
+        segments = parts[0::2]
+        self.slots = [int(slot) for slot in parts[1::2]]
+        self.fast = not any("<INPUT" in segment for segment in segments)
+        for before, after in zip(segments[:-1], segments[1:]):
+            if not _is_safe_neighbour(before[-1:] or None) or not _is_safe_neighbour(after[:1] or None):
+                self.fast = False
+        self.segments = [normalize_text(segment) for segment in segments]
+
+    def render(self, curr_input):
+        if type(curr_input) == type("string"):
+            curr_input = [curr_input]
+        inputs = ["" if i == 'None' else i for i in (str(i) for i in curr_input)]
+        if not self.fast or any("<INPUT" in i or COMMENT_BLOCK_MARKER in i for i in inputs):
+            return render_legacy(self.text, inputs)
+        normalized = [normalize_input(i) for i in inputs]
+        pieces = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            pieces.append(normalized[slot] if slot < len(normalized) else f"!<INPUT {slot}>!")
+            pieces.append(segment)
+        return drop_blank_lines(''.join(pieces))
+
+
+class PromptRegistry:
+    """Templates read once and kept in memory, keyed by absolute path.
+
+    A relative path that does not exist from the working directory, such as a config's
+    "./simulator/prompt_template/x.txt" outside the repository root, is looked up by file
+    name in `directory`; the resolved template is remembered under the asked path.
+    """
+    def __init__(self, directory=TEMPLATE_DIRECTORY):
+        self.directory = directory
+        self._templates = {}
+        self._aliases = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            self.load(path)
+
+    def load(self, path):
+        with open(path, "r", encoding='utf-8') as f:
+            template = PromptTemplate(f.read())
+        self._templates[os.path.abspath(path)] = template
+        return template
+
+    def get(self, path):
+        template = self._templates.get(os.path.abspath(path)) or self._aliases.get(path)
+        if template is None:
+            resolved = self.resolve(path)
+            template = self._templates.get(os.path.abspath(resolved)) or self.load(resolved)
+            self._aliases[path] = template
+        return template
+
+    def resolve(self, path):
+        if os.path.isabs(path) or os.path.exists(path):
+            return path
+        return os.path.join(self.directory, os.path.basename(path))
+
+    def __iter__(self):
+        return iter(self._templates.items())
+
+
+_registry = None
+
+
+def get_prompt_registry():
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
+
+
+def verify_against_legacy(samples=200, seed=0):
+    """Render every template with random inputs both ways and return the mismatching cases."""
+    rng = random.Random(seed)
+    pieces = ["Cafe #3 at 08:00:00", "You", "your", "YOUR plan", "None", "", "\n", "  \n ", "12:30:00.",
+              "Activities at 2020-04-07: ", "Home at 23:00:00", "{\"plan\": []}", "Café", ":00", "you're"]
+    failures = []
+    for path, template in get_prompt_registry():
+        for _ in range(samples):
+            inputs = [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 4)))
+                      for _ in range(rng.randint(1, 7))]
+            curr_input = inputs[0] if rng.random() < 0.1 else inputs
+            if isinstance(curr_input, list) and rng.random() < 0.3:
+                curr_input = [inputs, None] + inputs
+            legacy_inputs = [curr_input] if isinstance(curr_input, str) else curr_input
+            legacy_inputs = ["" if i == 'None' else i for i in (str(i) for i in legacy_inputs)]
+            expected = render_legacy(template.text, legacy_inputs)
+            if template.render(curr_input) != expected:
+                failures.append((path, curr_input))
+    return failures
+
+
+if __name__ == "__main__":
+    failures = verify_against_legacy()
+    print(f"{len(failures)} mismatches against the legacy generate_prompt")
+    for path, curr_input in failures[:10]:
+        print(path, repr(curr_input))
@@ -0,0 +1,94 @@
+import json
+import re
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+# how many '{' of a chatty reply are tried as the start of the JSON object
+_MAX_OBJECT_STARTS = 32
+
+_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {"plan": {"type": "array", "items": {"type": "string"}}, "reason": {"type": "string"}},
+    "required": ["plan", "reason"],
+    "additionalProperties": False,
+}
+_REFLECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"coherence_with_pattern": {"type": "boolean"}, "coherence_with_event": {"type": "boolean"},
+                   "reason": {"type": "string"}},
+    "required": ["coherence_with_pattern", "coherence_with_event", "reason"],
+    "additionalProperties": False,
+}
+# the JSON reply each template asks for, by planner stage
+RESPONSE_SCHEMAS = {"generation": _PLAN_SCHEMA, "replan": _PLAN_SCHEMA, "reflection": _REFLECTION_SCHEMA}
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str, "boolean": bool}
+
+# why a reply could not be used
+EMPTY = "empty"
+NOT_JSON = "not_json"
+WRONG_TYPE = "wrong_type"
+MISSING_KEY = "missing_key"
+
+
+class ResponseParseError(ValueError):
+    """A reply that holds no usable JSON object; `rule` says why (empty, not_json, wrong_type, missing_key)."""
+    def __init__(self, rule, message=None):
+        super().__init__(message or rule)
+        self.rule = rule
+
+
+def response_format(stage, mode):
+    """The API's response_format for `stage` in `mode`: None (free text), "json_object" (JSON mode)
+    or "json_schema" (structured output with the stage's schema from RESPONSE_SCHEMAS)."""
+    if mode is None:
+        return None
+    if mode == "json_object":
+        return {"type": "json_object"}
+    if mode == "json_schema":
+        if stage not in RESPONSE_SCHEMAS:
+            raise ValueError(f"stage {stage!r} has no response schema")
+        return {"type": "json_schema",
+                "json_schema": {"name": stage, "schema": RESPONSE_SCHEMAS[stage], "strict": True}}
+    raise ValueError(f"unknown response_format mode {mode!r}")
+
+
+def extract_json(text):
+    """(value, recovered): the JSON in a reply, and whether it had to be dug out of code fences
+    or surrounding prose. Raises ResponseParseError when there is none."""
+    if not isinstance(text, str) or not text.strip():
+        raise ResponseParseError(EMPTY)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    for match in _FENCE_PATTERN.finditer(text):
+        try:
+            return json.loads(match.group(1)), True
+        except json.JSONDecodeError:
+            continue
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    for _ in range(_MAX_OBJECT_STARTS):
+        if start < 0:
+            break
+        try:
+            return decoder.raw_decode(text, start)[0], True
+        except json.JSONDecodeError:
+            start = text.find('{', start + 1)
+    raise ResponseParseError(NOT_JSON)
+
+
+def parse_response(text, schema=None):
+    """(object, recovered): the JSON object of a reply, checked against `schema` (one of
+    RESPONSE_SCHEMAS: required keys and their top-level types) when given."""
+    data, recovered = extract_json(text)
+    if not isinstance(data, dict):
+        raise ResponseParseError(WRONG_TYPE, f"expected a JSON object, got {type(data).__name__}")
+    if schema is not None:
+        for key in schema["required"]:
+            if key not in data:
+                raise ResponseParseError(MISSING_KEY, f"missing key {key!r}")
+            expected = _JSON_TYPES.get(schema["properties"][key].get("type"))
+            if expected is not None and not isinstance(data[key], expected):
+                raise ResponseParseError(WRONG_TYPE, f"{key!r} is not of type {schema['properties'][key]['type']}")
+    return data, recovered
@@ -0,0 +1,117 @@
+import glob
+import json
+import os
+import pickle
+
+
+class ResultStore:
+    """Append-only JSON-lines store holding one record per planned user.
+
+    Every record is written with a single os.write on an O_APPEND descriptor, so a crash
+    can at worst leave one torn line at the end of the file; that line is ignored when
+    reading and cut off before the next append.
+    """
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._fd = None
+
+    def _open(self):
+        if self._fd is None:
+            self._drop_torn_tail()
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def _drop_torn_tail(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b'\n') + 1)
+
+    def append(self, user, trajectory):
+        record = json.dumps({"user": user, "trajectory": trajectory}, ensure_ascii=False) + "\n"
+        fd = self._open()
+        os.write(fd, record.encode('utf-8'))
+        if self.fsync:
+            os.fsync(fd)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __iter__(self):
+        """Yield (user, trajectory) for every complete record, oldest first."""
+        for user, trajectory, _ in self.records():
+            yield user, trajectory
+
+    def records(self, offset=0):
+        """Yield (user, trajectory, end offset) for every complete record from byte `offset` on;
+        passing the last end offset back later reads only the records appended since."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield record["user"], record["trajectory"], offset
+
+    def completed_users(self):
+        return {user for user, _ in self}
+
+
+def store_paths(path):
+    """Return the store at `path` together with any per-shard stores written next to it."""
+    root, ext = os.path.splitext(path)
+    paths = sorted(glob.glob(f"{glob.escape(root)}.shard*-of-*{ext}"))
+    if os.path.exists(path):
+        paths.insert(0, path)
+    return paths
+
+
+def completed_users(path):
+    users = set()
+    for store_path in store_paths(path):
+        users |= ResultStore(store_path).completed_users()
+    return users
+
+
+def load_results(path):
+    """Collect every user record from the store at `path` and its shard stores."""
+    trajectories = {}
+    for store_path in store_paths(path):
+        for user, trajectory in ResultStore(store_path):
+            trajectories[user] = trajectory
+    return trajectories
+
+
+def export_results(path, user_list, output_path):
+    """Compact the stores into the legacy result.pkl layout read by evaluation.py.
+
+    Users are written in user_list order and each record is pickled on its own first, so
+    the bytes only depend on the planned trajectories, not on how many shards or processes
+    produced them.
+    """
+    trajectories = load_results(path)
+    ordered = {key: pickle.loads(pickle.dumps(trajectories[key], protocol=4))
+               for key in user_list if key in trajectories}
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(ordered, f, protocol=4)
+    os.replace(tmp_path, output_path)
+    return ordered
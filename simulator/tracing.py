@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from simulator.result_store import store_paths
+
+
+class Span:
+    """One LLM call of a planner stage: wall time, token usage, retries and whether the cache answered."""
+    __slots__ = ("tracer", "stage", "user", "date", "start", "prompt_tokens", "completion_tokens", "retries",
+                 "cached")
+
+    def __init__(self, tracer, stage, user=None, date=None):
+        self.tracer = tracer
+        self.stage = stage
+        self.user = user
+        self.date = date
+        self.start = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.cached = False
+
+    def add_usage(self, usage):
+        """Add the token counts of a response's `usage` (an SDK object, a dict or None)."""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage.get("completion_tokens") or 0
+        else:
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(time.perf_counter() - self.start, None if exc_type is None else exc_type.__name__)
+        return False
+
+    def finish(self, seconds, error=None):
+        self.tracer.record({"type": "span", "stage": self.stage, "user": self.user, "date": self.date,
+                            "seconds": round(seconds, 6), "prompt_tokens": self.prompt_tokens,
+                            "completion_tokens": self.completion_tokens, "retries": self.retries,
+                            "cached": self.cached, "error": error})
+
+
+class Tracer:
+    """Writes spans of LLM calls and planner outcomes (parse failures, rejected plans,
+    reflection verdicts, fallbacks) to a JSON-lines file; with path=None nothing is kept."""
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def span(self, stage, user=None, date=None):
+        return Span(self, stage, user, date)
+
+    def event(self, name, stage=None, date=None, count=1, rule=None):
+        """Count `name` for a stage; `rule` names the validation rule behind it (failed or repaired)."""
+        if self.enabled and count:
+            record = {"type": "event", "event": name, "stage": stage, "date": date, "count": count}
+            if rule is not None:
+                record["rule"] = rule
+            self.record(record)
+
+    def record(self, record):
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_tracer = Tracer()
+
+
+def configure_tracing(path):
+    """Trace every planner stage call to the JSONL file at `path` (None turns tracing off)."""
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize_traces(path):
+    """Aggregate the trace at `path` and its per-shard files into per-stage and per-run figures."""
+    stages = {}
+    events = {}
+    rules = {}
+    for trace_path in store_paths(path):
+        with open(trace_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["type"] == "event":
+                    key = (record["event"], record.get("stage"))
+                    events[key] = events.get(key, 0) + record.get("count", 1)
+                    if record.get("rule") is not None:
+                        key = (record["event"], record.get("stage"), record["rule"])
+                        rules[key] = rules.get(key, 0) + record.get("count", 1)
+                    continue
+                stage = stages.setdefault(record["stage"], {"calls": 0, "cached": 0, "errors": 0, "retries": 0,
+                                                            "prompt_tokens": 0, "completion_tokens": 0,
+                                                            "seconds": []})
+                stage["calls"] += 1
+                stage["cached"] += record["cached"]
+                stage["errors"] += record["error"] is not None
+                stage["retries"] += record["retries"]
+                stage["prompt_tokens"] += record["prompt_tokens"]
+                stage["completion_tokens"] += record["completion_tokens"]
+                if not record["cached"]:
+                    stage["seconds"].append(record["seconds"])
+
+    def total(name):
+        return sum(count for (event, stage), count in events.items() if event == name)
+
+    user_days = total("plan_saved") + total("fallback")
+    for name, stage in stages.items():
+        seconds = sorted(stage.pop("seconds"))
+        stage["p50_seconds"] = _percentile(seconds, 0.50)
+        stage["p95_seconds"] = _percentile(seconds, 0.95)
+        stage["tokens_per_user_day"] = \
+            (stage["prompt_tokens"] + stage["completion_tokens"]) / user_days if user_days else 0.0
+        stage["json_parse_failures"] = events.get(("json_parse_failure", name), 0)
+        stage["json_recovered"] = events.get(("json_recovered", name), 0)
+        stage["json_parse_failure_rules"] = {rule: count for (event, stage_name, rule), count in sorted(rules.items())
+                                             if event == "json_parse_failure" and stage_name == name}
+        stage["invalid_plans"] = events.get(("invalid_plan", name), 0)
+        stage["repaired_plans"] = events.get(("plan_repaired", name), 0)
+        stage["invalid_plan_rules"] = {rule: count for (event, stage_name, rule), count in sorted(rules.items())
+                                       if event == "invalid_plan" and stage_name == name}
+        stage["repairs"] = {rule: count for (event, stage_name, rule), count in sorted(rules.items())
+                            if event == "plan_repair" and stage_name == name}
+    reflections = total("reflection_pass") + total("reflection_fail")
+    return {"stages": stages, "user_days": user_days,
+            "reflection_pass_rate": total("reflection_pass") / reflections if reflections else 0.0,
+            "fallback_rate": total("fallback") / user_days if user_days else 0.0}
+
+
+def print_trace_summary(summary):
+    print(f"{'stage':<14}{'calls':>9}{'cached':>9}{'retries':>9}{'p50 s':>9}{'p95 s':>9}"
+          f"{'tok/user-day':>14}{'bad json':>10}{'dug out':>10}{'bad plan':>10}{'repaired':>10}")
+    for name, stage in sorted(summary["stages"].items()):
+        print(f"{name:<14}{stage['calls']:>9}{stage['cached']:>9}{stage['retries']:>9}"
+              f"{stage['p50_seconds']:>9.2f}{stage['p95_seconds']:>9.2f}{stage['tokens_per_user_day']:>14.1f}"
+              f"{stage['json_parse_failures']:>10}{stage['json_recovered']:>10}{stage['invalid_plans']:>10}"
+              f"{stage['repaired_plans']:>10}")
+    for name, stage in sorted(summary["stages"].items()):
+        for what, key in (("bad json", "json_parse_failure_rules"), ("rejected", "invalid_plan_rules"),
+                          ("repaired", "repairs")):
+            if stage[key]:
+                print(f"{name} {what}: " + ", ".join(f"{rule} {count}" for rule, count in stage[key].items()))
+    print(f"{summary['user_days']} user-days, reflection pass rate {summary['reflection_pass_rate']:.1%}, "
+          f"fallback rate {summary['fallback_rate']:.1%}")
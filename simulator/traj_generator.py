@@ -1,5 +1,15 @@
 from simulator.gpt_structure import *
+from simulator.event_registry import *
+from simulator.pattern_gist import *
+from simulator.history_compaction import *
+from simulator.trajectory import *
+from simulator.plan_validator import *
+from simulator.response_parsing import *
+import asyncio
+import os
 import pickle
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import re
 import json
 from typing import Dict, List, Any, Optional
@@ -14,29 +24,34 @@ def load_locations(csv_filename):
                 valid_locations.add(loc)
     return valid_locations
 
-valid_locations = load_locations("data/subcategories.csv")
+# read on first use, from the repository's data directory whatever the working directory is
+LOCATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "subcategories.csv")
 root_directory = "./simulator/"
 
+
+def get_valid_locations(csv_filename=None):
+    """The location names plans may use (LOCATIONS_PATH by default), read once per file."""
+    return _valid_locations(os.path.abspath(csv_filename or LOCATIONS_PATH))
+
+
+def get_plan_validator(csv_filename=None):
+    """The PlanValidator of get_valid_locations(csv_filename), built once per file."""
+    return _plan_validator(os.path.abspath(csv_filename or LOCATIONS_PATH))
+
+
+@lru_cache(maxsize=None)
+def _valid_locations(path):
+    return frozenset(load_locations(path))
+
+
+@lru_cache(maxsize=None)
+def _plan_validator(path):
+    return PlanValidator(_valid_locations(path))
+
+
 def valid_generation(data):
     """Validate plan items for time format and allowed locations"""
-    pattern = re.compile(r'(?P<location_full>[^#]+#\d+)\s+at\s+(?P<time>([0-1]?\d|2[0-3]):[0-5]\d(?::[0-5]\d)?)')
-    for item in data[0]:
-        lower = item.lower()
-    for item in data:
-        if "Home at" in item:
-            continue
-        match = pattern.match(item)
-        if match is None:
-            return False
-        location_full = match.group("location_full")
-        if '#' not in location_full:
-            return False
-        elif re.search(r'\b(?:AM|PM)\b', item, re.IGNORECASE):
-            return False
-        location_name = location_full.split('#')[0].strip()
-        if location_name not in valid_locations:
-            return False
-    return True
+    return get_plan_validator().check(data) is None
 
 def check_workday_or_weekend(date_str: str) -> str:
     """Return Weekday or Weekend."""
@@ -47,36 +62,12 @@ def check_workday_or_weekend(date_str: str) -> str:
         return "Weekend"
 
 def get_long_routines(date_, test_routine_list, num_days=3):
-    current_date = datetime.strptime(date_, "%Y-%m-%d")
-    routines_with_diff = []
-    for test_route in test_routine_list:
-        date_str = test_route.split(": ")[0].split(" ")[-1]
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        if date_obj == current_date:
-            continue
-        days_diff = (current_date - date_obj).days
-        if days_diff > 0:
-            routines_with_diff.append((test_route, days_diff))
-    routines_with_diff.sort(key=lambda x: x[1])
-    output_routines = [route[0] for route in routines_with_diff[num_days:]]
-    return output_routines
+    """Routines dated before date_, newest first, without the num_days most recent ones."""
+    return as_routine_list(test_routine_list).older(date_, num_days)
 
 def get_recent_routines(date_, test_routine_list, num_days=3):
-    current_date = datetime.strptime(date_, "%Y-%m-%d")
-    routines_with_diff = []
-    for test_route in test_routine_list:
-        date_str = test_route.split(": ")[0].split(" ")[-1]
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        if date_obj == current_date:
-            continue
-        days_diff = (current_date - date_obj).days
-        if days_diff > 0:
-            routines_with_diff.append((test_route, days_diff))
-    routines_with_diff.sort(key=lambda x: x[1])
-    output_routines = [route[0] for route in routines_with_diff[:num_days]]
-    if len(output_routines) < num_days:
-        output_routines = [route[0] for route in routines_with_diff]
-    return output_routines
+    """The num_days most recent routines dated before date_, newest first."""
+    return as_routine_list(test_routine_list).recent(date_, num_days)
 
 class DayPlannerConfig:
     """Initialize the planner with a configuration."""
@@ -84,42 +75,209 @@ class DayPlannerConfig:
     MAX_REFLECTION_TRY = 3
     REPLAN_TRIAL = 3
 
-    REPLAN_TEMPLATE = "./simulator/prompt_template/regeneration.txt"
-    GENERATION_TEMPLATE = "./simulator/prompt_template/generation.txt"
-    EVENT_SCHEMA_TEMPLATE  = "./simulator/prompt_template/event_schema.txt"
-    EVENT_GIST_TEMPLATE = "./simulator/prompt_template/event_gist.txt"
-    PATTERN_GIST_TEMPLATE = "./simulator/prompt_template/pattern_gist.txt"
-    ACTION_GIST_TEMPLATE = "./simulator/prompt_template/action_gist.txt"
-    REFLECTION_TEMPLATE = "./simulator/prompt_template/reflection_alignment.txt"
+    # templates are found next to this module, whatever the working directory is
+    REPLAN_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "regeneration.txt")
+    GENERATION_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "generation.txt")
+    EVENT_SCHEMA_TEMPLATE  = os.path.join(TEMPLATE_DIRECTORY, "event_schema.txt")
+    EVENT_GIST_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "event_gist.txt")
+    PATTERN_GIST_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "pattern_gist.txt")
+    PATTERN_GIST_UPDATE_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "pattern_gist_update.txt")
+    ACTION_GIST_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "action_gist.txt")
+    REFLECTION_TEMPLATE = os.path.join(TEMPLATE_DIRECTORY, "reflection_alignment.txt")
+
+    # event text summarised into the event schema/gist; EVENT_CONTEXT_BY_DATE overrides it
+    # for dates whose situation really differs, e.g. {"2019-10-12": "Typhoon landfall ..."}
+    EVENT_CONTEXT = "Put event context here."
+    EVENT_CONTEXT_BY_DATE = {}
+    # schema/gist of each distinct event are persisted here; None keeps them in memory only
+    EVENT_REGISTRY_PATH = "event_registry.json"
+
+    # "incremental" summarises the training window once and then folds in only the routines
+    # appended since; "full" re-summarises the whole history every day
+    PATTERN_GIST_MODE = "incremental"
+    # a full re-summary is forced after this many incremental updates
+    PATTERN_GIST_MAX_UPDATES = 3
+    PATTERN_GIST_STORE_PATH = "pattern_gists.jsonl"
+    # the valid location names of generated plans; None is LOCATIONS_PATH
+    LOCATIONS_PATH = None
+
+    # LLM settings of each stage (event_schema, event_gist, pattern_gist, generation,
+    # action_gist, reflection, replan); keys a stage leaves out come from DEFAULT_STAGE_SETTINGS.
+    # "backend" is a name given to register_llm_backend, None the default backend, e.g.
+    # {"pattern_gist": {"backend": "gist", "model": "gpt-4.1-nano", "max_tokens": 400}}.
+    # "response_format" turns on the API's JSON mode ("json_object") or structured output with
+    # the stage's schema ("json_schema", for generation, replan and reflection)
+    DEFAULT_STAGE_SETTINGS = {"backend": None, "model": DEFAULT_MODEL, "temperature": 0.1, "max_tokens": None,
+                              "response_format": None}
+    STAGE_SETTINGS = {}
+
+    # candidate plans sampled per generation/replan call (the API's n); their action gists and
+    # reflections run together and the first candidate passing both checks is kept
+    GENERATION_CANDIDATES = 1
+
+    # fix trivial defects of a generated plan (AM/PM times, spacing around '#', the case or
+    # accents of a location name) locally instead of rejecting it and asking the LLM again
+    REPAIR_PLANS = True
+
+    # token budget of the history slots: "long_routines" in the generation/replan prompts and
+    # "pattern_history" in the pattern gist prompt. A history over its budget is compacted into
+    # ranked weekday/weekend places, recurring day patterns and the most recent days verbatim;
+    # None sends the whole history, e.g. {"long_routines": 3000, "pattern_history": 4000}
+    HISTORY_TOKEN_BUDGETS = {"long_routines": None, "pattern_history": None}
+
+class PromptRequest:
+    """A prompt the planner is waiting on; answered by whichever driver runs the plan.
+
+    With n > 1 the answer is a list of n sampled replies instead of one reply. `attempt`
+    counts the earlier replies to the same prompt that were rejected; it keeps the
+    response cache from answering a retry with one of them.
+    """
+    __slots__ = ("prompt", "stage", "date", "n", "attempt")
+
+    def __init__(self, prompt, stage, date=None, n=1, attempt=0):
+        self.prompt = prompt
+        self.stage = stage
+        self.date = date
+        self.n = n
+        self.attempt = attempt
+
 
 class DayPlanner:
-    """Plan daily activities."""
+    """Plan daily activities.
+
+    The planning logic lives in generator methods that yield lists of PromptRequest
+    and receive the answers back, so the same logic runs blocking (plan_new_day) or
+    concurrently with other users (plan_new_day_async).
+    """
     def __init__(self, config: DayPlannerConfig = None):
         self.config = config or DayPlannerConfig()
+        self.event_registry = EventRegistry(self.config.EVENT_REGISTRY_PATH)
+        self.pattern_gist_store = PatternGistStore(self.config.PATTERN_GIST_STORE_PATH)
+        self._stage_settings = {}
+
+    def prepare_events(self, dates):
+        """Summarise the event of every date up front, one schema/gist pair per distinct event."""
+        return self._run_sync(self.prepare_events_steps(dates))
+
+    async def prepare_events_async(self, dates):
+        return await self._run_async(self.prepare_events_steps(dates))
+
+    def prepare_events_steps(self, dates):
+        for date in dates:
+            try:
+                yield from self._get_event_summary(date)
+            except (LLMRetryError, LLMRequestError):
+                # left to the first user planning that date
+                continue
 
     def plan_new_day(self, person, sample_num: int = 1) -> Dict[str, Dict[str, str]]:
+        return self._run_sync(self.plan_new_day_steps(person, sample_num), person.name)
+
+    async def plan_new_day_async(self, person, sample_num: int = 1) -> Dict[str, Dict[str, str]]:
+        return await self._run_async(self.plan_new_day_steps(person, sample_num), person.name)
+
+    def _run_sync(self, steps, user=None):
+        """Drive a planning generator, answering each prompt with execute_prompt."""
+        answers, error = None, None
+        while True:
+            try:
+                requests = steps.throw(error) if error is not None else steps.send(answers)
+            except StopIteration as stop:
+                return stop.value
+            answers, error = None, None
+            try:
+                if len(requests) == 1:
+                    answers = [self._execute(requests[0], user)]
+                else:
+                    # the prompts of one step do not depend on each other, e.g. one reflection per candidate
+                    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+                        answers = list(executor.map(self._execute, requests, [user] * len(requests)))
+            except FatalLLMError:
+                raise
+            except Exception as e:
+                error = e
+
+    async def _run_async(self, steps, user=None):
+        """Drive a planning generator, awaiting the prompts of one step together."""
+        answers, error = None, None
+        while True:
+            try:
+                requests = steps.throw(error) if error is not None else steps.send(answers)
+            except StopIteration as stop:
+                return stop.value
+            answers, error = None, None
+            try:
+                answers = await asyncio.gather(*(self._execute_async(r, user) for r in requests))
+            except FatalLLMError:
+                raise
+            except Exception as e:
+                error = e
+
+    def stage_settings(self, stage):
+        """backend, model, temperature, max_tokens and response_format used for the prompts of `stage`."""
+        settings = self._stage_settings.get(stage)
+        if settings is None:
+            settings = dict(self.config.DEFAULT_STAGE_SETTINGS)
+            settings.update(self.config.STAGE_SETTINGS.get(stage, {}))
+            settings["response_format"] = response_format(stage, settings.get("response_format"))
+            self._stage_settings[stage] = settings
+        return settings
+
+    def _execute(self, request, user=None):
+        with get_tracer().span(request.stage, user, request.date) as span:
+            return execute_prompt(request.prompt, objective="", stage=request.stage, n=request.n, span=span,
+                                  attempt=request.attempt, **self.stage_settings(request.stage))
+
+    async def _execute_async(self, request, user=None):
+        with get_tracer().span(request.stage, user, request.date) as span:
+            return await execute_prompt_async(request.prompt, objective="", stage=request.stage, n=request.n,
+                                              span=span, attempt=request.attempt,
+                                              **self.stage_settings(request.stage))
+
+    def _ask(self, prompt, stage, date=None, n=1, attempt=0):
+        answers = yield [PromptRequest(prompt, stage, date, n, attempt)]
+        return answers[0]
+
+    def _ask_all(self, prompts, stage, date=None):
+        """Ask several independent prompts in one step, so drivers can send them together."""
+        answers = yield [PromptRequest(prompt, stage, date) for prompt in prompts]
+        return answers
+
+    def plan_new_day_steps(self, person, sample_num: int = 1):
+        """Generator that plans the person's test days, yielding the PromptRequests it waits on."""
         world_interaction = self._initialize_world_interaction()
         for k in range(sample_num):
             for test_route in person.test_routine_list:
                 date = self._extract_date(test_route)
                 recent_routine = get_recent_routines(date, person.train_routine_list)
-                long_routine = get_long_routines(date, person.train_routine_list)
-                event_summary, event_gist, day_type = self._get_event_summary(date)
-                pattern_data_input = [person.train_routine_list, recent_routine]
-                prompt_pattern_gist = generate_prompt(pattern_data_input, self.config.PATTERN_GIST_TEMPLATE)
-                pattern_gist_contents = execute_prompt(prompt_pattern_gist, objective=f"")
+                long_routine = self._compact_history(get_long_routines(date, person.train_routine_list),
+                                                     "long_routines")
+                try:
+                    event_summary, event_gist, day_type = yield from self._get_event_summary(date)
+                    pattern_gist_contents = yield from self._get_pattern_gist(person, recent_routine, date)
+                except (LLMRetryError, LLMRequestError):
+                    # the API kept failing or refused a prompt of this day; only this day falls back
+                    self._use_fallback_plan(person, date, test_route, world_interaction)
+                    self._update_training_data(person, test_route)
+                    continue
 
                 try:
-                    plan_result, reason = self._generate_initial_plan(
-                        recent_routine, long_routine, event_summary, day_type
+                    candidates = yield from self._generate_initial_plan(
+                        recent_routine, long_routine, event_summary, day_type, date
                     )
-                except:
+                except Exception:
+                    candidates = None
+                if candidates is None:
                     self._update_training_data(person, test_route)
                     self._use_fallback_plan(person, date, test_route, world_interaction)
                     continue
-                validated_plan = self._validate_and_replan(
-                    plan_result, event_summary, person, recent_routine, long_routine, day_type, reason, event_gist, pattern_gist_contents
-                )
+                try:
+                    validated_plan = yield from self._validate_and_replan(
+                        candidates, event_summary, person, recent_routine, long_routine, day_type, event_gist,
+                        pattern_gist_contents, date
+                    )
+                except (LLMRetryError, LLMRequestError):
+                    validated_plan = None
 
                 if validated_plan is None:
                     self._use_fallback_plan(person, date, test_route, world_interaction)
@@ -132,93 +290,158 @@ class DayPlanner:
         return {"results": {}, "reals": {}}
 
     def _extract_date(self, test_route: str) -> str:
-        return test_route.split(": ")[0].split(" ")[-1]
+        # the same cached parse that indexes the routines; text without a valid date keeps the old split
+        return routine_date(test_route) or test_route.split(": ")[0].split(" ")[-1]
 
     def _get_recent_routine(self, date: str, train_routine_list: List[str]) -> str:
         recent_routine = get_recent_routines(date, train_routine_list)
         return parse_activities(recent_routine)
 
 
+    def _compact_history(self, routines, slot):
+        return compact_routines(routines, self.config.HISTORY_TOKEN_BUDGETS.get(slot))
+
+    def _get_event_context(self, date: str) -> str:
+        return self.config.EVENT_CONTEXT_BY_DATE.get(date, self.config.EVENT_CONTEXT)
+
     def _get_event_summary(self, date) -> str:
-        """Build event schema and event gist with prompts and label the day type."""
-        event_context = "Put event context here."
+        """Look up (or build once) the event schema and event gist and label the day type."""
+        event_context = self._get_event_context(date)
         curr_input = [event_context]
         prompt_event_schema = generate_prompt(curr_input, self.config.EVENT_SCHEMA_TEMPLATE)
-        event_schema_contents = execute_prompt(prompt_event_schema, objective=f"")
         prompt_event_gist = generate_prompt(curr_input, self.config.EVENT_GIST_TEMPLATE)
-        event_gist_contents = execute_prompt(prompt_event_gist, objective=f"")
+        key = self.event_registry.make_key(prompt_event_schema, prompt_event_gist,
+                                           [self.stage_settings("event_schema"), self.stage_settings("event_gist")])
+        summary = self.event_registry.get(key)
+        if summary is None:
+            event_schema_contents = yield from self._ask(prompt_event_schema, "event_schema", date)
+            event_gist_contents = yield from self._ask(prompt_event_gist, "event_gist", date)
+            self.event_registry.put(key, event_context, event_schema_contents, event_gist_contents)
+        else:
+            event_schema_contents, event_gist_contents = summary
         day_type = f"Today is {check_workday_or_weekend(date)}."
         return event_schema_contents, event_gist_contents, day_type
 
+    def _get_pattern_gist(self, person, recent_routine, date):
+        """Return the person's pattern gist, updating their gist state from the newly appended routines."""
+        train_routine_list = person.train_routine_list
+        if self.config.PATTERN_GIST_MODE == "full":
+            pattern_data_input = [self._compact_history(train_routine_list, "pattern_history"), recent_routine]
+            prompt_pattern_gist = generate_prompt(pattern_data_input, self.config.PATTERN_GIST_TEMPLATE)
+            return (yield from self._ask(prompt_pattern_gist, "pattern_gist", date))
+
+        key = self.pattern_gist_store.make_key(person.name, train_routine_list, recent_routine,
+                                              self.config.HISTORY_TOKEN_BUDGETS.get("pattern_history"),
+                                              self.stage_settings("pattern_gist"))
+        state = self.pattern_gist_store.get(key)
+        if state is None:
+            previous = getattr(person, "pattern_gist_state", None)
+            if previous is None or previous["updates"] >= self.config.PATTERN_GIST_MAX_UPDATES \
+                    or previous["covered"] > len(train_routine_list):
+                pattern_data_input = [self._compact_history(train_routine_list, "pattern_history"), recent_routine]
+                prompt_pattern_gist = generate_prompt(pattern_data_input, self.config.PATTERN_GIST_TEMPLATE)
+                updates = 0
+            else:
+                new_routines = train_routine_list[previous["covered"]:]
+                update_input = [previous["gist"], new_routines, recent_routine]
+                prompt_pattern_gist = generate_prompt(update_input, self.config.PATTERN_GIST_UPDATE_TEMPLATE)
+                updates = previous["updates"] + 1
+            gist = yield from self._ask(prompt_pattern_gist, "pattern_gist", date)
+            state = {"gist": gist, "covered": len(train_routine_list), "updates": updates}
+            self.pattern_gist_store.put(key, state)
+        person.pattern_gist_state = state
+        return state["gist"]
+
     def _generate_initial_plan(
             self, recent_routine: str, history_routine: str,
-            event_summary: str, day_type: str
-    ) -> Optional[List[str]]:
-        """Try several generations and return a plan with its reason."""
+            event_summary: str, day_type: str, date: str = None
+    ) -> Optional[List[tuple]]:
+        """Try several generations and return the valid candidate plans with their reasons."""
         curr_input = [history_routine, recent_routine, event_summary, day_type]
         prompt = generate_prompt(curr_input, self.config.GENERATION_TEMPLATE)
 
         for trial in range(self.config.MAX_TRIAL):
-            contents = execute_prompt(prompt, objective=f"")
-            if not contents:
-                continue
-            try:
-                parsed_data = json.loads(contents)
-                plan = parsed_data["plan"]
-                reason = parsed_data["reason"]
-                if valid_generation(plan):
-                    return plan, reason
-            except json.JSONDecodeError:
-                continue
+            candidates = yield from self._ask_candidates(prompt, "generation", date, trial)
+            if candidates:
+                return candidates
 
         return None
 
+    def _ask_candidates(self, prompt, stage, date=None, attempt=0):
+        """Sample GENERATION_CANDIDATES replies to a plan prompt and keep the valid (plan, reason) pairs."""
+        n = self.config.GENERATION_CANDIDATES
+        replies = yield from self._ask(prompt, stage, date, n, attempt)
+        candidates = []
+        tracer = get_tracer()
+        for contents in ([replies] if n == 1 else replies):
+            try:
+                parsed_data, recovered = parse_response(contents, RESPONSE_SCHEMAS[stage])
+            except ResponseParseError as error:
+                tracer.event("json_parse_failure", stage, date, rule=error.rule)
+                continue
+            tracer.event("json_recovered", stage, date, int(recovered))
+            plan, repairs, rule = get_plan_validator(self.config.LOCATIONS_PATH).validate(
+                parsed_data["plan"], self.config.REPAIR_PLANS)
+            if rule is None:
+                candidates.append((plan, parsed_data["reason"]))
+                for repair in dict.fromkeys(repairs):
+                    tracer.event("plan_repair", stage, date, repairs.count(repair), rule=repair)
+                tracer.event("plan_repaired", stage, date, int(bool(repairs)))
+            else:
+                tracer.event("invalid_plan", stage, date, rule=rule)
+        return candidates
+
     def _validate_and_replan(
-            self, initial_plan: List[str], event_summary: str, person,
-            recent_routine: str, history_routine: str, day_type: str, reason: str, event_gist, pattern_gist_contents
+            self, candidates: List[tuple], event_summary: str, person,
+            recent_routine: str, history_routine: str, day_type: str, event_gist, pattern_gist_contents,
+            date: str = None
     ) -> Optional[List[str]]:
-        """Run reflection then replan if needed."""
-        current_plan = initial_plan
-        replan_reason = reason
+        """Reflect on the candidates together, keep the first that passes, replan only if none does."""
         for attempt in range(self.config.MAX_REFLECTION_TRY):
-            reflection_result = self._run_reflection_validation(current_plan, event_gist, pattern_gist_contents,
-                                                                replan_reason)
-            if reflection_result and self._is_reflection_successful(reflection_result):
-                return current_plan
+            reflection_results = yield from self._run_reflection_validation(candidates, event_gist,
+                                                                            pattern_gist_contents, date)
+            passed = [bool(reflection_result) and self._is_reflection_successful(reflection_result)
+                      for reflection_result in reflection_results]
+            get_tracer().event("reflection_pass", "reflection", date, sum(passed))
+            get_tracer().event("reflection_fail", "reflection", date, len(passed) - sum(passed))
+            for (plan, reason), ok in zip(candidates, passed):
+                if ok:
+                    return plan
+            current_plan, reflection_result = candidates[0][0], reflection_results[0]
             critique = reflection_result.get("reason") if reflection_result else "Reflection failed"
             try:
-                result = self._replan_activities(
+                result = yield from self._replan_activities(
                     recent_routine, history_routine, event_summary,
-                    current_plan, critique, day_type
+                    current_plan, critique, day_type, date, attempt * self.config.REPLAN_TRIAL
                 )
                 if result is None:
                     break
-                current_plan, replan_reason = result
+                candidates = result
             except Exception:
                 break
 
         return None
 
-    def _run_reflection_validation(self, plan, event_gist_content, pattern_gist_contents, reason):
-        """Execute reflection prompts on the plan and parse the returned JSON into a dict."""
+    def _run_reflection_validation(self, candidates, event_gist_content, pattern_gist_contents, date=None):
+        """Reflect on every (plan, reason) candidate at once; one parsed dict (or None) per candidate."""
+        action_prompts = [generate_prompt([plan, reason], self.config.ACTION_GIST_TEMPLATE)
+                          for plan, reason in candidates]
+        action_gists = yield from self._ask_all(action_prompts, "action_gist", date)
+        reflection_prompts = [generate_prompt([event_gist_content, pattern_gist_contents, action_gist_contents],
+                                              self.config.REFLECTION_TEMPLATE)
+                              for action_gist_contents in action_gists]
+        reflection_raws = yield from self._ask_all(reflection_prompts, "reflection", date)
+        return [self._parse_reflection(reflection_raw, date) for reflection_raw in reflection_raws]
+
+    def _parse_reflection(self, reflection_raw, date=None):
+        """Parse the reflection reply into a dict, or None when it holds no JSON object."""
         try:
-            curr_action_input = [plan, reason]
-            prompt_action_gist = generate_prompt(curr_action_input, self.config.ACTION_GIST_TEMPLATE)
-            action_gist_contents = execute_prompt(prompt_action_gist, objective=f"")
-            reflection_inputs = [event_gist_content, pattern_gist_contents, action_gist_contents]
-            reflection_prompt = generate_prompt(reflection_inputs, self.config.REFLECTION_TEMPLATE)
-            reflection_raw = execute_prompt(reflection_prompt, objective="")
-            s = reflection_raw.strip()
-            s = re.sub(r"```json", "", s)
-            s = s.replace("```", "")
-            m = re.search(r"(\{.*\})", s, flags=re.DOTALL)
-            if not m:
-                clean = s
-            else:
-                clean = m.group(1)
-            return json.loads(clean)
-        except json.JSONDecodeError:
+            reflection, recovered = parse_response(reflection_raw)
+        except ResponseParseError as error:
+            get_tracer().event("json_parse_failure", "reflection", date, rule=error.rule)
             return None
+        get_tracer().event("json_recovered", "reflection", date, int(recovered))
+        return reflection
 
     def _is_reflection_successful(self, reflection_result: Dict[str, Any]) -> bool:
         required_keys = {"coherence_with_pattern", "coherence_with_event", "reason"}
@@ -235,27 +458,18 @@ class DayPlanner:
 
     def _replan_activities(
             self, recent_routine: str, history_routine: str, event_summary: str,
-            current_plan: List[str], reason: str, day_type: str
-    ) -> Optional[List[str]]:
+            current_plan: List[str], reason: str, day_type: str, date: str = None, first_attempt: int = 0
+    ) -> Optional[List[tuple]]:
         gen_inputs = [history_routine, recent_routine, event_summary, day_type,
                       current_plan, reason]
         replan_prompt = generate_prompt(gen_inputs, self.config.REPLAN_TEMPLATE)
 
 
         for trial in range(self.config.REPLAN_TRIAL):
-            replan_raw = execute_prompt(replan_prompt, objective="")
-            if not replan_raw:
-                continue
-
-            try:
-                parsed_data = json.loads(replan_raw)
-                plan = parsed_data["plan"]
-                reason = parsed_data["reason"]
-                if valid_generation(plan):
-                    return plan, reason
-
-            except json.JSONDecodeError:
-                continue
+            # a later reflection round can give the same critique of the same plan, hence the same prompt
+            candidates = yield from self._ask_candidates(replan_prompt, "replan", date, first_attempt + trial)
+            if candidates:
+                return candidates
 
         return None
 
@@ -277,9 +491,11 @@ class DayPlanner:
 
         world_interaction["results"][date] = new
         world_interaction["reals"][date] = test_route
+        get_tracer().event("fallback", date=date)
         
     def _save_successful_plan(self, plan, date, test_route, world_interaction):
         world_interaction["reals"][date] = test_route
+        get_tracer().event("plan_saved", date=date)
 
         clean_plan = [item for item in plan if "Home at" not in item]
 
@@ -0,0 +1,286 @@
+import re
+from datetime import date as calendar_date
+from bisect import bisect_left
+from functools import lru_cache
+
+# category names are interned once per process; visits refer to them by index
+CATEGORY_NAMES = []
+_CATEGORY_IDS = {}
+
+_DAY_PATTERN = re.compile(r"Activities at (\d{4}-\d{2}-\d{2}): ")
+_ROUTINE_DATE_PATTERN = re.compile(r"Activities at (\d{4}-\d{2}-\d{2})")
+# only text that format() writes back verbatim: no leading blank, no '#007', minutes and seconds below 60
+_VISIT_PATTERN = re.compile(r"([^#\s][^#]*?)( ?)#(0|[1-9]\d*) at (\d{1,2}):([0-5]\d)(?::([0-5]\d))?")
+# the lenient pattern Evaluation.parse_activities has always used
+_ACTIVITY_PATTERN = re.compile(r'(?:^|,)\s*(.+? at \d{1,2}:\d{2}(?::\d{2})?\.?)')
+# every time of day in a text, which is what Evaluation has always measured SI on
+_TIME_PATTERN = re.compile(r"(\d{1,2}):(\d{2})(?::(\d{2}))?")
+
+SHOW_SECONDS = 1
+PAD_HOUR = 2
+SPACE_BEFORE_HASH = 4
+
+
+def intern_category(name):
+    category = _CATEGORY_IDS.get(name)
+    if category is None:
+        category = _CATEGORY_IDS[name] = len(CATEGORY_NAMES)
+        CATEGORY_NAMES.append(name)
+    return category
+
+
+class Visit:
+    """One check-in: interned category, POI number and time of day in seconds.
+
+    `style` remembers how the time and the '#' were written (SHOW_SECONDS, PAD_HOUR,
+    SPACE_BEFORE_HASH), so format() gives back the text the visit was parsed from.
+    """
+    __slots__ = ("category", "poi", "seconds", "style")
+
+    def __init__(self, category, poi, seconds, style=SHOW_SECONDS | PAD_HOUR | SPACE_BEFORE_HASH):
+        self.category = category
+        self.poi = poi
+        self.seconds = seconds
+        self.style = style
+
+    @classmethod
+    def parse(cls, text):
+        """Parse 'Cafe #3 at 08:00:00' (or '8:00', 'Cafe#3 ...'); None if the text is not a visit."""
+        match = _VISIT_PATTERN.fullmatch(text)
+        if match is None:
+            return None
+        name, space, poi, hour, minute, second = match.groups()
+        style = (SHOW_SECONDS if second is not None else 0) | (PAD_HOUR if len(hour) == 2 else 0) \
+            | (SPACE_BEFORE_HASH if space else 0)
+        seconds = int(hour) * 3600 + int(minute) * 60 + int(second or 0)
+        return cls(intern_category(name), int(poi), seconds, style)
+
+    @property
+    def category_name(self):
+        return CATEGORY_NAMES[self.category]
+
+    @property
+    def minutes(self):
+        return self.seconds // 60
+
+    @property
+    def location(self):
+        """The POI as the location maps name it, e.g. 'Cafe #3'."""
+        return f"{CATEGORY_NAMES[self.category]}{' ' if self.style & SPACE_BEFORE_HASH else ''}#{self.poi}"
+
+    def format_time(self):
+        hour, rest = divmod(self.seconds, 3600)
+        minute, second = divmod(rest, 60)
+        text = f"{hour:02d}:{minute:02d}" if self.style & PAD_HOUR else f"{hour}:{minute:02d}"
+        return f"{text}:{second:02d}" if self.style & SHOW_SECONDS else text
+
+    def format(self):
+        return f"{self.location} at {self.format_time()}"
+
+    def __repr__(self):
+        return f"Visit({self.format()!r})"
+
+
+class LooseVisit(Visit):
+    """A visit of free-form text that Visit.parse rejects ('Home at 08:00', 'Cafe #007 at 8:00'),
+    read the way Evaluation always read it: the category is the activity up to its '#' (or the
+    whole activity), the location the activity up to ' at '. A time of day that ends no activity
+    is a LooseVisit with an empty category and location, so that it only counts for SI.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, category, seconds, name):
+        super().__init__(category, None, seconds)
+        self.name = name
+
+    @property
+    def location(self):
+        return self.name
+
+    def format(self):
+        return f"{self.name} at {self.format_time()}"
+
+
+class DayTrajectory:
+    """One 'Activities at YYYY-MM-DD: ...' line: date ordinal, visits and the closing period.
+
+    Text that the typed fields cannot reproduce exactly (free-form LLM output, odd
+    separators) keeps its original text in `raw`, which format() then returns, and its
+    visits are extracted the lenient way Evaluation always parsed activities (see _lenient_visits).
+    """
+    __slots__ = ("ordinal", "visits", "period", "raw")
+
+    def __init__(self, ordinal, visits=None, period=False, raw=None):
+        self.ordinal = ordinal
+        self.visits = visits if visits is not None else []
+        self.period = period
+        self.raw = raw
+
+    @classmethod
+    def parse(cls, text):
+        match = _DAY_PATTERN.match(text)
+        ordinal = None
+        if match is not None:
+            try:
+                ordinal = calendar_date.fromisoformat(match.group(1)).toordinal()
+            except ValueError:
+                ordinal = None
+        if ordinal is None:
+            # like Evaluation always did, the activities are what follows the first ': '
+            return cls(None, _lenient_visits(text, text.partition(": ")[2] if ": " in text else text), False, text)
+        body = text[match.end():]
+        period = body.endswith('.')
+        items = body[:-1] if period else body
+        visits = [Visit.parse(item) for item in items.split(", ")] if items else []
+        if None in visits:
+            return cls(ordinal, _lenient_visits(text, body), period, text)
+        return cls(ordinal, visits, period)
+
+    @property
+    def date(self):
+        return None if self.ordinal is None else calendar_date.fromordinal(self.ordinal).isoformat()
+
+    def format(self):
+        if self.raw is not None:
+            return self.raw
+        text = f"Activities at {self.date}: " + ", ".join(visit.format() for visit in self.visits)
+        return text + "." if self.period else text
+
+    __str__ = format
+
+    def __repr__(self):
+        return f"DayTrajectory({self.format()!r})"
+
+
+def _lenient_visits(text, body):
+    """The visits of free-form `text` (whose activities are `body`, a suffix of it), as Evaluation
+    always read them: one per time of day in `text`, in order. A time that ends an activity found by
+    the activity pattern is that activity's visit, a LooseVisit when Visit.parse rejects it; any other
+    time is a LooseVisit that only SI counts."""
+    start = len(text) - len(body)
+    activities = {}
+    for match in _ACTIVITY_PATTERN.finditer(body):
+        activity = match.group(1)
+        if activity.endswith('.'):
+            activity = activity[:-1]
+        activities[start + match.start(1) + len(activity)] = activity
+    visits = []
+    for match in _TIME_PATTERN.finditer(text):
+        hour, minute, second = match.groups()
+        seconds = int(hour) * 3600 + int(minute) * 60 + int(second or 0)
+        activity = activities.get(match.end())
+        if activity is None:
+            visits.append(LooseVisit(intern_category(""), seconds, ""))
+            continue
+        visit = Visit.parse(activity)
+        if visit is None:
+            visit = LooseVisit(intern_category(activity.split('#')[0] if '#' in activity else activity), seconds,
+                               activity.rsplit(" at ", 1)[0])
+        visits.append(visit)
+    return visits
+
+
+def as_day(trajectory):
+    """A DayTrajectory for either a DayTrajectory or its text."""
+    return trajectory if isinstance(trajectory, DayTrajectory) else DayTrajectory.parse(trajectory)
+
+
+@lru_cache(maxsize=1 << 16)
+def routine_ordinal(routine):
+    """Date ordinal of an 'Activities at YYYY-MM-DD: ...' routine (or of a bare 'YYYY-MM-DD'),
+    parsed once per distinct text; None when there is no valid date."""
+    match = _ROUTINE_DATE_PATTERN.search(routine)
+    try:
+        return calendar_date.fromisoformat(match.group(1) if match else routine).toordinal()
+    except ValueError:
+        return None
+
+
+def routine_date(routine):
+    """ISO date of a routine from the cached routine_ordinal; None when there is no valid date."""
+    ordinal = routine_ordinal(routine)
+    return None if ordinal is None else calendar_date.fromordinal(ordinal).isoformat()
+
+
+class RoutineList(list):
+    """A list of routines that also keeps them indexed by date.
+
+    It is still the plain list, in the order the routines were added (prompts and the
+    pattern-gist store see exactly that), but next to it the positions are kept sorted by
+    date ordinal, newest-last, with routines of the same day in reverse insertion order.
+    append() keeps the index sorted with one bisect; other in-place changes drop the index
+    and it is rebuilt on the next lookup. Routines without a readable date are not indexed.
+    """
+    def __init__(self, routines=()):
+        super().__init__(routines)
+        self._ordinals = None
+        self._positions = None
+
+    def _index(self):
+        if self._ordinals is None:
+            dated = [(ordinal, -position) for position, ordinal in enumerate(map(routine_ordinal, self))
+                     if ordinal is not None]
+            dated.sort()
+            self._ordinals = [ordinal for ordinal, position in dated]
+            self._positions = [-position for ordinal, position in dated]
+        return self._ordinals, self._positions
+
+    def _invalidate(self):
+        self._ordinals = self._positions = None
+
+    def append(self, routine):
+        super().append(routine)
+        if self._ordinals is None:
+            return
+        ordinal = routine_ordinal(routine)
+        if ordinal is None:
+            return
+        # before any routine of the same day, so ties stay newest-position-first
+        i = bisect_left(self._ordinals, ordinal)
+        self._ordinals.insert(i, ordinal)
+        self._positions.insert(i, len(self) - 1)
+
+    def extend(self, routines):
+        for routine in routines:
+            self.append(routine)
+
+    def __iadd__(self, routines):
+        self.extend(routines)
+        return self
+
+    def _positions_before(self, date):
+        ordinal = date if isinstance(date, int) else routine_ordinal(date)
+        ordinals, positions = self._index()
+        return positions[:bisect_left(ordinals, ordinal)]
+
+    def recent(self, date, num_days):
+        """The `num_days` newest routines dated before `date` (ISO date or ordinal), newest first;
+        routines of the same day keep the order they were added in."""
+        positions = self._positions_before(date)
+        return [self[position] for position in reversed(positions[max(0, len(positions) - num_days):])]
+
+    def older(self, date, num_days):
+        """Every routine dated before `date` except the `num_days` newest ones, newest first."""
+        positions = self._positions_before(date)
+        return [self[position] for position in reversed(positions[:max(0, len(positions) - num_days)])]
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (list(self),)
+
+
+def _dropping_index(method):
+    def mutate(self, *args, **kwargs):
+        self._invalidate()
+        return method(self, *args, **kwargs)
+    mutate.__name__ = method.__name__
+    return mutate
+
+
+for _name in ("__setitem__", "__delitem__", "__imul__", "insert", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(RoutineList, _name, _dropping_index(getattr(list, _name)))
+del _name
+
+
+def as_routine_list(routines):
+    """`routines` itself if it is already a RoutineList, otherwise an indexed copy."""
+    return routines if isinstance(routines, RoutineList) else RoutineList(routines)
@@ -0,0 +1,61 @@
+import random
+import pytest
+from datetime import date, timedelta
+from simulator.traj_generator import *
+from simulator.batch_runner import *
+from simulator.person_anonymized import *
+
+LOCATIONS = ["Cafe", "Supermarket", "Park", "Train Station", "Ramen Restaurant", "Bookstore"]
+DATES = [f"2020-04-{day:02d}" for day in range(7, 11)]
+
+
+def make_person(index, train_days=12):
+    rng = random.Random(index)
+    favourites = [f"{rng.choice(LOCATIONS)} #{rng.randint(1, 40)}" for _ in range(4)]
+    start = date(2020, 4, 7) - timedelta(days=train_days)
+
+    def day(d):
+        times = sorted(rng.sample(range(6 * 6, 23 * 6), rng.randint(1, 4)))
+        visits = [f"{rng.choice(favourites)} at {t // 6:02d}:{t % 6 * 10:02d}:00" for t in times]
+        return f"Activities at {d.isoformat()}: " + ', '.join(visits) + '.'
+
+    P = Person(f"user_{index}")
+    P.train_routine_list = [day(start + timedelta(days=i)) for i in range(train_days)]
+    P.test_routine_list = [day(date(2020, 4, 7) + timedelta(days=i)) for i in range(len(DATES))]
+    return P
+
+
+def make_planner(tmp_path, candidates):
+    locations_path = tmp_path / "subcategories.csv"
+    locations_path.write_text("sub_category\n" + "\n".join(LOCATIONS) + "\n", encoding="utf-8")
+
+    class Config(DayPlannerConfig):
+        EVENT_REGISTRY_PATH = None
+        PATTERN_GIST_STORE_PATH = None
+        LOCATIONS_PATH = str(locations_path)
+        GENERATION_CANDIDATES = candidates
+
+    return DayPlanner(Config())
+
+
+def stub_backend():
+    # malformed replies and failed reflections make users replan, so their days take different numbers of rounds
+    return StubBackend(reflection_pass_rate=0.3, malformed_rate=0.2)
+
+
+@pytest.mark.parametrize("candidates", [1, 3])
+def test_batch_runner_matches_interactive_planner(tmp_path, candidates):
+    set_llm_backend(stub_backend())
+    planner = make_planner(tmp_path, candidates)
+    planner.prepare_events(DATES)
+    interactive = {P.name: planner.plan_new_day(P) for P in (make_person(i) for i in range(4))}
+
+    responder = stub_backend().respond
+    planner = make_planner(tmp_path, candidates)
+    runner = BatchRunner(LocalBatchBackend(responder), work_dir=str(tmp_path / "batches"))
+    runner.run_steps({"events": planner.prepare_events_steps(DATES)})
+    batched = runner.run(planner, [make_person(i) for i in range(4)])
+
+    assert runner.failed == {}
+    assert runner.rounds > 1
+    assert batched == interactive
@@ -0,0 +1,18 @@
+from simulator.llm_cache import *
+
+MESSAGES = [{"role": "user", "content": "Plan my day."}]
+
+
+def test_unset_options_keep_the_old_key():
+    key = LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1)
+    assert LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, None, 1, None, 0) == key
+
+
+def test_every_set_option_changes_the_key():
+    keys = {LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1),
+            LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, max_tokens=1),
+            LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, max_tokens=500),
+            LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, n=3),
+            LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, response_format={"type": "json_object"}),
+            LLMCache.make_key("gpt-4o-mini", MESSAGES, 0.1, attempt=1)}
+    assert len(keys) == 6
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from evaluation import *
+
+LON_RANGE = (139.50, 139.90)
+LAT_RANGE = (35.50, 35.82)
+
+
+def loop_step_distances(evaluator, point_seqs):
+    """The per-point loop calc_distance_one_step_jsd used before NumPy."""
+    return [evaluator.geodistance(lnglat[0], lnglat[1], traj[index][0], traj[index][1])
+            for traj in point_seqs for index, lnglat in enumerate(traj[1:])]
+
+
+def loop_grid_counts(points, grid_count=100, lon_range=LON_RANGE, lat_range=LAT_RANGE):
+    """The per-point loop calc_sg_act_jsd used before NumPy."""
+    grid_side = int(np.sqrt(grid_count))
+    counts = np.zeros(grid_count + 1, dtype=int)
+    for lon, lat in points:
+        if lon_range[0] <= lon <= lon_range[1] and lat_range[0] <= lat <= lat_range[1]:
+            gx = min(int((lon - lon_range[0]) / (lon_range[1] - lon_range[0]) * grid_side), grid_side - 1)
+            gy = min(int((lat - lat_range[0]) / (lat_range[1] - lat_range[0]) * grid_side), grid_side - 1)
+            counts[gy * grid_side + gx] += 1
+        else:
+            counts[grid_count] += 1
+    return counts
+
+
+def random_points(rng, count):
+    # partly off the grid, plus the corners and edges of the grid itself
+    points = np.column_stack([rng.uniform(139.45, 139.95, count), rng.uniform(35.45, 35.87, count)]).tolist()
+    return points + [[LON_RANGE[0], LAT_RANGE[0]], [LON_RANGE[1], LAT_RANGE[1]], [LON_RANGE[1], 35.6],
+                     [139.7, LAT_RANGE[1]]]
+
+
+def random_trajectories(rng, locations, count):
+    names = sorted(locations) + ["Nowhere #1"]
+    trajs = []
+    for index in range(count):
+        visits = [f"{names[rng.integers(len(names))]} at {hour:02d}:00"
+                  for hour in sorted(rng.choice(24, rng.integers(0, 6), replace=False))]
+        trajs.append(f"Activities at 2020-04-{index % 28 + 1:02d}: " + ", ".join(visits))
+    return trajs
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_step_distances_match_scalar_loop(rng):
+    evaluator = Evaluation({})
+    points = random_points(rng, 2000)
+    lengths = rng.integers(0, 7, size=600)
+    seqs = [points[start:end] for start, end in zip(np.cumsum(lengths) - lengths, np.cumsum(lengths))]
+    np.testing.assert_allclose(evaluator.step_distances(seqs), loop_step_distances(evaluator, seqs), rtol=0, atol=1e-9)
+    assert len(evaluator.step_distances([[], points[:1]])) == 0
+
+
+def test_grid_counts_match_scalar_loop(rng):
+    evaluator = Evaluation({})
+    points = random_points(rng, 5000)
+    for grid_count in (100, 400):
+        assert evaluator.grid_counts(points, grid_count).tolist() == loop_grid_counts(points, grid_count).tolist()
+
+
+def test_sd_and_sgd_match_scalar_computation(rng):
+    locations = {f"Cafe #{index}": tuple(point) for index, point in enumerate(random_points(rng, 300))}
+    evaluator = Evaluation(locations)
+    generated, real = random_trajectories(rng, locations, 400), random_trajectories(rng, locations, 400)
+
+    def loop_sd(trajs):
+        distances = loop_step_distances(evaluator, [evaluator.extract_lnglat_seq(traj) for traj in trajs])
+        return evaluator.arr_to_distribution(np.array(distances), 0, 100, 200)[0]
+
+    expected = evaluator.get_js_divergence(loop_sd(real), loop_sd(generated))
+    assert evaluator.calc_distance_one_step_jsd(real, generated) == pytest.approx(expected, abs=1e-12)
+
+    def loop_sgd(trajs):
+        return loop_grid_counts([point for traj in trajs for point in evaluator.extract_lnglat_seq(traj)])[:100]
+
+    p1, p2 = loop_sgd(generated), loop_sgd(real)
+    top25 = np.argsort(p2)[-25:][::-1]
+    expected = evaluator.get_js_divergence(p1[top25], p2[top25])
+    assert evaluator.calc_sg_act_jsd(generated, real) == pytest.approx(expected, abs=1e-12)
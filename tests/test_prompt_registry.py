@@ -0,0 +1,17 @@
+import os
+from simulator.prompt_registry import *
+
+
+def test_templates_render_like_legacy():
+    assert verify_against_legacy() == []
+
+
+def test_config_paths_resolve_outside_repository(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    registry = PromptRegistry()
+    templates = list(registry)
+    assert templates
+    for path, template in templates:
+        relative = os.path.join(".", "simulator", "prompt_template", os.path.basename(path))
+        assert registry.get(relative) is template
+        assert registry.get(path) is template
@@ -0,0 +1,53 @@
+import random
+import pytest
+from datetime import date, timedelta
+from simulator.trajectory import *
+
+
+def scan_routines(date_, routines, num_days=3):
+    """The recent and long routines the way they were found before RoutineList: a linear scan and a sort."""
+    current = date.fromisoformat(date_).toordinal()
+    routines_with_diff = []
+    for routine in routines:
+        days_diff = current - date.fromisoformat(routine.split(": ")[0].split(" ")[-1]).toordinal()
+        if days_diff > 0:
+            routines_with_diff.append((routine, days_diff))
+    routines_with_diff.sort(key=lambda x: x[1])
+    recent = [route[0] for route in routines_with_diff[:num_days]]
+    return recent, [route[0] for route in routines_with_diff[num_days:]]
+
+
+def random_routine(rng, index):
+    day = date(2020, 3, 1) + timedelta(days=rng.randint(0, 60))
+    return f"Activities at {day.isoformat()}: Cafe #{index} at {rng.randint(6, 22):02d}:00:00."
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lookups_match_linear_scan(seed):
+    # routines out of date order and several on the same day, as appended by resumed or replanned runs
+    rng = random.Random(seed)
+    routines = RoutineList(random_routine(rng, index) for index in range(40))
+    expected = list(routines)
+    for step in range(60):
+        date_ = (date(2020, 3, 1) + timedelta(days=rng.randint(0, 70))).isoformat()
+        num_days = rng.randint(0, 5)
+        assert (routines.recent(date_, num_days), routines.older(date_, num_days)) == \
+            scan_routines(date_, expected, num_days)
+        routine = random_routine(rng, 100 + step)
+        if step % 10 == 9:
+            # in-place changes other than append drop the index
+            routines.insert(rng.randint(0, len(routines)), routine)
+            del routines[rng.randrange(len(routines))]
+            expected = list(routines)
+        else:
+            routines.append(routine)
+            expected.append(routine)
+        assert list(routines) == expected
+
+
+def test_routines_without_a_date_are_not_indexed():
+    routines = RoutineList(["Activities at 2020-04-01: Cafe #1 at 08:00:00.", "no date here",
+                            "Activities at 2020-04-03: Park #2 at 10:00:00."])
+    assert routines.recent("2020-04-05", 3) == ["Activities at 2020-04-03: Park #2 at 10:00:00.",
+                                                "Activities at 2020-04-01: Cafe #1 at 08:00:00."]
+    assert routines.older("2020-04-05", 1) == ["Activities at 2020-04-01: Cafe #1 at 08:00:00."]